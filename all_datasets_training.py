@@ -1,13 +1,17 @@
 import os
+import time
 
-from keras import backend as K
 from keras.layers import Conv1D, BatchNormalization, GlobalAveragePooling1D, Permute, Dropout, Flatten
 from keras.layers import Input, Dense, LSTM, CuDNNLSTM, concatenate, Activation, GRU, SimpleRNN
 from keras.models import Model
 
 from utils.constants import MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
-from utils.keras_utils import train_model, evaluate_model
+from utils.generic_utils import load_dataset_at
+from utils.keras_utils import train_model, evaluate_model, build_cell_ensemble, ensemble_members
 from utils.layer_utils import AttentionLSTM
+from utils.registry_utils import load_registry
+from utils.sweep_utils import run_jobs, reset_session, JobLedger, remove_incomplete_weights, \
+    order_jobs_by_cost, estimate_makespan, SweepProgress
 
 
 def generate_lstmfcn(MAX_SEQUENCE_LENGTH, NB_CLASS, NUM_CELLS=8):
@@ -80,137 +84,146 @@ def generate_alstmfcn(MAX_SEQUENCE_LENGTH, NB_CLASS, NUM_CELLS=8):
     return model
 
 
+def train_and_evaluate(model_name, model_fn, cell, dname, did, dataset_name_, normalize_dataset,
+                       ledger_path=None, stopping_patience=None, val_frequency=1, checkpoint_interval=None):
+    """
+    Trains and evaluates a single (model, cell, dataset) combination.
+
+    Args:
+        model_name: Name of the model.
+        model_fn: Function which builds the Keras Model.
+        cell: Number of LSTM / Attention LSTM cells.
+        dname: Name of the dataset.
+        did: Integer id of the dataset set inside `utils/constants.py`.
+        dataset_name_: Prefix of the weight file of the model.
+        normalize_dataset: Normalization scheme of the dataset.
+        ledger_path: Optional path to the `JobLedger` of the sweep, in which
+            the start of this job is recorded.
+        stopping_patience: Optional number of epochs without improvement of
+            the training loss at the learning rate floor, after which
+            training stops early. If None, training runs for all epochs.
+        val_frequency: Number of epochs between two evaluations of the test
+            set during training. 0 never evaluates it during training.
+        checkpoint_interval: Optional minimum number of seconds between two
+            writes of the best weights, which are then written by a background
+            thread. If None, they are written every time the loss improves.
+
+    Returns:
+        The line to be written to the log file of this model and cell.
+    """
+    if did >= len(MAX_SEQUENCE_LENGTH_LIST):
+        # datasets discovered by the registry of the main process must also
+        # be registered inside this worker
+        load_registry(verbose=False)
+
+    MAX_SEQUENCE_LENGTH = MAX_SEQUENCE_LENGTH_LIST[did]
+    NB_CLASS = NB_CLASSES_LIST[did]
+
+    if ledger_path is not None:
+        JobLedger(ledger_path).mark_started(JobLedger.job_key(model_name, cell, dname))
+
+    # release GPU Memory
+    reset_session()
+
+    model = model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, cell)
+
+    print('*' * 20, "Training %s model for dataset %s" % (model_name, dname), '*' * 20)
+
+    # comment out the training code to only evaluate !
+    train_model(model, did, dataset_name_, epochs=2000, batch_size=128,
+                normalize_timeseries=normalize_dataset, stopping_patience=stopping_patience,
+                val_frequency=val_frequency, checkpoint_interval=checkpoint_interval)
+
+    acc = evaluate_model(model, did, dataset_name_, batch_size=128,
+                         normalize_timeseries=normalize_dataset)
+
+    return "%d,%s,%s,%0.6f\n" % (did, dname, dataset_name_, acc)
+
+
+def train_and_evaluate_ensemble(model_name, model_fn, cells, dname, did, dataset_names_, normalize_dataset,
+                                ledger_path=None, stopping_patience=None, val_frequency=1, checkpoint_interval=None):
+    """
+    Trains and evaluates several cell variants of a (model, dataset)
+    combination at once, as the members of a single cell ensemble. The
+    weights of each variant are saved to the same path as if it had been
+    trained on its own by `train_and_evaluate`.
+
+    Args:
+        model_name: Name of the model.
+        model_fn: Function which builds the Keras Model.
+        cells: List of the numbers of LSTM / Attention LSTM cells of the variants.
+        dname: Name of the dataset.
+        did: Integer id of the dataset set inside `utils/constants.py`.
+        dataset_names_: List of the prefixes of the weight files of the variants.
+        normalize_dataset: Normalization scheme of the dataset.
+        ledger_path: Optional path to the `JobLedger` of the sweep, in which
+            the start of the job of every variant is recorded.
+        stopping_patience: See `train_and_evaluate`. Training stops once
+            the sum of the losses of the variants stops improving.
+        val_frequency: See `train_and_evaluate`.
+        checkpoint_interval: See `train_and_evaluate`.
+
+    Returns:
+        The list of lines to be written to the log file of each variant.
+    """
+    if did >= len(MAX_SEQUENCE_LENGTH_LIST):
+        load_registry(verbose=False)
+
+    MAX_SEQUENCE_LENGTH = MAX_SEQUENCE_LENGTH_LIST[did]
+    NB_CLASS = NB_CLASSES_LIST[did]
+
+    if ledger_path is not None:
+        ledger = JobLedger(ledger_path)
+        for cell in cells:
+            ledger.mark_started(JobLedger.job_key(model_name, cell, dname))
+
+    # release GPU Memory
+    reset_session()
+
+    models = [model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, cell) for cell in cells]
+    model = build_cell_ensemble(models, names=['%s_%d_cells' % (model_name, cell) for cell in cells])
+
+    print('*' * 20, "Training %s model ensemble of %s cells for dataset %s" %
+          (model_name, ', '.join(str(cell) for cell in cells), dname), '*' * 20)
+
+    dataset = load_dataset_at(did, normalize_timeseries=normalize_dataset)
+
+    train_model(model, did, list(dataset_names_), epochs=2000, batch_size=128, dataset=dataset,
+                stopping_patience=stopping_patience, val_frequency=val_frequency,
+                checkpoint_interval=checkpoint_interval)
+
+    lines = []
+    for member, dataset_name_ in zip(ensemble_members(model), dataset_names_):
+        acc = evaluate_model(member, did, dataset_name_, batch_size=128, dataset=dataset)
+        lines.append("%d,%s,%s,%0.6f\n" % (did, dname, dataset_name_, acc))
+
+    return lines
+
+
+def group_cell_jobs(jobs):
+    """
+    Groups the jobs of the same model and dataset into a single job training
+    all their cell variants, to be run by `train_and_evaluate_ensemble`.
+    """
+    groups = {}
+    for job in jobs:
+        MODEL_NAME, model_fn, cell, dname, did, dataset_name_ = job[:6]
+        group = groups.setdefault((MODEL_NAME, dname), [MODEL_NAME, model_fn, (), dname, did, (), job[6:]])
+
+        group[2] += (cell,)
+        group[5] += (dataset_name_,)
+
+    return [tuple(group[:6]) + group[6] for group in groups.values()]
+
+
 if __name__ == "__main__":
 
-    dataset_map = [('Adiac', 0),
-                   ('ArrowHead', 1),
-                   ('ChlorineConcentration', 2),
-                   ('InsectWingbeatSound', 3),
-                   ('Lighting7', 4),
-                   ('Wine', 5),
-                   ('WordsSynonyms', 6),
-                   ('50words', 7),
-                   ('Beef', 8),
-                   ('DistalPhalanxOutlineAgeGroup', 9),
-                   ('DistalPhalanxOutlineCorrect', 10),
-                   ('DistalPhalanxTW', 11),
-                   ('ECG200', 12),
-                   ('ECGFiveDays', 13),
-                   ('BeetleFly', 14),
-                   ('BirdChicken', 15),
-                   ('ItalyPowerDemand', 16),
-                   ('SonyAIBORobotSurface', 17),
-                   ('SonyAIBORobotSurfaceII', 18),
-                   ('MiddlePhalanxOutlineAgeGroup', 19),
-                   ('MiddlePhalanxOutlineCorrect', 20),
-                   ('MiddlePhalanxTW', 21),
-                   ('ProximalPhalanxOutlineAgeGroup', 22),
-                   ('ProximalPhalanxOutlineCorrect', 23),
-                   ('ProximalPhalanxTW', 24),
-                   ('MoteStrain', 25),
-                   ('MedicalImages', 26),
-                   ('Strawberry', 27),
-                   ('ToeSegmentation1', 28),
-                   ('Coffee', 29),
-                   ('Cricket_X', 30),
-                   ('Cricket_Y', 31),
-                   ('Cricket_Z', 32),
-                   ('uWaveGestureLibrary_X', 33),
-                   ('uWaveGestureLibrary_Y', 34),
-                   ('uWaveGestureLibrary_Z', 35),
-                   ('ToeSegmentation2', 36),
-                   ('DiatomSizeReduction', 37),
-                   ('car', 38),
-                   ('CBF', 39),
-                   ('CinC_ECG_torso', 40),
-                   ('Computers', 41),
-                   ('Earthquakes', 42),
-                   ('ECG5000', 43),
-                   ('ElectricDevices', 44),
-                   ('FaceAll', 45),
-                   ('FaceFour', 46),
-                   ('FacesUCR', 47),
-                   ('Fish', 48),
-                   ('FordA', 49),
-                   ('FordB', 50),
-                   ('Gun_Point', 51),
-                   ('Ham', 52),
-                   ('HandOutlines', 53),
-                   ('Haptics', 54),
-                   ('Herring', 55),
-                   ('InlineSkate', 56),
-                   ('LargeKitchenAppliances', 57),
-                   ('Lighting2', 58),
-                   ('MALLAT', 59),
-                   ('Meat', 60),
-                   ('NonInvasiveFatalECG_Thorax1', 61),
-                   ('NonInvasiveFatalECG_Thorax2', 62),
-                   ('OliveOil', 63),
-                   ('OSULeaf', 64),
-                   ('PhalangesOutlinesCorrect', 65),
-                   ('Phoneme', 66),
-                   ('plane', 67),
-                   ('RefrigerationDevices', 68),
-                   ('ScreenType', 69),
-                   ('ShapeletSim', 70),
-                   ('ShapesAll', 71),
-                   ('SmallKitchenAppliances', 72),
-                   ('StarlightCurves', 73),
-                   ('SwedishLeaf', 74),
-                   ('Symbols', 75),
-                   ('synthetic_control', 76),
-                   ('Trace', 77),
-                   ('Patterns', 78),
-                   ('TwoLeadECG', 79),
-                   ('UWaveGestureLibraryAll', 80),
-                   ('wafer', 81),
-                   ('Worms', 82),
-                   ('WormsTwoClass', 83),
-                   ('yoga', 84),
-                   ('ACSF1', 85),
-                   ('AllGestureWiimoteX', 86),
-                   ('AllGestureWiimoteY', 87),
-                   ('AllGestureWiimoteZ', 88),
-                   ('BME', 89),
-                   ('Chinatown', 90),
-                   ('Crop', 91),
-                   ('DodgerLoopDay', 92),
-                   ('DodgerLoopGame', 93),
-                   ('DodgerLoopWeekend', 94),
-                   ('EOGHorizontalSignal', 95),
-                   ('EOGVerticalSignal', 96),
-                   ('EthanolLevel', 97),
-                   ('FreezerRegularTrain', 98),
-                   ('FreezerSmallTrain', 99),
-                   ('Fungi', 100),
-                   ('GestureMidAirD1', 101),
-                   ('GestureMidAirD2', 102),
-                   ('GestureMidAirD3', 103),
-                   ('GesturePebbleZ1', 104),
-                   ('GesturePebbleZ2', 105),
-                   ('GunPointAgeSpan', 106),
-                   ('GunPointMaleVersusFemale', 107),
-                   ('GunPointOldVersusYoung', 108),
-                   ('HouseTwenty', 109),
-                   ('InsectEPGRegularTrain', 110),
-                   ('InsectEPGSmallTrain', 111),
-                   ('MelbournePedestrian', 112),
-                   ('MixedShapesRegularTrain', 113),
-                   ('MixedShapesSmallTrain', 114),
-                   ('PickupGestureWiimoteZ', 115),
-                   ('PigAirwayPressure', 116),
-                   ('PigArtPressure', 117),
-                   ('PigCVP', 118),
-                   ('PLAID', 119),
-                   ('PowerCons', 120),
-                   ('Rock', 121),
-                   ('SemgHandGenderCh2', 122),
-                   ('SemgHandMovementCh2', 123),
-                   ('SemgHandSubjectCh2', 124),
-                   ('ShakeGestureWiimoteZ', 125),
-                   ('SmoothSubspace', 126),
-                   ('UMD', 127)
-                   ]
+    registry = load_registry()
+
+    # (dataset name, id) of every dataset whose files are present in the data
+    # directory. Use `registry.dataset_map(names=[...])` to only select some
+    # of them, or `max_train_samples` to skip the largest ones.
+    dataset_map = registry.dataset_map()
 
     print("Num datasets : ", len(dataset_map))
     print()
@@ -232,72 +245,153 @@ if __name__ == "__main__":
     # Normalize = 2 means dataset normalization.
     normalize_dataset = True
 
+    # Number of worker processes training models in parallel.
+    # 1 trains all models one at a time inside this process.
+    NUM_WORKERS = 1
+
+    # Number of CPU threads each worker may use, for TensorFlow and OpenMP / MKL.
+    # None splits the cores of the host evenly between the workers.
+    # Use `benchmark_threads` from `utils/runtime_utils.py` to find the best
+    # split for the size of the datasets.
+    THREADS_PER_WORKER = None
+
+    # Whether to pin each worker to its own block of THREADS_PER_WORKER CPUs.
+    PIN_CPUS = False
+
+    # Ledger of finished jobs. Re-running the script skips every job recorded
+    # as finished in it, so an interrupted sweep only runs the missing work.
+    LEDGER_PATH = 'all_datasets_training_ledger.jsonl'
+
+    # Number of epochs without improvement of the training loss, once the
+    # learning rate has reached its floor, after which training stops early.
+    # None always trains for the full number of epochs.
+    STOPPING_PATIENCE = None
+
+    # Number of epochs between two evaluations of the test set during training.
+    # 1 evaluates it after every epoch, 0 never evaluates it during training.
+    VAL_FREQUENCY = 1
+
+    # Minimum number of seconds between two writes of the best weights, which
+    # are then kept in memory and written by a background thread.
+    # None writes them every time the training loss improves.
+    CHECKPOINT_INTERVAL = None
+
+    # Whether to train all the CELLS variants of a model on a dataset at once,
+    # as independent sub-networks of a single graph fed by the same batches.
+    # Each variant still gets its own weight file and log line, but the
+    # learning rate schedule and the plateau stopping follow the sum of the
+    # losses of all variants, so the results differ from separate runs.
+    CELL_ENSEMBLE = False
+
+    ledger = JobLedger(LEDGER_PATH)
+
+    jobs = []
+    successes = {}
+    failures = {}
+
     for model_id, (MODEL_NAME, model_fn) in enumerate(MODELS):
         for cell in CELLS:
-            successes = []
-            failures = []
+            successes[(MODEL_NAME, cell)] = []
+            failures[(MODEL_NAME, cell)] = []
 
             if not os.path.exists(base_log_name % (MODEL_NAME, cell)):
                 file = open(base_log_name % (MODEL_NAME, cell), 'w')
                 file.write('%s,%s,%s,%s\n' % ('dataset_id', 'dataset_name', 'dataset_name_', 'test_accuracy'))
                 file.close()
 
+            weights_dir = base_weights_dir % (MODEL_NAME, cell)
+
+            if not os.path.exists('weights/' + weights_dir):
+                os.makedirs('weights/' + weights_dir)
+
             for dname, did in dataset_map:
+                dataset_name_ = weights_dir + dname
 
-                MAX_SEQUENCE_LENGTH = MAX_SEQUENCE_LENGTH_LIST[did]
-                NB_CLASS = NB_CLASSES_LIST[did]
+                job_key = JobLedger.job_key(MODEL_NAME, cell, dname)
+                weights_path = './weights/%s_weights.h5' % dataset_name_
 
-                # release GPU Memory
-                K.clear_session()
+                if ledger.is_finished(job_key, weights_path):
+                    print('Skipping %s (%d cells) for dataset %s, already finished' % (MODEL_NAME, cell, dname))
+                    continue
 
-                file = open(base_log_name % (MODEL_NAME, cell), 'a+')
+                if ledger.is_interrupted(job_key):
+                    remove_incomplete_weights(weights_path)
 
-                weights_dir = base_weights_dir % (MODEL_NAME, cell)
+                jobs.append((MODEL_NAME, model_fn, cell, dname, did, dataset_name_, normalize_dataset,
+                             LEDGER_PATH, STOPPING_PATIENCE, VAL_FREQUENCY, CHECKPOINT_INTERVAL))
 
-                if not os.path.exists('weights/' + weights_dir):
-                    os.makedirs('weights/' + weights_dir)
+    if CELL_ENSEMBLE:
+        jobs = group_cell_jobs(jobs)
 
-                dataset_name_ = weights_dir + dname
+    # estimated cost of each job : the number of timesteps of the train set,
+    # which every epoch goes through, once per variant being trained
+    costs = []
+    for job in jobs:
+        info = registry.get_id(job[4])
+        num_variants = len(job[2]) if CELL_ENSEMBLE else 1
+        costs.append(info.n_train * info.sequence_length * num_variants)
 
-                # try:
-                model = model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, cell)
+    if NUM_WORKERS > 1:
+        # start the most expensive jobs first, so that they do not end up
+        # running alone at the end of the sweep
+        jobs, costs = order_jobs_by_cost(jobs, costs)
 
-                print('*' * 20, "Training model for dataset %s" % (dname), '*' * 20)
+    print("Num jobs to run : ", len(jobs))
 
-                # comment out the training code to only evaluate !
-                train_model(model, did, dataset_name_, epochs=2000, batch_size=128,
-                            normalize_timeseries=normalize_dataset)
+    if len(jobs) > 0:
+        makespan = estimate_makespan(costs, NUM_WORKERS)
+        print("Estimated cost : %d timesteps per epoch, %d for the busiest of %d workers (%0.1f%% of sequential)" %
+              (sum(costs), makespan, NUM_WORKERS, 100. * makespan / max(1, sum(costs))))
+    print()
 
-                acc = evaluate_model(model, did, dataset_name_, batch_size=128,
-                                     normalize_timeseries=normalize_dataset)
+    progress = SweepProgress(dict(zip(jobs, costs)), num_workers=NUM_WORKERS)
 
-                s = "%d,%s,%s,%0.6f\n" % (did, dname, dataset_name_, acc)
+    def log_result(job, result, error):
+        MODEL_NAME, _, cells, dname, did, dataset_names_ = job[:6]
 
-                file.write(s)
-                file.flush()
+        if not CELL_ENSEMBLE:
+            cells, dataset_names_, result = (cells,), (dataset_names_,), [result]
 
-                successes.append(s)
+        for i, (cell, dataset_name_) in enumerate(zip(cells, dataset_names_)):
+            key = (MODEL_NAME, cell)
+            job_key = JobLedger.job_key(MODEL_NAME, cell, dname)
 
-                # except Exception as e:
-                #     traceback.print_exc()
-                #
-                #     s = "%d,%s,%s,%s\n" % (did, dname, dataset_name_, 0.0)
-                #     failures.append(s)
-                #
-                #     print()
+            if error is None:
+                # only this process writes to the log files, so results of
+                # parallel workers are never interleaved
+                with open(base_log_name % key, 'a+') as file:
+                    file.write(result[i])
+                    file.flush()
 
-                file.close()
+                successes[key].append(result[i])
+                ledger.mark_finished(job_key, result=result[i].strip())
+            else:
+                failures[key].append("%d,%s,%s,%s\n" % (did, dname, dataset_name_, 0.0))
+                ledger.mark_failed(job_key, error=error)
+
+        remaining_time = progress.update(job)
+        if remaining_time is not None:
+            print("Finished %d / %d jobs, expected finish time : %s" %
+                  (len(jobs) - len(progress.remaining), len(jobs),
+                   time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + remaining_time))))
 
+    job_fn = train_and_evaluate_ensemble if CELL_ENSEMBLE else train_and_evaluate
+
+    run_jobs(jobs, job_fn, num_workers=NUM_WORKERS,
+             threads_per_worker=THREADS_PER_WORKER, callback=log_result, pin_cpus=PIN_CPUS)
+
+    for MODEL_NAME, _ in MODELS:
+        for cell in CELLS:
             print('\n\n')
-            print('*' * 20, "Successes", '*' * 20)
+            print('*' * 20, "Successes : %s (%d cells)" % (MODEL_NAME, cell), '*' * 20)
             print()
 
-            for line in successes:
+            for line in successes[(MODEL_NAME, cell)]:
                 print(line)
 
             print('\n\n')
-            print('*' * 20, "Failures", '*' * 20)
+            print('*' * 20, "Failures : %s (%d cells)" % (MODEL_NAME, cell), '*' * 20)
             print()
 
-            for line in failures:
+            for line in failures[(MODEL_NAME, cell)]:
                 print(line)
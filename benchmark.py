@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import tensorflow as tf
+from keras import __version__ as keras_version
+from keras.layers import Input
+from keras.models import Model
+
+from all_datasets_training import generate_lstmfcn, generate_alstmfcn
+from utils.constants import TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
+from utils.generic_utils import load_dataset_at
+from utils.keras_utils import evaluate_model, write_cam, write_context_vector
+from utils.layer_utils import AttentionLSTM
+from utils.runtime_utils import reset_session, describe_runtime
+
+
+# must be bumped whenever the benchmarks change, so that results are only
+# compared against a baseline measuring the same work
+BENCHMARK_VERSION = 1
+
+
+def time_fn(fn, repeats=10, warmup=2, setup=None):
+    """
+    Times a function over several calls.
+
+    Args:
+        fn: Function to time. Called without arguments, or with the result
+            of `setup` if it is provided.
+        repeats: Number of timed calls.
+        warmup: Number of untimed calls made first, which absorb the cost of
+            building graphs and filling caches.
+        setup: Optional function called before every call, whose time is not
+            counted, and whose result is passed to `fn`.
+
+    Returns:
+        A dict of the median, mean, min and standard deviation of the time
+        of a call in seconds, and the number of repeats.
+    """
+    times = []
+
+    for i in range(warmup + repeats):
+        args = (setup(),) if setup is not None else ()
+
+        start_time = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start_time
+
+        if i >= warmup:
+            times.append(elapsed)
+
+    times = np.array(times)
+
+    return {
+        'median': float(np.median(times)),
+        'mean': float(times.mean()),
+        'min': float(times.min()),
+        'std': float(times.std()),
+        'repeats': repeats,
+    }
+
+
+def write_synthetic_dataset(data_dir, name, n_train, n_test, sequence_length, nb_classes, seed=0):
+    """
+    Writes a synthetic dataset in the format of the UCR datasets, where each
+    class is a noisy sine wave of its own frequency.
+
+    Returns:
+        A tuple of the paths to the train and test files.
+    """
+    rng = np.random.RandomState(seed)
+    t = np.linspace(0., 1., sequence_length)
+
+    paths = []
+    for split, n in (('TRAIN', n_train), ('TEST', n_test)):
+        y = rng.randint(1, nb_classes + 1, size=n)
+        X = np.sin(2. * np.pi * y[:, None] * t[None, :]) + 0.5 * rng.normal(size=(n, sequence_length))
+
+        path = os.path.join(data_dir, '%s_%s' % (name, split))
+        data = np.concatenate([y[:, None], X], axis=1)
+        np.savetxt(path, data, delimiter=',', fmt=['%d'] + ['%.6f'] * sequence_length)
+
+        paths.append(path)
+
+    return tuple(paths)
+
+
+@contextmanager
+def registered_dataset(train_path, test_path, sequence_length, nb_classes):
+    """
+    Appends a dataset to the lists of `utils/constants.py`, so that the
+    utilities which take a dataset id can load it, and removes it from them
+    once the block of the `with` statement exits.
+
+    Yields:
+        The id of the dataset.
+    """
+    lists = (TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST)
+    lengths = [len(values) for values in lists]
+
+    for values, value in zip(lists, (train_path, test_path, sequence_length, nb_classes)):
+        values.append(value)
+
+    try:
+        yield len(TRAIN_FILES) - 1
+
+    finally:
+        for values, length in zip(lists, lengths):
+            del values[length:]
+
+
+def run_benchmarks(work_dir, sequence_length=256, nb_classes=5, n_train=512, n_test=512, batch_size=128,
+                   cells=(8, 64, 128), repeats=10, warmup=2, benchmarks=None, seed=0):
+    """
+    Times the hot paths of training and analysing the models on a synthetic
+    dataset : loading the dataset, a training step of LSTM-FCN and ALSTM-FCN,
+    a training step of the AttentionLSTM layer alone, the evaluation of a
+    model, and the export of class activation maps and context vectors.
+
+    Args:
+        work_dir: Directory in which the dataset, weight and feature files
+            are written. Must be the current directory, as the utilities
+            write to paths relative to it.
+        sequence_length: Length of the synthetic series.
+        nb_classes: Number of classes of the synthetic dataset.
+        n_train: Number of train samples.
+        n_test: Number of test samples.
+        batch_size: Size of each batch for training and evaluation.
+        cells: Numbers of cells of the models.
+        repeats: Number of timed calls of each benchmark.
+        warmup: Number of untimed calls made before the timed ones.
+        benchmarks: Optional list of prefixes of the names of the benchmarks
+            to run, such as ['train_step/lstmfcn']. By default, all of them.
+        seed: Seed of the synthetic dataset and weights.
+
+    Returns:
+        A dict which maps the name of each benchmark to its timings.
+    """
+    np.random.seed(seed)
+
+    def selected(name):
+        return benchmarks is None or any(name.startswith(prefix) for prefix in benchmarks)
+
+    results = {}
+
+    def record(name, timings):
+        results[name] = timings
+        print("%-40s median %10.3f ms, min %10.3f ms" % (name, timings['median'] * 1000., timings['min'] * 1000.))
+
+    data_dir = os.path.join(work_dir, 'data')
+    os.makedirs(data_dir)
+    os.makedirs(os.path.join(work_dir, 'weights', 'benchmark'))
+
+    train_path, test_path = write_synthetic_dataset(data_dir, 'Synthetic', n_train, n_test, sequence_length,
+                                                    nb_classes, seed=seed)
+
+    # the dataset is only registered while the benchmarks run
+    with registered_dataset(train_path, test_path, sequence_length, nb_classes) as did:
+        # load_dataset_at
+
+        if selected('load_dataset/parse'):
+            record('load_dataset/parse', time_fn(lambda: load_dataset_at(did, normalize_timeseries=True, verbose=False,
+                                                                         use_cache=False),
+                                                 repeats=repeats, warmup=warmup))
+
+        if selected('load_dataset/cache'):
+            record('load_dataset/cache', time_fn(lambda: load_dataset_at(did, normalize_timeseries=True, verbose=False),
+                                                 repeats=repeats, warmup=warmup))
+
+        if selected('load_dataset/mmap'):
+            record('load_dataset/mmap', time_fn(lambda: load_dataset_at(did, normalize_timeseries=True, verbose=False,
+                                                                        mmap=True),
+                                                repeats=repeats, warmup=warmup))
+
+        dataset = load_dataset_at(did, normalize_timeseries=True, verbose=False)
+        X_train, y_train = dataset[0], dataset[1]
+
+        batch_size = min(batch_size, n_train)
+        X_batch = np.ascontiguousarray(X_train[:batch_size])
+        y_batch = np.eye(nb_classes, dtype=np.float32)[y_train[:batch_size, 0].astype('int32')]
+
+        # training steps of the full models, and of the attention lstm alone
+
+        for model_name, model_fn in (('lstmfcn', generate_lstmfcn), ('alstmfcn', generate_alstmfcn)):
+            for cell in cells:
+                name = 'train_step/%s_%d' % (model_name, cell)
+                if not selected(name):
+                    continue
+
+                reset_session()
+                model = model_fn(sequence_length, nb_classes, cell)
+                model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
+                record(name, time_fn(lambda: model.train_on_batch(X_batch, y_batch), repeats=repeats, warmup=warmup))
+
+        for cell in cells:
+            name = 'attention_lstm/%d' % cell
+            if not selected(name):
+                continue
+
+            reset_session()
+            ip = Input(shape=(1, sequence_length))
+            model = Model(ip, AttentionLSTM(cell)(ip))
+            model.compile(optimizer='adam', loss='mse')
+
+            targets = np.random.normal(size=(batch_size, cell)).astype(np.float32)
+
+            record(name, time_fn(lambda: model.train_on_batch(X_batch, targets), repeats=repeats, warmup=warmup))
+
+        # evaluation and exporters, from saved weights
+
+        for model_name, model_fn in (('lstmfcn', generate_lstmfcn), ('alstmfcn', generate_alstmfcn)):
+            dataset_prefix = 'benchmark/%s_%d' % (model_name, cells[0])
+
+            def build_model():
+                reset_session()
+                return model_fn(sequence_length, nb_classes, cells[0])
+
+            build_model().save_weights('./weights/%s_weights.h5' % dataset_prefix)
+
+            name = 'evaluate_model/%s_%d' % (model_name, cells[0])
+            if selected(name):
+                record(name, time_fn(lambda model: evaluate_model(model, did, dataset_prefix, batch_size=batch_size,
+                                                                  dataset=dataset),
+                                     repeats=repeats, warmup=warmup, setup=build_model))
+
+            name = 'write_cam/%s_%d' % (model_name, cells[0])
+            if selected(name):
+                record(name, time_fn(lambda model: write_cam(model, did, dataset_prefix, normalize_timeseries=True,
+                                                             batch_size=batch_size),
+                                     repeats=repeats, warmup=warmup, setup=build_model))
+
+            name = 'write_context_vector/%s_%d' % (model_name, cells[0])
+            if model_name == 'alstmfcn' and selected(name):
+                record(name, time_fn(lambda model: write_context_vector(model, did, dataset_prefix,
+                                                                        normalize_timeseries=True,
+                                                                        batch_size=batch_size),
+                                     repeats=repeats, warmup=warmup, setup=build_model))
+
+        return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1):
+    """
+    Compares benchmark results against a baseline, by the median time of
+    each benchmark.
+
+    Args:
+        results: Results written by this script.
+        baseline: Results of a previous run, such as a stored baseline.
+        tolerance: Relative slowdown above which a benchmark counts as a
+            regression, and speedup above which it counts as an improvement.
+
+    Returns:
+        A list of (name, baseline median, median, ratio, status) tuples, where
+        status is one of 'regression', 'improvement', 'unchanged' or 'new'.
+    """
+    if baseline.get('config') != results.get('config'):
+        print("Warning : the baseline was run with a different configuration, the comparison is not reliable")
+
+    comparison = []
+
+    for name, timings in sorted(results['benchmarks'].items()):
+        baseline_timings = baseline.get('benchmarks', {}).get(name)
+
+        if baseline_timings is None:
+            comparison.append((name, None, timings['median'], None, 'new'))
+            continue
+
+        ratio = timings['median'] / baseline_timings['median']
+
+        if ratio > 1. + tolerance:
+            status = 'regression'
+        elif ratio < 1. - tolerance:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+
+        comparison.append((name, baseline_timings['median'], timings['median'], ratio, status))
+
+    return comparison
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'keras': keras_version,
+        'runtime': describe_runtime(),
+    }
+
+
+if __name__ == '__main__':
+    # Shape of the synthetic dataset
+    SEQUENCE_LENGTH = 256
+    NB_CLASSES = 5
+    N_TRAIN = 512
+    N_TEST = 512
+    BATCH_SIZE = 128
+
+    # Number of cells of the benchmarked models. Evaluation and exporters
+    # only use the first one.
+    CELLS = [8, 64, 128]
+
+    # Number of timed and untimed calls of each benchmark
+    REPEATS = 10
+    WARMUP = 2
+
+    # Optional list of prefixes of the names of the benchmarks to run,
+    # such as ['train_step/alstmfcn', 'attention_lstm']. None runs all of them.
+    BENCHMARKS = None
+
+    SEED = 0
+
+    # Results of this run
+    OUTPUT_PATH = 'benchmark_results.json'
+
+    # Results of a previous run to compare against, if the file exists.
+    # Set SAVE_BASELINE to True to store the results of this run as the new baseline.
+    BASELINE_PATH = 'benchmark_baseline.json'
+    SAVE_BASELINE = False
+
+    # Relative slowdown of the median time above which a benchmark is reported
+    # as a regression. The script exits with status 1 if there is any.
+    TOLERANCE = 0.15
+
+    """ <<<<< SCRIPT SETUP >>>>> """
+    config = {
+        'version': BENCHMARK_VERSION,
+        'sequence_length': SEQUENCE_LENGTH,
+        'nb_classes': NB_CLASSES,
+        'n_train': N_TRAIN,
+        'n_test': N_TEST,
+        'batch_size': BATCH_SIZE,
+        'cells': CELLS,
+        'seed': SEED,
+    }
+
+    output_path = os.path.abspath(OUTPUT_PATH)
+    baseline_path = os.path.abspath(BASELINE_PATH)
+
+    # the utilities read and write weights and features relative to the
+    # current directory, so run inside a scratch directory
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='lstmfcn_benchmark_')
+    os.chdir(work_dir)
+
+    try:
+        benchmark_results = run_benchmarks(work_dir, sequence_length=SEQUENCE_LENGTH, nb_classes=NB_CLASSES,
+                                           n_train=N_TRAIN, n_test=N_TEST, batch_size=BATCH_SIZE, cells=CELLS,
+                                           repeats=REPEATS, warmup=WARMUP, benchmarks=BENCHMARKS, seed=SEED)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': config,
+        'environment': environment(),
+        'benchmarks': benchmark_results,
+    }
+
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    print()
+    print("Results written to ", output_path)
+
+    regressions = []
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+
+        print()
+        print('*' * 20, "Comparison to the baseline %s" % baseline_path, '*' * 20)
+        print()
+
+        for name, baseline_median, median, ratio, status in compare_to_baseline(results, baseline, TOLERANCE):
+            if baseline_median is None:
+                print("%-40s %10s -> %10.3f ms  %s" % (name, '', median * 1000., status))
+            else:
+                print("%-40s %10.3f -> %10.3f ms  x%0.2f  %s" %
+                      (name, baseline_median * 1000., median * 1000., ratio, status))
+
+            if status == 'regression':
+                regressions.append(name)
+
+    if SAVE_BASELINE:
+        shutil.copy(output_path, baseline_path)
+        print("Results saved as the new baseline ", baseline_path)
+
+    if len(regressions) > 0:
+        print()
+        print("%d regressions : %s" % (len(regressions), ', '.join(regressions)))
+        sys.exit(1)
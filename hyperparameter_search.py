@@ -2,7 +2,6 @@ import json
 import os
 import traceback
 
-from keras import backend as K
 from keras.layers import Conv1D, BatchNormalization, GlobalAveragePooling1D, Permute, Dropout, Flatten
 from keras.layers import Input, PReLU, Dense, LSTM, CuDNNLSTM, concatenate, Activation, GRU, SimpleRNN
 from keras.models import Model
@@ -10,6 +9,9 @@ from utils.constants import MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
 from utils.generic_utils import load_dataset_at
 from utils.keras_utils import train_model, evaluate_model, loss_model
 from utils.layer_utils import AttentionLSTM
+from utils.registry_utils import load_registry
+from utils.runtime_utils import RuntimeConfig, configure_runtime, reset_session, describe_runtime
+from utils.sweep_utils import JobLedger, remove_incomplete_weights, successive_halving, is_valid_weights_file
 
 
 def generate_lstmfcn(MAX_SEQUENCE_LENGTH, NB_CLASS, NUM_CELLS=8):
@@ -297,135 +299,12 @@ def generate_ndalstmfcn(MAX_SEQUENCE_LENGTH, NB_CLASS, NUM_CELLS=8):
 
 if __name__ == "__main__":
 
-    dataset_map = [('Adiac', 0),
-                   ('ArrowHead', 1),
-                   ('ChlorineConcentration', 2),
-                   ('InsectWingbeatSound', 3),
-                   ('Lighting7', 4),
-                   ('Wine', 5),
-                   ('WordsSynonyms', 6),
-                   ('50words', 7),
-                   ('Beef', 8),
-                   ('DistalPhalanxOutlineAgeGroup', 9),
-                   ('DistalPhalanxOutlineCorrect', 10),
-                   ('DistalPhalanxTW', 11),
-                   ('ECG200', 12),
-                   ('ECGFiveDays', 13),
-                   ('BeetleFly', 14),
-                   ('BirdChicken', 15),
-                   ('ItalyPowerDemand', 16),
-                   ('SonyAIBORobotSurface', 17),
-                   ('SonyAIBORobotSurfaceII', 18),
-                   ('MiddlePhalanxOutlineAgeGroup', 19),
-                   ('MiddlePhalanxOutlineCorrect', 20),
-                   ('MiddlePhalanxTW', 21),
-                   ('ProximalPhalanxOutlineAgeGroup', 22),
-                   ('ProximalPhalanxOutlineCorrect', 23),
-                   ('ProximalPhalanxTW', 24),
-                   ('MoteStrain', 25),
-                   ('MedicalImages', 26),
-                   ('Strawberry', 27),
-                   ('ToeSegmentation1', 28),
-                   ('Coffee', 29),
-                   ('Cricket_X', 30),
-                   ('Cricket_Y', 31),
-                   ('Cricket_Z', 32),
-                   ('uWaveGestureLibrary_X', 33),
-                   ('uWaveGestureLibrary_Y', 34),
-                   ('uWaveGestureLibrary_Z', 35),
-                   ('ToeSegmentation2', 36),
-                   ('DiatomSizeReduction', 37),
-                   ('car', 38),
-                   ('CBF', 39),
-                   ('CinC_ECG_torso', 40),
-                   ('Computers', 41),
-                   ('Earthquakes', 42),
-                   ('ECG5000', 43),
-                   ('ElectricDevices', 44),
-                   ('FaceAll', 45),
-                   ('FaceFour', 46),
-                   ('FacesUCR', 47),
-                   ('Fish', 48),
-                   ('FordA', 49),
-                   ('FordB', 50),
-                   ('Gun_Point', 51),
-                   ('Ham', 52),
-                   ('HandOutlines', 53),
-                   ('Haptics', 54),
-                   ('Herring', 55),
-                   ('InlineSkate', 56),
-                   ('LargeKitchenAppliances', 57),
-                   ('Lighting2', 58),
-                   ('MALLAT', 59),
-                   ('Meat', 60),
-                   ('NonInvasiveFatalECG_Thorax1', 61),
-                   ('NonInvasiveFatalECG_Thorax2', 62),
-                   ('OliveOil', 63),
-                   ('OSULeaf', 64),
-                   ('PhalangesOutlinesCorrect', 65),
-                   ('Phoneme', 66),
-                   ('plane', 67),
-                   ('RefrigerationDevices', 68),
-                   ('ScreenType', 69),
-                   ('ShapeletSim', 70),
-                   ('ShapesAll', 71),
-                   ('SmallKitchenAppliances', 72),
-                   ('StarlightCurves', 73),
-                   ('SwedishLeaf', 74),
-                   ('Symbols', 75),
-                   ('synthetic_control', 76),
-                   ('Trace', 77),
-                   ('Patterns', 78),
-                   ('TwoLeadECG', 79),
-                   ('UWaveGestureLibraryAll', 80),
-                   ('wafer', 81),
-                   ('Worms', 82),
-                   ('WormsTwoClass', 83),
-                   ('yoga', 84),
-                   ('ACSF1', 85),
-                   ('AllGestureWiimoteX', 86),
-                   ('AllGestureWiimoteY', 87),
-                   ('AllGestureWiimoteZ', 88),
-                   ('BME', 89),
-                   ('Chinatown', 90),
-                   ('Crop', 91),
-                   ('DodgerLoopDay', 92),
-                   ('DodgerLoopGame', 93),
-                   ('DodgerLoopWeekend', 94),
-                   ('EOGHorizontalSignal', 95),
-                   ('EOGVerticalSignal', 96),
-                   ('EthanolLevel', 97),
-                   ('FreezerRegularTrain', 98),
-                   ('FreezerSmallTrain', 99),
-                   ('Fungi', 100),
-                   ('GestureMidAirD1', 101),
-                   ('GestureMidAirD2', 102),
-                   ('GestureMidAirD3', 103),
-                   ('GesturePebbleZ1', 104),
-                   ('GesturePebbleZ2', 105),
-                   ('GunPointAgeSpan', 106),
-                   ('GunPointMaleVersusFemale', 107),
-                   ('GunPointOldVersusYoung', 108),
-                   ('HouseTwenty', 109),
-                   ('InsectEPGRegularTrain', 110),
-                   ('InsectEPGSmallTrain', 111),
-                   ('MelbournePedestrian', 112),
-                   ('MixedShapesRegularTrain', 113),
-                   ('MixedShapesSmallTrain', 114),
-                   ('PickupGestureWiimoteZ', 115),
-                   ('PigAirwayPressure', 116),
-                   ('PigArtPressure', 117),
-                   ('PigCVP', 118),
-                   ('PLAID', 119),
-                   ('PowerCons', 120),
-                   ('Rock', 121),
-                   ('SemgHandGenderCh2', 122),
-                   ('SemgHandMovementCh2', 123),
-                   ('SemgHandSubjectCh2', 124),
-                   ('ShakeGestureWiimoteZ', 125),
-                   ('SmoothSubspace', 126),
-                   ('UMD', 127)
-                   ]
+    registry = load_registry()
+
+    # (dataset name, id) of every dataset whose files are present in the data
+    # directory. Use `registry.dataset_map(names=[...])` to only select some
+    # of them, or `max_train_samples` to skip the largest ones.
+    dataset_map = registry.dataset_map()
 
     print("Num datasets : ", len(dataset_map))
     print()
@@ -445,9 +324,64 @@ if __name__ == "__main__":
     # Number of cells
     CELLS = [8, 64, 128]
 
+    # Number of epochs the selected model is trained for
+    EPOCHS = 2000
+
+    # Search mode
+    # 'full' trains every number of cells for EPOCHS epochs, and keeps the one
+    #   with the lowest training loss.
+    # 'halving' trains every number of cells for HALVING_MIN_EPOCHS epochs, only
+    #   keeps the best 1 / HALVING_ETA of them by the training loss of their saved
+    #   weights, and so on. The last one standing is trained up to EPOCHS epochs.
+    #   Weights of the discarded cells are only partially trained. Every round of
+    #   every cell is recorded in the ledger, an interrupted search resumes each
+    #   cell from its saved weights, with a new optimizer.
+    SEARCH_MODE = 'full'
+    HALVING_MIN_EPOCHS = 100
+    HALVING_ETA = 3
+
+    # Number of epochs without improvement of the training loss, once the
+    # learning rate has reached its floor, after which training stops early.
+    # None always trains for the full number of epochs.
+    STOPPING_PATIENCE = None
+
+    # Number of epochs between two evaluations of the test set during training.
+    # 1 evaluates it after every epoch, 0 never evaluates it during training.
+    VAL_FREQUENCY = 1
+
+    # Minimum number of seconds between two writes of the best weights, which
+    # are then kept in memory and written by a background thread.
+    # None writes them every time the training loss improves.
+    CHECKPOINT_INTERVAL = None
+
+    # Ledger of finished jobs. Re-running the script skips every job recorded
+    # as finished in it, so an interrupted search only runs the missing work.
+    LEDGER_PATH = 'cell_search_ledger.jsonl'
+
+    # Number of CPU threads used by TensorFlow. None lets TensorFlow use every
+    # core of the host. OpenMP / MKL read their thread count when numpy is
+    # imported, so set OMP_NUM_THREADS in the environment of the script instead.
+    THREADS = None
+
+    # Optional list of the ids of the CPUs this process is pinned to, such as
+    # list(range(0, 8)), so that several searches started on the same host
+    # do not compete for the same cores. None runs on any CPU.
+    CPU_AFFINITY = None
+
+    configure_runtime(RuntimeConfig(intra_op_threads=THREADS, cpu_affinity=CPU_AFFINITY))
+    print("Runtime : ", describe_runtime())
+
+    ledger = JobLedger(LEDGER_PATH)
+
     for model_id, (MODEL_NAME, model_fn) in enumerate(MODELS):
         for dname, did in dataset_map:
 
+            search_key = JobLedger.job_key(MODEL_NAME, 'search', dname)
+
+            if ledger.is_finished(search_key):
+                print('Skipping dataset %s, cell search already finished' % (dname))
+                continue
+
             current_loss = 1e10
 
             MAX_SEQUENCE_LENGTH = MAX_SEQUENCE_LENGTH_LIST[did]
@@ -457,6 +391,9 @@ if __name__ == "__main__":
             successes = []
             failures = []
 
+            # load and normalize the dataset once, and share it between every cell
+            dataset = load_dataset_at(did, normalize_timeseries=True)
+
             for cell in CELLS:
 
                 if not os.path.exists(base_log_name % (MODEL_NAME, cell)):
@@ -464,26 +401,118 @@ if __name__ == "__main__":
                     file.write('%s,%s,%s,%s\n' % ('dataset_id', 'dataset_name', 'dataset_name_', 'test_accuracy'))
                     file.close()
 
-                # release GPU Memory
-                K.clear_session()
                 weights_dir = base_weights_dir % (MODEL_NAME, cell)
 
                 if not os.path.exists('weights/' + weights_dir):
                     os.makedirs('weights/' + weights_dir)
 
-                dataset_name_ = weights_dir + dname
+            if SEARCH_MODE == 'halving':
+                # release GPU Memory
+                reset_session()
+
+                # every candidate stays in memory between rounds, so that its training
+                # resumes with the state of its optimizer and its current learning rate
+                models = {}
+
+                # lowest training loss of the weights saved for each candidate, so that
+                # a later round never overwrites them with worse ones
+                best_losses = {}
+
+                def train_cell(cell, initial_epoch, epochs):
+                    dataset_name_ = base_weights_dir % (MODEL_NAME, cell) + dname
+                    weights_path = './weights/%s_weights.h5' % dataset_name_
+
+                    # each round of each cell is a job of its own, so that an interrupted
+                    # search takes the rounds which already finished from the ledger
+                    job_key = JobLedger.job_key(MODEL_NAME, cell, dname, 'halving', epochs)
+
+                    if ledger.is_finished(job_key, weights_path):
+                        print('Skipping training of %d cells for dataset %s up to epoch %d, already finished' %
+                              (cell, dname, epochs))
+                        best_losses[cell] = ledger.record(job_key)['best_loss']
+                        return ledger.result(job_key)
+
+                    if ledger.is_interrupted(job_key) and not is_valid_weights_file(weights_path):
+                        remove_incomplete_weights(weights_path)
+
+                    ledger.mark_started(job_key, epochs=epochs)
+
+                    if cell not in models:
+                        models[cell] = model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, cell)
+
+                        # the search was interrupted after the previous rounds of this cell
+                        if initial_epoch > 0:
+                            if is_valid_weights_file(weights_path):
+                                models[cell].load_weights(weights_path)
+                            else:
+                                initial_epoch = 0
+                                best_losses.pop(cell, None)
+
+                    print('*' * 20, "Training %d cells model for dataset %s, epochs %d - %d" %
+                          (cell, dname, initial_epoch, epochs), '*' * 20)
 
-                model = model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, cell)
+                    history = train_model(models[cell], did, dataset_name_, epochs=epochs, batch_size=128,
+                                          normalize_timeseries=True, dataset=dataset, initial_epoch=initial_epoch,
+                                          stopping_patience=STOPPING_PATIENCE, val_frequency=VAL_FREQUENCY,
+                                          checkpoint_interval=CHECKPOINT_INTERVAL,
+                                          checkpoint_best=best_losses.get(cell))
 
-                print('*' * 20, "Training model for dataset %s" % (dname), '*' * 20)
+                    best_losses[cell] = min([best_losses.get(cell, float('inf'))] + history.history['loss'])
 
-                train_model(model, did, dataset_name_, epochs=2000, batch_size=128, normalize_timeseries=True)
+                    # rank the candidates by the loss of their saved weights, as in 'full' mode,
+                    # without touching the state of the model being trained
+                    model_loss = loss_model(models[cell], did, dataset_name_, batch_size=128,
+                                            normalize_timeseries=True, dataset=dataset, keep_state=True)
 
-                model_loss = loss_model(model, did, dataset_name_, batch_size=128, normalize_timeseries=True)
+                    ledger.mark_finished(job_key, result=float(model_loss), best_loss=float(best_losses[cell]),
+                                         epochs=epochs)
 
-                if (model_loss < current_loss):
-                    finalcell = cell
-                    current_loss = model_loss
+                    return model_loss
+
+                finalcell, cell_losses = successive_halving(CELLS, train_cell, max_epochs=EPOCHS,
+                                                            min_epochs=HALVING_MIN_EPOCHS, eta=HALVING_ETA)
+
+            else:
+                cell_losses = {}
+
+                for cell in CELLS:
+                    dataset_name_ = base_weights_dir % (MODEL_NAME, cell) + dname
+
+                    job_key = JobLedger.job_key(MODEL_NAME, cell, dname)
+                    weights_path = './weights/%s_weights.h5' % dataset_name_
+
+                    if ledger.is_finished(job_key, weights_path):
+                        print('Skipping training of %d cells for dataset %s, already finished' % (cell, dname))
+                        model_loss = ledger.result(job_key)
+
+                    else:
+                        if ledger.is_interrupted(job_key):
+                            remove_incomplete_weights(weights_path)
+
+                        ledger.mark_started(job_key)
+
+                        # release GPU Memory
+                        reset_session()
+
+                        model = model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, cell)
+
+                        print('*' * 20, "Training model for dataset %s" % (dname), '*' * 20)
+
+                        train_model(model, did, dataset_name_, epochs=EPOCHS, batch_size=128,
+                                    normalize_timeseries=True, dataset=dataset,
+                                    stopping_patience=STOPPING_PATIENCE, val_frequency=VAL_FREQUENCY,
+                                    checkpoint_interval=CHECKPOINT_INTERVAL)
+
+                        model_loss = loss_model(model, did, dataset_name_, batch_size=128,
+                                                normalize_timeseries=True, dataset=dataset)
+
+                        ledger.mark_finished(job_key, result=float(model_loss))
+
+                    cell_losses[cell] = model_loss
+
+                    if (model_loss < current_loss):
+                        finalcell = cell
+                        current_loss = model_loss
 
             print('Final Cell Selected:', finalcell)
             model = model_fn(MAX_SEQUENCE_LENGTH, NB_CLASS, finalcell)
@@ -491,7 +520,8 @@ if __name__ == "__main__":
             dataset_name_ = weights_dir + dname
 
             print(dataset_name_)
-            acc = evaluate_model(model, did, dataset_name_, batch_size=128, normalize_timeseries=True)
+            acc = evaluate_model(model, did, dataset_name_, batch_size=128, normalize_timeseries=True,
+                                 dataset=dataset)
 
             s = "%d,%s,%s,%0.6f\n" % (did, dname, dataset_name_, acc)
 
@@ -502,3 +532,6 @@ if __name__ == "__main__":
             successes.append(s)
 
             file.close()
+
+            ledger.mark_finished(search_key, result=float(acc), cell=finalcell, mode=SEARCH_MODE,
+                                 losses={str(cell): float(loss) for cell, loss in cell_losses.items()})
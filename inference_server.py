@@ -0,0 +1,215 @@
+import json
+import re
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+
+from utils.inference_utils import NumpyLSTMFCN
+from utils.serving_utils import MicroBatcher
+
+
+class ModelServer(object):
+    """
+    Holds the trained models being served, each behind its own MicroBatcher.
+
+    Args:
+        models: List of (model name, number of cells, dataset name) triples,
+            such as ('lstmfcn', 8, 'Adiac'). Their weights are read from the
+            directories written by `all_datasets_training.py`. A fourth item,
+            such as ('lstmfcn', 8, 'Adiac', False), sets the normalization
+            scheme the model was trained with, overriding `normalize_timeseries`.
+        normalize_timeseries: Normalization scheme the models were trained
+            with, for the models which do not set their own. If True / int
+            not equal to 2, sample-wise z-normalization is applied to the
+            incoming series, as done during training. Dataset-wise
+            normalization (2) requires the statistics of the training set,
+            and must be applied by the client instead.
+        max_batch_size: Maximum number of requests run in one micro-batch.
+        max_delay: Maximum time in seconds a request waits for its
+            micro-batch to fill up.
+    """
+
+    def __init__(self, models, normalize_timeseries=True, max_batch_size=64, max_delay=0.005):
+        self.normalize_timeseries = normalize_timeseries
+        self.models = {}
+        self.batchers = {}
+        self.sample_normalization = {}  # whether each model normalizes the series it receives
+
+        for model in models:
+            model_name, cells, dataset_name = model[:3]
+            normalize = model[3] if len(model) > 3 else normalize_timeseries
+
+            key = model_key(model_name, cells, dataset_name)
+            self.sample_normalization[key] = bool(normalize) and int(normalize) != 2
+            weights_path = './weights/%s_%d_cells_weights/%s_weights.h5' % (model_name, cells, dataset_name)
+
+            print("Loading model %s from %s" % (key, weights_path))
+            model = NumpyLSTMFCN(weights_path)
+
+            self.models[key] = model
+            self.batchers[key] = MicroBatcher(model.predict, max_batch_size=max_batch_size,
+                                              max_delay=max_delay)
+
+    def start(self):
+        for batcher in self.batchers.values():
+            batcher.start()
+
+    def stop(self):
+        for batcher in self.batchers.values():
+            batcher.stop()
+
+    def predict(self, key, series):
+        """
+        Classifies a single time series.
+
+        Args:
+            key: Key of the model, as built by `model_key`.
+            series: List or numpy array of shape (timesteps,).
+
+        Returns:
+            A tuple of (predicted class, class probabilities).
+        """
+        if key not in self.models:
+            raise KeyError("Unknown model %s" % key)
+
+        series = np.asarray(series, dtype=np.float32).reshape(-1)
+
+        if series.shape[0] != self.models[key].sequence_length:
+            raise ValueError("Model %s expects series of length %d, got %d" %
+                             (key, self.models[key].sequence_length, series.shape[0]))
+
+        if self.sample_normalization[key]:
+            series = (series - series.mean()) / (series.std() + 1e-8)
+
+        probabilities = self.batchers[key].predict(series)
+        return int(np.argmax(probabilities)), probabilities
+
+    def stats(self):
+        return {key: batcher.stats() for key, batcher in self.batchers.items()}
+
+
+def model_key(model_name, cells, dataset_name):
+    return '%s/%d/%s' % (model_name, cells, dataset_name)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # every connection gets its own thread, so that concurrent requests can
+    # be grouped into the same micro-batch
+    daemon_threads = True
+
+    # the default listen backlog of 5 drops connections under bursts of requests
+    request_queue_size = 1024
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the inference server :
+
+        POST /predict/<model name>/<cells>/<dataset name>
+            with a JSON body {"series": [...]}, returns
+            {"class": ..., "probabilities": [...]}
+        GET /stats
+            returns the throughput and latencies of every model
+        GET /models
+            returns the served models and their input length
+    """
+
+    server_models = None  # ModelServer, set before the server starts
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server_models.stats())
+        elif self.path == '/models':
+            self._send_json(200, {key: {'sequence_length': model.sequence_length,
+                                        'nb_classes': model.nb_classes}
+                                  for key, model in self.server_models.models.items()})
+        else:
+            self._send_json(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        match = re.match(r'^/predict/(.+)$', self.path)
+        if match is None:
+            self._send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+
+        key = match.group(1)
+        if key not in self.server_models.models:
+            self._send_json(404, {'error': 'Unknown model %s' % key})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            series = json.loads(self.rfile.read(length).decode('utf8'))['series']
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            predicted_class, probabilities = self.server_models.predict(key, series)
+        except (ValueError, TypeError) as e:
+            # series which are not numbers, or of the wrong length
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            # always answer, rather than dropping the connection
+            self._send_json(500, {'error': '%s: %s' % (e.__class__.__name__, str(e))})
+            return
+
+        self._send_json(200, {'class': predicted_class, 'probabilities': probabilities.tolist()})
+
+    def log_message(self, format, *args):
+        # do not print a line per request
+        pass
+
+    def _send_json(self, code, content):
+        data = json.dumps(content).encode('utf8')
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    HOST = '127.0.0.1'
+    PORT = 8000
+
+    # (model name, number of cells, dataset name) of every model to serve. A
+    # fourth item sets the normalization scheme of a model which was trained
+    # with another one than NORMALIZE_TIMESERIES, e.g. ('lstmfcn', 8, 'Adiac', False)
+    MODELS = [
+        ('lstmfcn', 8, 'Adiac'),
+        ('alstmfcn', 8, 'Adiac'),
+    ]
+
+    # Normalization scheme used during training
+    # Normalize = False means no normalization will be done
+    # Normalize = True / 1 means sample wise z-normalization
+    # Normalize = 2 means dataset wise z-normalization, which the client must apply
+    NORMALIZE_TIMESERIES = True
+
+    # Micro-batching parameters
+    MAX_BATCH_SIZE = 64
+    MAX_DELAY = 0.005  # seconds
+
+    """ <<<<< SCRIPT SETUP >>>>> """
+    server_models = ModelServer(MODELS, normalize_timeseries=NORMALIZE_TIMESERIES,
+                                max_batch_size=MAX_BATCH_SIZE, max_delay=MAX_DELAY)
+    server_models.start()
+
+    RequestHandler.server_models = server_models
+    httpd = ThreadingHTTPServer((HOST, PORT), RequestHandler)
+
+    print("Serving %d models on http://%s:%d" % (len(MODELS), HOST, PORT))
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        server_models.stop()
+
+        print(json.dumps(server_models.stats(), indent=2))
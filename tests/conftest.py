@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the utilities are imported as `utils.<module>`, from the root of the repository
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('h5py')
+
+from utils.constants import TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
+from utils.archive_utils import DATASET_ARCHIVE_NAME
+from utils.generic_utils import load_dataset_at, build_dataset_archive
+
+
+@pytest.fixture
+def dataset_id(tmpdir):
+    rng = np.random.RandomState(0)
+
+    for split, n in (('TRAIN', 20), ('TEST', 10)):
+        y = rng.randint(1, 4, size=n)
+        X = rng.normal(size=(n, 32))
+
+        # more digits than float32 holds, so that a cast to it is visible
+        np.savetxt(str(tmpdir.join('Synthetic_%s' % split)), np.concatenate([y[:, None], X], axis=1),
+                   delimiter=',', fmt=['%d'] + ['%.12f'] * 32)
+
+    TRAIN_FILES.append(str(tmpdir.join('Synthetic_TRAIN')))
+    TEST_FILES.append(str(tmpdir.join('Synthetic_TEST')))
+    MAX_SEQUENCE_LENGTH_LIST.append(32)
+    NB_CLASSES_LIST.append(3)
+
+    yield len(TRAIN_FILES) - 1
+
+    for values in (TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST):
+        values.pop()
+
+
+def test_float64_load_bypasses_float32_archive(tmpdir, dataset_id):
+    # the archive of the data directory of the dataset is used by default
+    build_dataset_archive(str(tmpdir.join(DATASET_ARCHIVE_NAME)), dataset_ids=[dataset_id], dtype=np.float32,
+                          verbose=False)
+
+    expected = np.loadtxt(TRAIN_FILES[dataset_id], delimiter=',')[:, 1:]
+
+    # float32 loads are served by the archive
+    X_train, _, _, _, _ = load_dataset_at(dataset_id, verbose=False, mmap=True)
+    assert X_train.dtype == np.float32
+    np.testing.assert_array_equal(X_train[:, 0, :], expected.astype(np.float32))
+
+    # float64 loads must keep the full precision of the dataset files
+    for use_cache in (False, True, True):
+        X_train, _, _, _, _ = load_dataset_at(dataset_id, verbose=False, use_cache=use_cache, dtype=np.float64)
+        assert X_train.dtype == np.float64
+        np.testing.assert_allclose(X_train[:, 0, :], expected, rtol=1e-12, atol=0.)
+
+
+def test_float64_load_bypasses_float32_binary_files(dataset_id):
+    # binary files holding float32 series, narrower than the text files
+    for path in (TRAIN_FILES[dataset_id], TEST_FILES[dataset_id]):
+        values = np.loadtxt(path, delimiter=',')
+        np.savez(path + '.npz', X=values[:, 1:].astype(np.float32), y=values[:, 0].astype(np.int64))
+
+    expected = np.loadtxt(TRAIN_FILES[dataset_id], delimiter=',')[:, 1:]
+
+    X_train, _, _, _, _ = load_dataset_at(dataset_id, verbose=False, use_cache=False)
+    np.testing.assert_array_equal(X_train[:, 0, :], expected.astype(np.float32))
+
+    X_train, _, _, _, _ = load_dataset_at(dataset_id, verbose=False, use_cache=False, dtype=np.float64)
+    np.testing.assert_allclose(X_train[:, 0, :], expected, rtol=1e-12, atol=0.)
+
+
+def test_mmap_without_cache(tmpdir, dataset_id):
+    # the series must be parsed, there is no file to map
+    with pytest.raises(ValueError):
+        load_dataset_at(dataset_id, verbose=False, use_cache=False, mmap=True)
+
+    # archived series are mapped from the archive, the cache is not needed
+    build_dataset_archive(str(tmpdir.join(DATASET_ARCHIVE_NAME)), dataset_ids=[dataset_id], dtype=np.float32,
+                          verbose=False)
+
+    X_train, _, _, _, _ = load_dataset_at(dataset_id, verbose=False, use_cache=False, mmap=True)
+    assert not X_train.flags.writeable
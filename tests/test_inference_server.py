@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('h5py')
+
+import inference_server
+from inference_server import ModelServer, model_key
+
+
+class FakeModel(object):
+    """ Returns the series it is given, so that the normalization is visible. """
+
+    sequence_length = 4
+
+    def __init__(self, weights_path):
+        self.weights_path = weights_path
+
+    def predict(self, X):
+        return X
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(inference_server, 'NumpyLSTMFCN', FakeModel)
+
+    server = ModelServer([('lstmfcn', 8, 'Adiac'), ('alstmfcn', 8, 'Adiac', False), ('lstmfcn', 64, 'Adiac', 2)],
+                         normalize_timeseries=True, max_delay=0.)
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+def test_normalization_is_set_per_model(server):
+    series = np.array([1., 2., 3., 6.], dtype=np.float32)
+    normalized = (series - series.mean()) / series.std()
+
+    _, probabilities = server.predict(model_key('lstmfcn', 8, 'Adiac'), series)
+    np.testing.assert_allclose(probabilities, normalized, rtol=1e-5)
+
+    # trained without normalization
+    _, probabilities = server.predict(model_key('alstmfcn', 8, 'Adiac'), series)
+    np.testing.assert_array_equal(probabilities, series)
+
+    # dataset-wise normalization is applied by the client
+    _, probabilities = server.predict(model_key('lstmfcn', 64, 'Adiac'), series)
+    np.testing.assert_array_equal(probabilities, series)
+
+
+def test_invalid_requests(server):
+    with pytest.raises(KeyError):
+        server.predict(model_key('grufcn', 8, 'Adiac'), np.zeros(4))
+
+    with pytest.raises(ValueError):
+        server.predict(model_key('lstmfcn', 8, 'Adiac'), np.zeros(5))
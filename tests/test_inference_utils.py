@@ -0,0 +1,229 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from utils.inference_utils import NumpyLSTMFCN, fold_batchnorm_weights, BATCHNORM_EPSILON, _lstm, \
+    _attention_lstm, _conv1d, _hard_sigmoid, _sigmoid
+
+
+def reference_lstm(x, kernel, recurrent_kernel, bias, activation=np.tanh, recurrent_activation=_hard_sigmoid,
+                   context=None):
+    """
+    LSTM written one sample and one gate at a time, as in the Keras LSTM cell.
+    `context(sample, h, gates)` optionally adds the attention term of each gate.
+    """
+    units = recurrent_kernel.shape[0]
+    gates = [slice(i * units, (i + 1) * units) for i in range(4)]
+    outputs = []
+
+    for sample in x:
+        h = np.zeros(units)
+        c = np.zeros(units)
+
+        for x_t in sample:
+            z = [x_t.dot(kernel[:, g]) + h.dot(recurrent_kernel[:, g]) + bias[g] for g in gates]
+            if context is not None:
+                z = [z_g + z_hat_g for z_g, z_hat_g in zip(z, context(sample, h, gates))]
+
+            i = recurrent_activation(z[0])
+            f = recurrent_activation(z[1])
+            c = f * c + i * activation(z[2])
+            o = recurrent_activation(z[3])
+            h = o * activation(c)
+
+        outputs.append(h)
+
+    return np.array(outputs)
+
+
+def reference_attention_context(attention_kernel, attention_W, attention_U, attention_v, attention_b):
+    def context(sample, h, gates):
+        # Bahdanau alignment of the state with every timestep of the sample
+        energy = np.array([np.tanh(x_j.dot(attention_W) + h.dot(attention_U) + attention_b).dot(attention_v)[0]
+                           for x_j in sample])
+        alpha = np.exp(energy) / np.sum(np.exp(energy))
+
+        z_hat = np.sum(alpha[:, np.newaxis] * sample, axis=0)
+        return [z_hat.dot(attention_kernel[:, g]) for g in gates]
+
+    return context
+
+
+def reference_conv1d(x, kernel, bias):
+    kernel_size = kernel.shape[0]
+    pad_left = (kernel_size - 1) // 2
+
+    out = np.zeros((x.shape[0], x.shape[1], kernel.shape[-1]))
+    for t in range(x.shape[1]):
+        for k in range(kernel_size):
+            if 0 <= t + k - pad_left < x.shape[1]:
+                out[:, t, :] += x[:, t + k - pad_left, :].dot(kernel[k])
+
+    return out + bias
+
+
+def lstm_weights(rng, input_dim, units):
+    return {
+        'kernel': rng.normal(scale=0.5, size=(input_dim, 4 * units)),
+        'recurrent_kernel': rng.normal(scale=0.5, size=(units, 4 * units)),
+        'bias': rng.normal(scale=0.5, size=(4 * units,)),
+    }
+
+
+def attention_weights(rng, input_dim, units):
+    return {
+        'attention_kernel': rng.normal(scale=0.5, size=(input_dim, 4 * units)),
+        'attention_W': rng.normal(scale=0.5, size=(input_dim, units)),
+        'attention_U': rng.normal(scale=0.5, size=(units, units)),
+        'attention_v': rng.normal(scale=0.5, size=(units, 1)),
+        'attention_b': rng.normal(scale=0.5, size=(units,)),
+    }
+
+
+@pytest.mark.parametrize('recurrent_activation', [_hard_sigmoid, _sigmoid])
+def test_lstm_matches_reference(recurrent_activation):
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=(5, 7, 3))
+    weights = lstm_weights(rng, 3, 4)
+
+    np.testing.assert_allclose(_lstm(x, recurrent_activation=recurrent_activation, **weights),
+                               reference_lstm(x, recurrent_activation=recurrent_activation, **weights),
+                               rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('timesteps, input_dim', [(1, 16), (5, 3)])
+def test_attention_lstm_matches_reference(timesteps, input_dim):
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=(5, timesteps, input_dim))
+    weights = lstm_weights(rng, input_dim, 4)
+    attention = attention_weights(rng, input_dim, 4)
+
+    expected = reference_lstm(x, context=reference_attention_context(**attention), **weights)
+
+    np.testing.assert_allclose(_attention_lstm(x, **dict(weights, **attention)), expected, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('kernel_size', [3, 8])
+def test_conv1d_matches_reference(kernel_size):
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=(4, 11, 3))
+    kernel = rng.normal(size=(kernel_size, 3, 5))
+    bias = rng.normal(size=(5,))
+
+    np.testing.assert_allclose(_conv1d(x, kernel, bias), reference_conv1d(x, kernel, bias), rtol=1e-10, atol=1e-12)
+
+
+def test_fold_batchnorm_weights():
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=(4, 11, 3))
+    kernel = rng.normal(size=(3, 3, 5))
+    bias = rng.normal(size=(5,))
+    gamma, beta, moving_mean = rng.normal(size=(3, 5))
+    moving_variance = rng.uniform(0.5, 2., size=(5,))
+
+    expected = gamma * (reference_conv1d(x, kernel, bias) - moving_mean) / np.sqrt(moving_variance +
+                                                                                   BATCHNORM_EPSILON) + beta
+
+    folded_kernel, folded_bias = fold_batchnorm_weights(kernel, bias, moving_mean, moving_variance, gamma, beta)
+    np.testing.assert_allclose(_conv1d(x, folded_kernel, folded_bias), expected, rtol=1e-10, atol=1e-12)
+
+
+def write_weights_file(path, layers, keras_version='2.2.4'):
+    """
+    Writes weights in the layout of `model.save_weights`.
+    """
+    with h5py.File(path, 'w') as f:
+        f.attrs['layer_names'] = np.array([name.encode('utf8') for name, _ in layers])
+        f.attrs['keras_version'] = keras_version.encode('utf8')
+
+        for layer_name, weights in layers:
+            group = f.create_group(layer_name)
+            weight_names = ['%s/%s:0' % (layer_name, name) for name in weights]
+            group.attrs['weight_names'] = np.array([name.encode('utf8') for name in weight_names])
+
+            for weight_name, value in zip(weight_names, weights.values()):
+                group.create_dataset(weight_name, data=value)
+
+
+@pytest.mark.parametrize('attention', [False, True])
+def test_numpy_model_matches_reference(tmpdir, attention):
+    rng = np.random.RandomState(0)
+    sequence_length, units, nb_classes = 12, 4, 3
+    X = rng.normal(size=(6, 1, sequence_length))
+
+    recurrent = lstm_weights(rng, sequence_length, units)
+    if attention:
+        recurrent.update(attention_weights(rng, sequence_length, units))
+
+    layers = [('lstm_1', recurrent)]
+    convs = []
+    channels = 1
+
+    for i, (filters, kernel_size) in enumerate([(8, 8), (16, 5), (8, 3)]):
+        conv = {'kernel': rng.normal(scale=0.5, size=(kernel_size, channels, filters)),
+                'bias': rng.normal(scale=0.5, size=(filters,))}
+        batchnorm = {'gamma': rng.normal(size=(filters,)), 'beta': rng.normal(size=(filters,)),
+                     'moving_mean': rng.normal(size=(filters,)),
+                     'moving_variance': rng.uniform(0.5, 2., size=(filters,))}
+
+        layers += [('conv1d_%d' % (i + 1), conv), ('batch_normalization_%d' % (i + 1), batchnorm)]
+        convs.append((conv, batchnorm))
+        channels = filters
+
+    dense = {'kernel': rng.normal(size=(units + channels, nb_classes)), 'bias': rng.normal(size=(nb_classes,))}
+    layers.append(('dense_1', dense))
+
+    weights_path = str(tmpdir.join('weights.h5'))
+    write_weights_file(weights_path, layers)
+
+    # forward pass of the Keras model, one layer at a time
+    context = reference_attention_context(**{name: value for name, value in recurrent.items()
+                                             if name.startswith('attention')}) if attention else None
+    x = reference_lstm(X, recurrent['kernel'], recurrent['recurrent_kernel'], recurrent['bias'], context=context)
+
+    y = np.transpose(X, (0, 2, 1))
+    for conv, batchnorm in convs:
+        y = reference_conv1d(y, conv['kernel'], conv['bias'])
+        y = batchnorm['gamma'] * (y - batchnorm['moving_mean']) / np.sqrt(batchnorm['moving_variance'] +
+                                                                          BATCHNORM_EPSILON) + batchnorm['beta']
+        y = np.maximum(y, 0.)
+
+    logits = np.concatenate([x, np.mean(y, axis=1)], axis=-1).dot(dense['kernel']) + dense['bias']
+    expected = np.exp(logits) / np.sum(np.exp(logits), axis=-1, keepdims=True)
+
+    model = NumpyLSTMFCN(weights_path, dtype=np.float64)
+    assert model.recurrent_type == ('attention_lstm' if attention else 'lstm')
+    assert model.recurrent_activations['recurrent_activation'] == 'hard_sigmoid'
+
+    np.testing.assert_allclose(model.predict(X, batch_size=4), expected, rtol=1e-8, atol=1e-10)
+    np.testing.assert_array_equal(model.predict_classes(X[:, 0, :]), np.argmax(expected, axis=-1))
+
+
+@pytest.mark.parametrize('attention', [False, True])
+def test_numpy_model_matches_keras(tmpdir, attention):
+    pytest.importorskip('keras')
+
+    from all_datasets_training import generate_lstmfcn, generate_alstmfcn
+
+    np.random.seed(0)
+    X = np.random.normal(size=(20, 1, 24)).astype(np.float32)
+
+    model_fn = generate_alstmfcn if attention else generate_lstmfcn
+    model = model_fn(24, 3, 8)
+
+    # moving statistics away from their initial values, so that folding them matters
+    for layer in model.layers:
+        if layer.__class__.__name__ == 'BatchNormalization':
+            gamma, beta, moving_mean, moving_variance = layer.get_weights()
+            layer.set_weights([np.random.normal(size=gamma.shape), np.random.normal(size=beta.shape),
+                               np.random.normal(size=moving_mean.shape),
+                               np.random.uniform(0.5, 2., size=moving_variance.shape)])
+
+    weights_path = str(tmpdir.join('weights.h5'))
+    model.save_weights(weights_path)
+
+    numpy_model = NumpyLSTMFCN(weights_path)
+
+    np.testing.assert_allclose(numpy_model.predict(X, batch_size=8), model.predict(X, batch_size=8),
+                               rtol=1e-4, atol=1e-5)
@@ -0,0 +1,178 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from keras import backend as K
+from keras.models import Model
+from keras.layers import Input, Conv1D, BatchNormalization, Activation, GlobalAveragePooling1D, Dense, Permute
+
+from utils.keras_utils import AsyncModelCheckpoint, PeriodicValidation, PlateauStopping, fold_batchnorm
+
+
+def _build_model(sequence_length, nb_classes):
+    ip = Input(shape=(1, sequence_length))
+
+    y = Permute((2, 1))(ip)
+    y = Conv1D(8, 3, padding='same')(y)
+    y = BatchNormalization()(y)
+    y = Activation('relu')(y)
+    y = GlobalAveragePooling1D()(y)
+
+    out = Dense(nb_classes, activation='softmax')(y)
+    return Model(ip, out)
+
+
+def _randomize_batchnorm(model):
+    # moving statistics away from their initial values, so that folding them matters
+    for layer in model.layers:
+        if isinstance(layer, BatchNormalization):
+            gamma, beta, moving_mean, moving_variance = layer.get_weights()
+            layer.set_weights([np.random.normal(size=gamma.shape), np.random.normal(size=beta.shape),
+                               np.random.normal(size=moving_mean.shape),
+                               np.random.uniform(0.5, 2., size=moving_variance.shape)])
+
+
+@pytest.mark.parametrize('model_name', ['conv', 'lstmfcn', 'alstmfcn'])
+def test_fold_batchnorm_keeps_predictions(model_name):
+    from all_datasets_training import generate_lstmfcn, generate_alstmfcn
+
+    np.random.seed(0)
+    X = np.random.normal(size=(20, 1, 24)).astype(np.float32)
+
+    model_fns = {'conv': _build_model, 'lstmfcn': generate_lstmfcn, 'alstmfcn': generate_alstmfcn}
+    model = model_fns[model_name](24, 3)
+    _randomize_batchnorm(model)
+
+    folded = fold_batchnorm(model)
+
+    assert not any(isinstance(layer, BatchNormalization) for layer in folded.layers)
+    assert len(folded.layers) < len(model.layers)
+
+    np.testing.assert_allclose(folded.predict(X, batch_size=8), model.predict(X, batch_size=8),
+                               rtol=1e-4, atol=1e-5)
+
+
+class FakeModel(object):
+    """ Stands for the model a callback is set on, with a learning rate and fixed metrics. """
+
+    metrics_names = ['loss', 'acc']
+
+    def __init__(self, lr=1e-3):
+        self.optimizer = type('FakeOptimizer', (object,), {})()
+        self.optimizer.lr = K.variable(lr)
+        self.stop_training = False
+        self.evaluated = 0
+
+    def evaluate(self, X, y, batch_size=None, verbose=1):
+        self.evaluated += 1
+        return [0.5, 0.75]
+
+
+def test_plateau_stopping_only_counts_epochs_at_the_lr_floor(tmpdir):
+    record_paths = [str(tmpdir.join('a_stopping.json')), str(tmpdir.join('b_stopping.json'))]
+
+    model = FakeModel(lr=1e-3)
+    callback = PlateauStopping(patience=3, min_lr=1e-4, record_path=record_paths)
+    callback.set_model(model)
+
+    # no improvement above the floor never stops training
+    for epoch, loss in enumerate([5., 4., 4., 4., 4.]):
+        callback.on_epoch_end(epoch, {'loss': loss})
+        assert not model.stop_training
+
+    K.set_value(model.optimizer.lr, 1e-4)
+
+    # an improvement at the floor starts the patience again
+    for epoch, loss in enumerate([4., 4., 3.9, 4., 4.], start=5):
+        callback.on_epoch_end(epoch, {'loss': loss})
+        assert not model.stop_training
+
+    callback.on_epoch_end(10, {'loss': 4.})
+    assert model.stop_training
+
+    callback.on_train_end()
+
+    for record_path in record_paths:
+        with open(record_path, 'r') as f:
+            record = json.load(f)
+
+        assert record == {'reason': 'loss_plateau', 'epochs': 11, 'monitor': 'loss', 'best': 3.9, 'best_epoch': 8,
+                          'lr_floor_epoch': 6, 'patience': 3}
+
+
+def test_plateau_stopping_records_full_runs(tmpdir):
+    record_path = str(tmpdir.join('stopping.json'))
+
+    model = FakeModel(lr=1e-4)
+    callback = PlateauStopping(patience=3, min_lr=1e-4, record_path=record_path)
+    callback.set_model(model)
+
+    for epoch, loss in enumerate([3., 2., 1.]):
+        callback.on_epoch_end(epoch, {'loss': loss})
+
+    with pytest.warns(RuntimeWarning):
+        callback.on_epoch_end(3, {})
+
+    callback.on_train_end()
+
+    with open(record_path, 'r') as f:
+        record = json.load(f)
+
+    assert not model.stop_training
+    assert record['reason'] == 'max_epochs'
+    assert record['epochs'] == 4
+    assert record['best_epoch'] == 3
+
+
+def test_periodic_validation(capsys):
+    model = FakeModel()
+    callback = PeriodicValidation((None, None), frequency=3, last_epoch=7)
+    callback.set_model(model)
+
+    validated = []
+    for epoch in range(8):
+        logs = {'loss': 1.}
+        callback.on_epoch_end(epoch, logs)
+
+        if 'val_loss' in logs:
+            validated.append(epoch)
+            assert logs == {'loss': 1., 'val_loss': 0.5, 'val_acc': 0.75}
+
+    # every third epoch, and the last one
+    assert validated == [2, 5, 7]
+    assert model.evaluated == 3
+
+    printed = capsys.readouterr().out.splitlines()
+    assert printed == ['Epoch 3 validation - val_loss: 0.5000 - val_acc: 0.7500',
+                       'Epoch 6 validation - val_loss: 0.5000 - val_acc: 0.7500',
+                       'Epoch 8 validation - val_loss: 0.5000 - val_acc: 0.7500']
+
+
+def test_async_checkpoint_round_trip_with_batchnorm(tmpdir):
+    np.random.seed(0)
+    X = np.random.normal(size=(32, 1, 16)).astype(np.float32)
+    y = np.eye(3, dtype=np.float32)[np.random.randint(0, 3, size=32)]
+
+    model = _build_model(16, 3)
+    model.compile(optimizer='adam', loss='categorical_crossentropy')
+
+    # a single epoch, so that the best weights are the final ones
+    filepath = str(tmpdir.join('weights.h5'))
+    model.fit(X, y, batch_size=8, epochs=1, verbose=0,
+              callbacks=[AsyncModelCheckpoint(filepath, monitor='loss', flush_interval=0.)])
+
+    # the moving statistics of batchnorm must have moved away from their initial values
+    moving_mean = model.layers[3].get_weights()[2]
+    assert np.any(moving_mean != 0.)
+
+    reloaded = _build_model(16, 3)
+    reloaded.load_weights(filepath)
+
+    for layer, reloaded_layer in zip(model.layers, reloaded.layers):
+        for w, reloaded_w in zip(layer.get_weights(), reloaded_layer.get_weights()):
+            np.testing.assert_array_equal(w, reloaded_w)
+
+    np.testing.assert_allclose(model.predict(X), reloaded.predict(X), rtol=1e-6, atol=1e-6)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from keras.models import Model
+from keras.layers import Input, Dense
+
+from utils.layer_utils import AttentionLSTM, AttentionLSTMCell, _time_distributed_dense
+
+
+class _PerStepProjectionCell(AttentionLSTMCell):
+    """ The cell as it was, projecting the input by the alignment model at every step. """
+
+    def call(self, inputs, states, training=None):
+        self._attention_projection = _time_distributed_dense(inputs, self.attention_weights, self.attention_bias,
+                                                             input_dim=self.input_dim, output_dim=self.units,
+                                                             timesteps=self.timestep_dim)
+        return super(_PerStepProjectionCell, self).call(inputs, states, training=training)
+
+
+def _build_model(timesteps, input_dim, units=4, cell_class=None, **kwargs):
+    ip = Input(shape=(timesteps, input_dim))
+
+    layer = AttentionLSTM(units, **kwargs)
+    if cell_class is not None:
+        # before the layer is called, so that its graph is built with this cell
+        layer.cell.__class__ = cell_class
+
+    x = layer(ip)
+    out = Dense(3, activation='softmax')(x)
+    return Model(ip, out)
+
+
+@pytest.mark.parametrize('implementation', [1, 2])
+def test_attention_projection_once_per_sequence(implementation):
+    np.random.seed(0)
+    X = np.random.normal(size=(8, 1, 16)).astype(np.float32)
+
+    model = _build_model(1, 16, implementation=implementation)
+
+    # the step input only spans the whole sequence for the LSTM-FCN input shape
+    per_step_model = _build_model(1, 16, implementation=implementation, cell_class=_PerStepProjectionCell)
+    per_step_model.set_weights(model.get_weights())
+
+    np.testing.assert_allclose(model.predict(X, batch_size=len(X)), per_step_model.predict(X, batch_size=len(X)),
+                               rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('timesteps, input_dim', [(1, 16), (5, 3)])
+@pytest.mark.parametrize('implementation', [1, 2])
+def test_attention_lstm_context_is_per_sample(timesteps, input_dim, implementation):
+    np.random.seed(0)
+    X = np.random.normal(size=(8, timesteps, input_dim)).astype(np.float32)
+
+    model = _build_model(timesteps, input_dim, implementation=implementation)
+
+    batch_predictions = model.predict(X, batch_size=len(X))
+    single_predictions = np.concatenate([model.predict(X[i:i + 1]) for i in range(len(X))])
+
+    # the output of a sample must not depend on the other samples of its batch
+    np.testing.assert_allclose(batch_predictions, single_predictions, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(model.predict(X[::-1], batch_size=len(X)), batch_predictions[::-1],
+                               rtol=1e-5, atol=1e-6)
+
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('h5py')
+
+from utils import registry_utils
+from utils.constants import TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
+from utils.registry_utils import load_registry, REGISTRY_INDEX_NAME
+
+
+def write_dataset(data_dir, name, n_train=20, n_test=10, sequence_length=16, nb_classes=3):
+    rng = np.random.RandomState(0)
+
+    for split, n in (('TRAIN', n_train), ('TEST', n_test)):
+        y = np.arange(n) % nb_classes + 1
+        X = rng.normal(size=(n, sequence_length))
+
+        np.savetxt(str(data_dir.join('%s_%s' % (name, split))), np.concatenate([y[:, None], X], axis=1),
+                   delimiter=',', fmt=['%d'] + ['%.6f'] * sequence_length)
+
+
+@pytest.fixture
+def data_dir(tmpdir, monkeypatch):
+    # the files of `utils/constants.py` are relative to the current directory
+    monkeypatch.chdir(tmpdir)
+
+    lists = (TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST)
+    lengths = [len(values) for values in lists]
+
+    yield tmpdir.mkdir('extra')
+
+    for values, length in zip(lists, lengths):
+        del values[length:]
+
+
+def count_reads(monkeypatch):
+    reads = []
+    read_ucr_dataset = registry_utils._read_ucr_dataset
+
+    def counted(train_path, *args, **kwargs):
+        reads.append(train_path)
+        return read_ucr_dataset(train_path, *args, **kwargs)
+
+    monkeypatch.setattr(registry_utils, '_read_ucr_dataset', counted)
+    return reads
+
+
+def test_new_datasets_are_registered_after_the_known_ones(data_dir):
+    num_known = len(TRAIN_FILES)
+    write_dataset(data_dir, 'Synthetic', n_train=20, n_test=10, sequence_length=16, nb_classes=3)
+
+    registry = load_registry(str(data_dir), verbose=False)
+
+    info = registry.get('Synthetic')
+    assert info.id == num_known
+    assert (info.n_train, info.n_test, info.sequence_length, info.nb_classes) == (20, 10, 16, 3)
+
+    assert TRAIN_FILES[info.id] == str(data_dir.join('Synthetic_TRAIN'))
+    assert MAX_SEQUENCE_LENGTH_LIST[info.id] == 16
+    assert NB_CLASSES_LIST[info.id] == 3
+
+    # the files of the known datasets are missing
+    assert registry.dataset_map() == [('Synthetic', num_known)]
+
+
+def test_unreadable_dataset_is_not_registered(data_dir, monkeypatch):
+    num_known = len(TRAIN_FILES)
+    write_dataset(data_dir, 'Synthetic')
+
+    def read_ucr_dataset(*args, **kwargs):
+        raise ValueError('unreadable')
+
+    monkeypatch.setattr(registry_utils, '_read_ucr_dataset', read_ucr_dataset)
+
+    with pytest.raises(ValueError):
+        load_registry(str(data_dir), verbose=False)
+
+    # the lists never hold a dataset whose entry is not computed yet
+    assert len(TRAIN_FILES) == len(MAX_SEQUENCE_LENGTH_LIST) == len(NB_CLASSES_LIST) == num_known
+
+
+def test_index_is_only_computed_again_when_files_change(data_dir, monkeypatch):
+    num_known = len(TRAIN_FILES)
+    write_dataset(data_dir, 'Synthetic', n_train=20)
+    reads = count_reads(monkeypatch)
+
+    load_registry(str(data_dir), verbose=False)
+    assert len(reads) == 1
+    assert data_dir.join(REGISTRY_INDEX_NAME).check()
+
+    def reload():
+        del TRAIN_FILES[num_known:], TEST_FILES[num_known:]
+        del MAX_SEQUENCE_LENGTH_LIST[num_known:], NB_CLASSES_LIST[num_known:]
+        return load_registry(str(data_dir), verbose=False)
+
+    # unchanged files are read from the index
+    reload()
+    assert len(reads) == 1
+
+    # same size, new modification time
+    train_path = str(data_dir.join('Synthetic_TRAIN'))
+    stat = os.stat(train_path)
+    os.utime(train_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    reload()
+    assert len(reads) == 2
+
+    # new size
+    write_dataset(data_dir, 'Synthetic', n_train=30)
+
+    registry = reload()
+    assert len(reads) == 3
+    assert registry.get('Synthetic').n_train == 30
+
+
+def test_legacy_dataset_names(data_dir):
+    registry = load_registry(str(data_dir), verbose=False)
+
+    info = registry.get('Patterns')
+    assert info.file_name == 'Two_Patterns'
+    assert info.train_file == TRAIN_FILES[info.id]
+
+    # the name of the files finds the same dataset
+    assert registry.get('Two_Patterns') is info
+    assert 'Patterns' in registry
+
+    with pytest.raises(KeyError):
+        registry.get('NotADataset')
@@ -0,0 +1,134 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from utils import serving_utils
+from utils.serving_utils import MicroBatcher
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def recording_predict_fn(batch_sizes):
+    def predict_fn(X):
+        batch_sizes.append(len(X))
+        return X * 2.
+
+    return predict_fn
+
+
+def test_batch_runs_once_full_or_at_deadline():
+    batch_sizes = []
+    batcher = MicroBatcher(recording_predict_fn(batch_sizes), max_batch_size=2, max_delay=0.5)
+    batcher.start()
+
+    try:
+        start = time.time()
+        futures = [batcher.submit(np.full(3, i, dtype=np.float32)) for i in range(5)]
+
+        # two full batches run at once, the last request waits for its deadline
+        for i, future in enumerate(futures[:4]):
+            np.testing.assert_array_equal(future.result(timeout=0.4), np.full(3, 2. * i))
+
+        np.testing.assert_array_equal(futures[4].result(timeout=5.), np.full(3, 8.))
+        assert time.time() - start >= 0.5
+
+    finally:
+        batcher.stop()
+
+    assert batch_sizes == [2, 2, 1]
+
+
+def test_concurrent_requests_share_a_batch():
+    batch_sizes = []
+    batcher = MicroBatcher(recording_predict_fn(batch_sizes), max_batch_size=64, max_delay=0.2)
+    batcher.start()
+
+    results = {}
+
+    def request(i):
+        results[i] = batcher.predict(np.array([i], dtype=np.float32), timeout=5.)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    batcher.stop()
+
+    assert sum(batch_sizes) == 8
+    assert len(batch_sizes) < 8
+    assert all(results[i][0] == 2. * i for i in range(8))
+
+
+def test_latency_percentiles(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(serving_utils, 'time', clock)
+
+    def predict_fn(X):
+        # the request of value i takes i milliseconds
+        clock.now += X[0, 0] / 1000.
+        return X
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=1)
+    batcher.start()
+
+    for i in range(1, 101):
+        batcher.predict(np.array([i], dtype=np.float64), timeout=5.)
+
+    batcher.stop()
+
+    stats = batcher.stats()
+    assert stats['requests'] == 100
+    assert stats['batches'] == 100
+    assert stats['errors'] == 0
+    assert stats['mean_batch_size'] == 1.
+    assert stats['latency_p50_ms'] == pytest.approx(50.5)
+    assert stats['latency_p99_ms'] == pytest.approx(99.01)
+
+
+def test_errors_are_returned_to_every_request_of_the_batch():
+    def predict_fn(X):
+        raise ValueError('bad batch')
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=4, max_delay=0.05)
+    batcher.start()
+
+    futures = [batcher.submit(np.zeros(3)) for _ in range(3)]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5.)
+
+    batcher.stop()
+
+    stats = batcher.stats()
+    assert stats['errors'] == 3
+    assert stats['requests'] == 0
+    assert stats['latency_p50_ms'] is None
+
+
+def test_submit_after_stop_raises():
+    batcher = MicroBatcher(recording_predict_fn([]), max_batch_size=4, max_delay=1.)
+
+    with pytest.raises(RuntimeError):
+        batcher.submit(np.zeros(3))
+
+    batcher.start()
+    future = batcher.submit(np.ones(3))
+
+    # requests queued before the stop are still run
+    batcher.stop()
+    np.testing.assert_array_equal(future.result(timeout=0.), np.full(3, 2.))
+
+    with pytest.raises(RuntimeError):
+        batcher.submit(np.zeros(3))
@@ -0,0 +1,147 @@
+import json
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from utils import sweep_utils
+from utils.sweep_utils import JobLedger, order_jobs_by_cost, estimate_makespan, SweepProgress, successive_halving
+
+
+def write_weights_file(path):
+    with h5py.File(path, 'w') as f:
+        f.attrs['layer_names'] = np.array([b'dense_1'])
+
+
+def test_ledger_repairs_truncated_last_line(tmpdir):
+    path = str(tmpdir.join('ledger.jsonl'))
+
+    ledger = JobLedger(path)
+    ledger.mark_finished('a', result=1.)
+
+    # a crash while the record of 'b' was being written
+    with open(path, 'a') as f:
+        f.write('{"job": "b", "sta')
+
+    ledger = JobLedger(path)
+    assert ledger.result('a') == 1.
+    assert ledger.status('b') is None
+
+    # the next record is not swallowed by the truncated line
+    ledger.mark_finished('c', result=2.)
+
+    ledger = JobLedger(path)
+    assert ledger.result('a') == 1.
+    assert ledger.result('c') == 2.
+
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+
+    assert json.loads(lines[-1])['job'] == 'c'
+
+
+def test_ledger_finished_requires_valid_weights(tmpdir):
+    ledger = JobLedger(str(tmpdir.join('ledger.jsonl')))
+    weights_path = str(tmpdir.join('weights.h5'))
+
+    ledger.mark_finished('a', result=1.)
+
+    assert ledger.is_finished('a')
+    assert not ledger.is_finished('a', weights_path)
+
+    # left half written by a crash
+    with open(weights_path, 'wb') as f:
+        f.write(b'\x89HDF\r\n')
+
+    assert not ledger.is_finished('a', weights_path)
+
+    write_weights_file(weights_path)
+    assert ledger.is_finished('a', weights_path)
+
+
+def test_ledger_interrupted_jobs(tmpdir):
+    path = str(tmpdir.join('ledger.jsonl'))
+
+    ledger = JobLedger(path)
+    ledger.mark_started('a')
+    ledger.mark_started('b')
+    ledger.mark_started('c')
+    ledger.mark_finished('b', result=1.)
+    ledger.mark_failed('c', error='Traceback')
+
+    # the process running the sweep was killed
+    ledger = JobLedger(path)
+
+    assert ledger.is_interrupted('a')
+    assert not ledger.is_finished('a')
+    assert not ledger.is_interrupted('b')
+    assert not ledger.is_interrupted('c')
+    assert not ledger.is_finished('c')
+    assert not ledger.is_interrupted('d')
+
+
+def test_ledger_keeps_record_fields(tmpdir):
+    path = str(tmpdir.join('ledger.jsonl'))
+
+    JobLedger(path).mark_finished('a', result=1., best_loss=0.5)
+
+    record = JobLedger(path).record('a')
+    assert record['status'] == JobLedger.FINISHED
+    assert record['best_loss'] == 0.5
+    assert JobLedger(path).record('b') is None
+
+
+def test_successive_halving():
+    final_losses = {8: 3., 64: 1., 128: 2.}
+    calls = []
+
+    def train_fn(candidate, initial_epoch, epochs):
+        calls.append((candidate, initial_epoch, epochs))
+        return final_losses[candidate] * 100. / epochs
+
+    best, losses = successive_halving([8, 64, 128], train_fn, max_epochs=1000, min_epochs=10, eta=3)
+
+    assert best == 64
+    assert calls == [(8, 0, 10), (64, 0, 10), (128, 0, 10), (64, 10, 1000)]
+    assert losses == {8: 30., 64: 0.1, 128: 20.}
+
+
+def test_order_jobs_by_cost():
+    jobs, costs = order_jobs_by_cost(['a', 'b', 'c', 'd'], [2., 5., 1., 3.])
+
+    assert jobs == ['b', 'd', 'a', 'c']
+    assert costs == [5., 3., 2., 1.]
+
+
+def test_estimate_makespan():
+    assert estimate_makespan([], num_workers=2) == 0.
+    assert estimate_makespan([5., 3., 2., 1.], num_workers=1) == 11.
+
+    # each job goes to the first free worker : 5 | 3 + 2 + 1
+    assert estimate_makespan([5., 3., 2., 1.], num_workers=2) == 6.
+
+    # the longest job last leaves a worker idle : 1 + 3 | 2 + 5
+    assert estimate_makespan([1., 2., 3., 5.], num_workers=2) == 7.
+
+
+def test_sweep_progress(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(sweep_utils.time, 'time', lambda: now[0])
+
+    progress = SweepProgress({'a': 1., 'b': 1., 'c': 4.}, num_workers=2)
+    assert progress.remaining_time() is None
+
+    # 1 unit of cost in 10 seconds
+    now[0] = 110.
+    remaining = progress.update('a')
+
+    # the remaining cost of 5 takes 50 seconds, but a single worker needs
+    # 80 seconds for the 4 units of the largest job at half the rate
+    assert remaining == pytest.approx(80.)
+
+    now[0] = 120.
+    progress.update('b')
+    progress.update('c')
+
+    assert progress.remaining_time() == 0.
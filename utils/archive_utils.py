@@ -0,0 +1,144 @@
+import os
+import json
+import mmap
+
+import h5py
+import numpy as np
+
+
+# name of the archive file, looked up inside the data directory
+DATASET_ARCHIVE_NAME = 'ucr_archive.h5'
+
+# must be bumped whenever the layout of the archive changes
+DATASET_ARCHIVE_VERSION = 1
+
+# name of the HDF5 dataset which holds the index of the archive
+_INDEX_NAME = '_index'
+
+
+class DatasetArchive(object):
+    """
+    Read-only view of an archive holding many datasets in a single HDF5 file.
+
+    Every array of the archive is stored contiguously and uncompressed, and
+    the index of the archive records the byte offset, shape and type of each
+    of them. The index is read once when the archive is opened, after which
+    the whole file is memory-mapped, and any array is returned as a read-only
+    numpy view of the mapping. Looking up a dataset does not open, seek or
+    read any file, and processes which read the same archive share the same
+    pages of memory.
+
+    Use `write_dataset_archive` to build one.
+
+    Args:
+        path: Path to the archive file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with h5py.File(path, 'r') as f:
+            index = json.loads(f[_INDEX_NAME][()].tobytes().decode('utf8'))
+
+        if index.get('version') != DATASET_ARCHIVE_VERSION:
+            raise ValueError("Archive %s has version %s, expected %d" %
+                             (path, index.get('version'), DATASET_ARCHIVE_VERSION))
+
+        self._datasets = index['datasets']
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __contains__(self, name):
+        return name in self._datasets
+
+    def names(self):
+        """
+        Returns the sorted list of the names of the archived datasets.
+        """
+        return sorted(self._datasets.keys())
+
+    def attributes(self, name):
+        """
+        Returns the dict of attributes stored along with a dataset.
+        """
+        return self._datasets[name]['attributes']
+
+    def array(self, name, array_name):
+        """
+        Returns a single array of a dataset, as a read-only view of the archive.
+
+        Args:
+            name: Name of the dataset.
+            array_name: Name of the array, such as 'X_train'.
+
+        Returns:
+            A read-only numpy array.
+        """
+        entry = self._datasets[name]['arrays'][array_name]
+
+        if entry['offset'] is None:
+            # HDF5 does not allocate storage for empty arrays
+            return np.empty(entry['shape'], dtype=entry['dtype'])
+
+        return np.ndarray(entry['shape'], dtype=entry['dtype'], buffer=self._mmap, offset=entry['offset'])
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_dataset_archive(path, datasets):
+    """
+    Writes an archive of many datasets into a single HDF5 file, which can be
+    read with `DatasetArchive`. The archive is written into a temporary file
+    which is then renamed into place, so that readers never see a partially
+    written archive.
+
+    Args:
+        path: Path to the archive file.
+        datasets: Iterable of (name, arrays, attributes) triples, where arrays
+            is a dict of numpy arrays and attributes a JSON serializable dict.
+            Each dataset is written as soon as it is produced, so a generator
+            keeps a single dataset in memory at a time.
+
+    Returns:
+        The number of datasets written.
+    """
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    index = {}
+
+    try:
+        with h5py.File(temp_path, 'w') as f:
+            for name, arrays, attributes in datasets:
+                group = f.create_group(name)
+                entries = {}
+
+                for array_name, array in arrays.items():
+                    # contiguous and uncompressed, so that it can be memory-mapped
+                    array = np.ascontiguousarray(array)
+                    dataset = group.create_dataset(array_name, data=array)
+
+                    entries[array_name] = {
+                        'offset': dataset.id.get_offset(),
+                        'shape': list(array.shape),
+                        'dtype': array.dtype.str,
+                    }
+
+                index[name] = {'arrays': entries, 'attributes': attributes}
+
+            data = json.dumps({'version': DATASET_ARCHIVE_VERSION, 'datasets': index}, sort_keys=True)
+            f.create_dataset(_INDEX_NAME, data=np.frombuffer(data.encode('utf8'), dtype=np.uint8))
+
+        os.replace(temp_path, path)
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return len(index)
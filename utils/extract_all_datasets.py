@@ -1,36 +1,136 @@
 import os
 import glob
+import json
 import numpy as np
 import pandas as pd
-import shutil
 from joblib import Parallel, delayed
 
 path = '_data'
 
-if not os.path.exists(path):
-    os.makedirs(path)
+# extension of the binary dataset files, which `load_dataset_at` reads directly
+BINARY_EXTENSION = '.npz'
 
+# index of every extracted file, written inside the output directory
+INDEX_NAME = '_index.json'
 
-def process_file(fn):
+# must be bumped whenever the content of the binary files changes, so that
+# every file is converted again
+INDEX_VERSION = 1
+
+
+def dataset_file_name(fn):
+    # Adiac/Adiac_TRAIN.tsv -> Adiac_TRAIN
     file_name = os.path.split(fn)[-1]
-    file_name = file_name[:-4]
-    new_path = os.path.join(path, file_name)
+    return file_name[:-4]
+
+
+def output_path(fn):
+    return os.path.join(path, dataset_file_name(fn) + BINARY_EXTENSION)
+
+
+def is_up_to_date(fn, new_path):
+    return os.path.exists(new_path) and os.path.getmtime(new_path) >= os.path.getmtime(fn)
+
+
+def process_file(fn, index_entry=None):
+    """
+    Converts a single tab separated UCR file into a binary file holding the
+    series as one contiguous float64 block `X` of shape (samples, timesteps),
+    at the full precision of the text file, and the labels as an integer
+    array `y`. `load_dataset_at` casts the series to the type it returns.
+
+    Args:
+        fn: Path to the `.tsv` file.
+        index_entry: Entry of the index for this file, from a previous run.
+
+    Returns:
+        A tuple of (name of the file, index entry).
+    """
+    file_name = dataset_file_name(fn)
+    new_path = output_path(fn)
+
+    if index_entry is not None and is_up_to_date(fn, new_path):
+        return file_name, index_entry
 
     # Load the Tab seperated values in the dataset
-    df = pd.read_table(fn, header=None, encoding='latin-1')
+    df = pd.read_csv(fn, sep='\t', header=None, encoding='latin-1', dtype=np.float64)
 
-    # Fill the empty timesteps with 0.0
+    # remove all columns which are completely empty, and fill the empty timesteps with 0.0
+    df.dropna(axis=1, how='all', inplace=True)
     df.fillna(0.0, inplace=True)
 
-    # Save the prepared dataset as a CSV file that the dataset reader can use
-    df.to_csv(new_path, sep=',', index=False, header=None, encoding='latin-1')
+    values = df.values
+    y = values[:, 0]
+    X = np.ascontiguousarray(values[:, 1:], dtype=np.float64)
+
+    # UCR labels are integers, keep them as such whenever possible
+    if np.all(y == np.round(y)):
+        y = y.astype(np.int64)
+
+    # write into a temporary file first, so that an interrupted run never
+    # leaves a truncated file behind that looks up to date
+    temp_path = new_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, X=X, y=y)
+
+    os.replace(temp_path, new_path)
+
+    print("Converted file from %s to %s" % (fn, new_path))
+
+    index_entry = {
+        'source': fn,
+        'samples': int(X.shape[0]),
+        'timesteps': int(X.shape[1]),
+        'nb_classes': int(len(np.unique(y))),
+    }
+
+    return file_name, index_entry
+
+
+def read_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except ValueError:
+        return {}
+
+    if index.get('version') != INDEX_VERSION:
+        return {}
+
+    return index.get('datasets', {})
+
+
+def write_index(index_path, index):
+    temp_path = index_path + '.tmp'
+
+    with open(temp_path, 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'datasets': index}, f, indent=1, sort_keys=True)
+
+    os.replace(temp_path, index_path)
+
+
+if __name__ == '__main__':
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    index_path = os.path.join(path, INDEX_NAME)
+    index = read_index(index_path)
+
+    files = sorted(glob.glob("*/*.tsv"))
+    num_skipped = sum(1 for fn in files
+                      if dataset_file_name(fn) in index and is_up_to_date(fn, output_path(fn)))
 
-    # shutil.copy(fn, new_path)
-    print("Copied file from %s to %s" % (fn, new_path))
+    print("Converting %d files, %d are already up to date" % (len(files) - num_skipped, num_skipped))
 
+    # every file is converted independently, in its own worker
+    with Parallel(n_jobs=-1, backend='loky', verbose=1) as engine:
+        results = engine([delayed(process_file)(fn, index.get(dataset_file_name(fn))) for fn in files])
 
-with Parallel(n_jobs=-1, backend='loky', verbose=1) as engine:
-    engine([delayed(process_file)(fn) for fn in glob.glob("*/*.tsv")])
+    index.update(results)
+    write_index(index_path, index)
 
-print()
-print("Extracted all files. Transfer all these files to the `data` directory")
+    print()
+    print("Extracted all files. Transfer all these files to the `data` directory")
@@ -1,15 +1,42 @@
 import numpy as np
 import pandas as pd
 import os
+import re
+import shutil
+import hashlib
+import tempfile
+import warnings
 import matplotlib as mpl
 import matplotlib.pylab as plt
 
 mpl.style.use('seaborn-paper')
 
 from utils.constants import TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
+from utils.archive_utils import DatasetArchive, write_dataset_archive, DATASET_ARCHIVE_NAME
 
 
-def load_dataset_at(index, normalize_timeseries=False, verbose=True) -> (np.array, np.array):
+# name of the directory (created next to the dataset files) which holds the
+# parsed binary copies of each dataset
+DATASET_CACHE_DIR = '_cache'
+DATASET_CACHE_ARRAYS = ('X_train', 'y_train', 'X_test', 'y_test')
+
+# normalization schemes whose results are precomputed inside the cache
+# 1 : sample-wise z-normalization, 2 : dataset-wise z-normalization
+DATASET_CACHE_NORMALIZATIONS = (1, 2)
+
+# part of the cache key, must be bumped whenever the layout of the cache changes
+DATASET_CACHE_VERSION = 3
+
+# extension of the binary dataset files written by `utils/extract_all_datasets.py`,
+# which are read instead of the CSV files whenever they exist
+DATASET_BINARY_EXTENSION = '.npz'
+
+# archives opened by `load_dataset_at`, keyed by path
+_dataset_archives = {}
+
+
+def load_dataset_at(index, normalize_timeseries=False, verbose=True, use_cache=True,
+                    mmap=False, dtype=np.float32, archive=None) -> (np.array, np.array):
     """
     Loads a Univaraite UCR Dataset indexed by `utils.constants`.
 
@@ -24,124 +51,557 @@ def load_dataset_at(index, normalize_timeseries=False, verbose=True) -> (np.arra
                 z-normalization.
             If 2: Performs full dataset z-normalization.
         verbose: Whether to describe the dataset being loaded.
+        use_cache: Whether to use the binary dataset cache. On the first load,
+            the parsed train and test sets are stored as `.npy` files inside
+            a `_cache` directory next to the dataset files, keyed by the path,
+            modification time and size of both files. Sample-wise and dataset-wise
+            normalized copies of the series are stored next to the raw ones.
+            Later loads read the binary copies and skip the CSV parse entirely.
+        mmap: Whether to return X_train and X_test as read-only `np.memmap`
+            views of the cached files instead of in-memory arrays. Processes
+            which load the same dataset then share the same pages of memory.
+            Datasets which are not read from an archive require `use_cache`,
+            a ValueError is raised otherwise.
+        dtype: Floating point type of X_train and X_test. By default float32,
+            the type the models are trained in, which halves the memory used
+            by the series and spares Keras a cast of every batch. Use
+            np.float64 to keep the full precision of the dataset files for
+            analysis. The series are parsed and normalized in this type, and
+            each type has its own copy in the cache.
+        archive: Optional path to a dataset archive built by
+            `build_dataset_archive`. By default, the archive `ucr_archive.h5`
+            of the data directory is used if it exists. The dataset is read
+            from the archive unless it is missing from it, its files have
+            changed since the archive was built, or the archive holds its
+            series in another type than `dtype`. With `mmap`, the series are
+            returned as read-only views of the memory-mapped archive.
 
     Returns:
         A tuple of shape (X_train, y_train, X_test, y_test, is_timeseries).
         For legacy reasons, is_timeseries is always True.
     """
     assert index < len(TRAIN_FILES), "Index invalid. Could not load dataset at %d" % index
+
     if verbose: print("Loading train / test dataset : ", TRAIN_FILES[index], TEST_FILES[index])
 
-    if os.path.exists(TRAIN_FILES[index]):
-        df = pd.read_csv(TRAIN_FILES[index], header=None, encoding='latin-1')
+    is_timeseries = True # assume all input data is univariate time series
+
+    if normalize_timeseries:
+        normalize_timeseries = 2 if int(normalize_timeseries) == 2 else 1
+    else:
+        normalize_timeseries = 0
+
+    dataset = None
+
+    if archive is None:
+        archive = _default_archive_path(index)
+
+    if archive is not None:
+        dataset = _load_archived_dataset(archive, index, normalize_timeseries, mmap=mmap, dtype=dtype)
+        if dataset is not None and verbose: print("Loaded train / test dataset from archive : ", archive)
+
+    if dataset is None and use_cache:
+        train_path = _resolve_dataset_path(TRAIN_FILES[index])
+        test_path = _resolve_dataset_path(TEST_FILES[index])
+
+        mmap_mode = 'r' if mmap else None
+        cache_dir = _dataset_cache_dir(train_path, test_path, dtype)
+        dataset = _load_dataset_cache(cache_dir, normalize_timeseries, mmap_mode=mmap_mode)
+
+        if dataset is not None:
+            if verbose: print("Loaded train / test dataset from cache : ", cache_dir)
+
+        else:
+            raw_dataset = _read_ucr_dataset(train_path, test_path, verbose=verbose, dtype=dtype)
+            _save_dataset_cache(cache_dir, raw_dataset)
+
+            dataset = _load_dataset_cache(cache_dir, normalize_timeseries, mmap_mode=mmap_mode)
+
+            # the cache could not be written, use the parsed dataset directly
+            if dataset is None:
+                dataset = _normalize_dataset(*raw_dataset, normalize_timeseries=normalize_timeseries,
+                                             inplace=True)
+
+    elif dataset is None:
+        if mmap:
+            raise ValueError("Memory-mapped datasets are read from the dataset archive or cache, "
+                             "`mmap` requires `use_cache` unless the dataset is archived")
+
+        train_path = _resolve_dataset_path(TRAIN_FILES[index])
+        test_path = _resolve_dataset_path(TEST_FILES[index])
+
+        raw_dataset = _read_ucr_dataset(train_path, test_path, verbose=verbose, dtype=dtype)
+        dataset = _normalize_dataset(*raw_dataset, normalize_timeseries=normalize_timeseries, inplace=True)
 
-    elif os.path.exists(TRAIN_FILES[index][1:]):
-        df = pd.read_csv(TRAIN_FILES[index][1:], header=None, encoding='latin-1')
+    X_train, y_train, X_test, y_test = dataset
+    nb_classes = len(np.unique(y_test))
+
+    if verbose:
+        print()
+        print("Number of train samples : ", X_train.shape[0], "Number of test samples : ", X_test.shape[0])
+        print("Number of classes : ", nb_classes)
+        print("Sequence length : ", X_train.shape[-1])
+
+    return X_train, y_train, X_test, y_test, is_timeseries
+
+
+def _normalize_dataset(X_train, y_train, X_test, y_test, normalize_timeseries=0, inplace=False):
+    """
+    Normalizes the train and test sets of a dataset.
+
+    Args:
+        X_train: Train sequences.
+        y_train: Train labels.
+        X_test: Test sequences.
+        y_test: Test labels.
+        normalize_timeseries: Integer. 0 does not normalize the time series,
+            1 performs sample-wise z-normalization and 2 performs full dataset
+            z-normalization, using the statistics of the train set.
+        inplace: Whether to normalize X_train and X_test in place, instead of
+            returning normalized copies.
+
+    Returns:
+        A tuple of (X_train, y_train, X_test, y_test). The series keep their
+        floating point type, the statistics are computed in float64.
+    """
+    if not normalize_timeseries:
+        return X_train, y_train, X_test, y_test
+
+    if not inplace:
+        X_train = X_train.copy()
+        X_test = X_test.copy()
+
+    if normalize_timeseries == 2:
+        X_train_mean = X_train.mean(dtype=np.float64)
+        X_train_std = X_train.std(dtype=np.float64)
+
+        for X in (X_train, X_test):
+            X -= X_train_mean
+            X /= (X_train_std + 1e-8)
 
     else:
-        raise FileNotFoundError('File %s not found!' % (TRAIN_FILES[index]))
+        for X in (X_train, X_test):
+            X_mean = X.mean(axis=-1, keepdims=True, dtype=np.float64)
+            X_std = X.std(axis=-1, keepdims=True, dtype=np.float64)
 
-    is_timeseries = True # assume all input data is univariate time series
+            X -= X_mean.astype(X.dtype)
+            X /= (X_std + 1e-8).astype(X.dtype)
 
-    # remove all columns which are completely empty
-    df.dropna(axis=1, how='all', inplace=True)
+    return X_train, y_train, X_test, y_test
 
-    if not is_timeseries:
-        data_idx = df.columns[1:]
-        min_val = min(df.loc[:, data_idx].min())
-        if min_val == 0:
-            df.loc[:, data_idx] += 1
 
-    # fill all missing columns with 0
-    df.fillna(0, inplace=True)
+def _resolve_dataset_path(path):
+    """
+    Finds a dataset file, either at the path set inside `utils/constants.py`
+    or relative to the current directory. The binary copy of the file
+    written by `utils/extract_all_datasets.py` is preferred over the CSV file.
+
+    Args:
+        path: Path of the dataset file, as listed in `utils/constants.py`.
 
-    # cast all data into integer (int32)
-    if not is_timeseries:
-        df[df.columns] = df[df.columns].astype(np.int32)
+    Returns:
+        The path at which the file exists.
+    """
+    for candidate in (path, path[1:]):
+        if os.path.exists(candidate + DATASET_BINARY_EXTENSION):
+            return candidate + DATASET_BINARY_EXTENSION
 
-    # extract labels Y and normalize to [0 - (MAX - 1)] range
-    y_train = df[[0]].values
-    nb_classes = len(np.unique(y_train))
-    y_train = (y_train - y_train.min()) / (y_train.max() - y_train.min()) * (nb_classes - 1)
+        elif os.path.exists(candidate):
+            return candidate
 
-    # drop labels column from train set X
-    df.drop(df.columns[0], axis=1, inplace=True)
+    raise FileNotFoundError('File %s not found!' % (path))
 
-    X_train = df.values
 
-    if is_timeseries:
-        X_train = X_train[:, np.newaxis, :]
-        # scale the values
-        if normalize_timeseries:
-            normalize_timeseries = int(normalize_timeseries)
+def _read_ucr_split(path, dtype=np.float64):
+    """
+    Parses a single train or test split of a UCR dataset from its CSV file,
+    or reads it from its binary copy.
 
-            if normalize_timeseries == 2:
-                X_train_mean = X_train.mean()
-                X_train_std = X_train.std()
-                X_train = (X_train - X_train_mean) / (X_train_std + 1e-8)
+    Args:
+        path: Path to the comma separated dataset file, or to its binary
+            copy written by `utils/extract_all_datasets.py`.
+        dtype: Floating point type the series are parsed to.
 
-            else:
-                X_train_mean = X_train.mean(axis=-1, keepdims=True)
-                X_train_std = X_train.std(axis=-1, keepdims=True)
-                X_train = (X_train - X_train_mean) / (X_train_std + 1e-8)
+    Returns:
+        A tuple of (X, y), where X has the shape (samples, 1, timesteps)
+        and y holds the labels normalized to the [0 - (MAX - 1)] range.
+    """
+    if path.endswith(DATASET_BINARY_EXTENSION):
+        with np.load(path) as arrays:
+            X = arrays['X']
+            y = arrays['y'][:, np.newaxis]
 
-    if verbose: print("Finished loading train dataset..")
+        if X.dtype.itemsize < np.dtype(dtype).itemsize:
+            # the series were stored in a narrower type, an upcast would not
+            # restore the precision of the text file
+            text_path = path[:-len(DATASET_BINARY_EXTENSION)]
+            if os.path.exists(text_path):
+                return _read_ucr_split(text_path, dtype=dtype)
 
-    if os.path.exists(TEST_FILES[index]):
-        df = pd.read_csv(TEST_FILES[index], header=None, encoding='latin-1')
+            warnings.warn("%s holds %s series, convert the dataset again to load it as %s" %
+                          (path, X.dtype.name, np.dtype(dtype).name))
+
+        X = X.astype(dtype, copy=False)
 
-    elif os.path.exists(TEST_FILES[index][1:]):
-        df = pd.read_csv(TEST_FILES[index][1:], header=None, encoding='latin-1')
     else:
-        raise FileNotFoundError('File %s not found!' % (TEST_FILES[index]))
+        df = pd.read_csv(path, header=None, encoding='latin-1', dtype=dtype)
 
-    # remove all columns which are completely empty
-    df.dropna(axis=1, how='all', inplace=True)
+        # remove all columns which are completely empty
+        df.dropna(axis=1, how='all', inplace=True)
 
-    if not is_timeseries:
-        data_idx = df.columns[1:]
-        min_val = min(df.loc[:, data_idx].min())
-        if min_val == 0:
-            df.loc[:, data_idx] += 1
+        # fill all missing columns with 0
+        df.fillna(0, inplace=True)
 
-    # fill all missing columns with 0
-    df.fillna(0, inplace=True)
+        # extract labels Y
+        y = df[[0]].values
 
-    # cast all data into integer (int32)
-    if not is_timeseries:
-        df[df.columns] = df[df.columns].astype(np.int32)
+        # drop labels column from the set X
+        df.drop(df.columns[0], axis=1, inplace=True)
 
-    # extract labels Y and normalize to [0 - (MAX - 1)] range
-    y_test = df[[0]].values
-    nb_classes = len(np.unique(y_test))
-    y_test = (y_test - y_test.min()) / (y_test.max() - y_test.min()) * (nb_classes - 1)
+        X = df.values
 
-    # drop labels column from train set X
-    df.drop(df.columns[0], axis=1, inplace=True)
+    # normalize labels to [0 - (MAX - 1)] range
+    # labels are normalized in float64, so that they round trip to exact class ids
+    y = y.astype(np.float64)
+    nb_classes = len(np.unique(y))
+    y = (y - y.min()) / (y.max() - y.min()) * (nb_classes - 1)
 
-    X_test = df.values
+    X = X[:, np.newaxis, :]
 
-    if is_timeseries:
-        X_test = X_test[:, np.newaxis, :]
-        # scale the values
-        if normalize_timeseries:
-            normalize_timeseries = int(normalize_timeseries)
+    return X, y
 
-            if normalize_timeseries == 2:
-                X_test = (X_test - X_train_mean) / (X_train_std + 1e-8)
-            else:
-                X_test_mean = X_test.mean(axis=-1, keepdims=True)
-                X_test_std = X_test.std(axis=-1, keepdims=True)
-                X_test = (X_test - X_test_mean) / (X_test_std + 1e-8)
 
-    if verbose:
-        print("Finished loading test dataset..")
-        print()
-        print("Number of train samples : ", X_train.shape[0], "Number of test samples : ", X_test.shape[0])
-        print("Number of classes : ", nb_classes)
-        print("Sequence length : ", X_train.shape[-1])
+def _read_ucr_dataset(train_path, test_path, verbose=True, dtype=np.float64):
+    """
+    Parses the train and test splits of a UCR dataset from their CSV files.
 
-    return X_train, y_train, X_test, y_test, is_timeseries
+    Args:
+        train_path: Path to the train split of the dataset.
+        test_path: Path to the test split of the dataset.
+        verbose: Whether to describe the dataset being loaded.
+        dtype: Floating point type the series are parsed to.
+
+    Returns:
+        A tuple of (X_train, y_train, X_test, y_test).
+    """
+    X_train, y_train = _read_ucr_split(train_path, dtype=dtype)
+    if verbose: print("Finished loading train dataset..")
+
+    X_test, y_test = _read_ucr_split(test_path, dtype=dtype)
+    if verbose: print("Finished loading test dataset..")
+
+    return X_train, y_train, X_test, y_test
+
+
+def _dataset_cache_dir(train_path, test_path, dtype=np.float64):
+    """
+    Computes the cache directory of a dataset. The name of the directory
+    embeds a key built from the path, modification time and size of both
+    the train and test files, so that any change to them invalidates the
+    cache. Each floating point type of the series has its own directory.
+
+    Args:
+        train_path: Path to the train split of the dataset.
+        test_path: Path to the test split of the dataset.
+        dtype: Floating point type of the cached series.
+
+    Returns:
+        Path to the cache directory of this dataset.
+    """
+    key = hashlib.sha1(('v%d\n' % DATASET_CACHE_VERSION).encode('utf8'))
+    for path in (train_path, test_path):
+        stat = os.stat(path)
+        key.update(('%s|%d|%d\n' % (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)).encode('utf8'))
+
+    dataset_name = os.path.basename(train_path)
+    if dataset_name.endswith(DATASET_BINARY_EXTENSION):
+        dataset_name = dataset_name[:-len(DATASET_BINARY_EXTENSION)]
+
+    if dataset_name.endswith('_TRAIN'):
+        dataset_name = dataset_name[:-len('_TRAIN')]
+
+    cache_root = os.path.join(os.path.dirname(train_path), DATASET_CACHE_DIR)
+    return os.path.join(cache_root, '%s_%s_%s' % (dataset_name, np.dtype(dtype).name, key.hexdigest()[:16]))
+
+
+def _cache_array_names(normalize_timeseries=0):
+    """
+    Names of the cached arrays which hold a dataset under a given
+    normalization scheme.
+
+    Args:
+        normalize_timeseries: Integer. 0 for the raw series, 1 for sample-wise
+            and 2 for dataset-wise z-normalization.
+
+    Returns:
+        A tuple of the names of (X_train, y_train, X_test, y_test).
+    """
+    if not normalize_timeseries:
+        return DATASET_CACHE_ARRAYS
+
+    suffix = '_norm%d' % normalize_timeseries
+    return 'X_train' + suffix, 'y_train', 'X_test' + suffix, 'y_test'
+
+
+def _load_dataset_cache(cache_dir, normalize_timeseries=0, mmap_mode=None):
+    """
+    Loads the binary copy of a dataset, if it exists.
+
+    Args:
+        cache_dir: Cache directory of the dataset, computed by
+            `_dataset_cache_dir`.
+        normalize_timeseries: Integer. 0 loads the raw series, 1 the sample-wise
+            and 2 the dataset-wise z-normalized series.
+        mmap_mode: Optional memory map mode passed to `np.load`. If 'r', the
+            series are returned as read-only `np.memmap` views of the files.
+
+    Returns:
+        A tuple of (X_train, y_train, X_test, y_test), or None if the
+        dataset has not been cached yet.
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+
+    try:
+        return tuple(np.load(os.path.join(cache_dir, '%s.npy' % name), mmap_mode=mmap_mode)
+                     for name in _cache_array_names(normalize_timeseries))
+    except (IOError, ValueError):
+        # incomplete or corrupted cache, fall back to parsing the dataset
+        return None
+
+
+def _save_dataset_cache(cache_dir, arrays):
+    """
+    Writes the binary copy of a dataset, along with its normalized copies.
+    The arrays are written into a temporary directory which is then renamed
+    into place, so that several processes loading the same dataset never see
+    a partially written cache. Stale copies of the same dataset are removed.
+
+    Args:
+        cache_dir: Cache directory of the dataset, computed by
+            `_dataset_cache_dir`.
+        arrays: A tuple of the raw (X_train, y_train, X_test, y_test).
+    """
+    cache_root, cache_name = os.path.split(cache_dir)
+
+    # neither the type nor the key hold an underscore, unlike the dataset name
+    dataset_name, dtype_name, _ = cache_name.rsplit('_', 2)
+
+    # other keys of the same dataset and type, as well as caches written before
+    # the type was part of their name. The name must match exactly, so that the
+    # caches of datasets whose name starts with this one are kept.
+    stale_cache_name = re.compile(r'^%s_(%s_)?[0-9a-f]{16}$' % (re.escape(dataset_name), re.escape(dtype_name)))
+
+    try:
+        if not os.path.exists(cache_root):
+            os.makedirs(cache_root, exist_ok=True)
+
+        temp_dir = tempfile.mkdtemp(prefix='.%s_' % cache_name, dir=cache_root)
+
+        for name, array in zip(DATASET_CACHE_ARRAYS, arrays):
+            np.save(os.path.join(temp_dir, '%s.npy' % name), array)
+
+        for normalize_timeseries in DATASET_CACHE_NORMALIZATIONS:
+            X_train, _, X_test, _ = _normalize_dataset(*arrays, normalize_timeseries=normalize_timeseries)
+            X_train_name, _, X_test_name, _ = _cache_array_names(normalize_timeseries)
+
+            np.save(os.path.join(temp_dir, '%s.npy' % X_train_name), X_train)
+            np.save(os.path.join(temp_dir, '%s.npy' % X_test_name), X_test)
+
+        try:
+            os.rename(temp_dir, cache_dir)
+        except OSError:
+            # another process has already cached this dataset
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+    except OSError as e:
+        print("Could not write dataset cache at %s : %s" % (cache_dir, e))
+        return
+
+    for old_name in os.listdir(cache_root):
+        if old_name != cache_name and stale_cache_name.match(old_name):
+            shutil.rmtree(os.path.join(cache_root, old_name), ignore_errors=True)
+
+
+def build_dataset_archive(archive_path=None, dataset_ids=None, dtype=np.float32, verbose=True):
+    """
+    Packs many datasets into a single archive file, which `load_dataset_at`
+    then reads instead of the files of each dataset. The archive holds the
+    raw, sample-wise and dataset-wise normalized series of every dataset, so
+    any of them is a memory-mapped view of the one file, which suits shared
+    network storage better than the many files of the datasets and their
+    caches. The archive must be built again whenever a dataset file changes,
+    until then the files of that dataset are read instead.
+
+    Args:
+        archive_path: Path to the archive file. By default, `ucr_archive.h5`
+            inside the data directory.
+        dataset_ids: Optional list of the ids of the datasets to pack. By
+            default, every dataset whose files are present.
+        dtype: Floating point type of the archived series.
+        verbose: Whether to describe the datasets being packed.
+
+    Returns:
+        The path to the archive file.
+    """
+    if archive_path is None:
+        data_dir = _dataset_dir(0)
+        if data_dir is None:
+            raise FileNotFoundError('Data directory %s not found!' % os.path.dirname(TRAIN_FILES[0]))
+
+        archive_path = os.path.join(data_dir, DATASET_ARCHIVE_NAME)
+
+    if dataset_ids is None:
+        dataset_ids = range(len(TRAIN_FILES))
+
+    def archived_datasets():
+        for index in dataset_ids:
+            try:
+                train_path = _resolve_dataset_path(TRAIN_FILES[index])
+                test_path = _resolve_dataset_path(TEST_FILES[index])
+            except FileNotFoundError:
+                if verbose: print("Skipping missing dataset : ", TRAIN_FILES[index])
+                continue
+
+            if verbose: print("Packing dataset : ", TRAIN_FILES[index])
+
+            raw_dataset = _read_ucr_dataset(train_path, test_path, verbose=False, dtype=dtype)
+            arrays = dict(zip(DATASET_CACHE_ARRAYS, raw_dataset))
+
+            for normalize_timeseries in DATASET_CACHE_NORMALIZATIONS:
+                X_train, _, X_test, _ = _normalize_dataset(*raw_dataset, normalize_timeseries=normalize_timeseries)
+                X_train_name, _, X_test_name, _ = _cache_array_names(normalize_timeseries)
+
+                arrays[X_train_name] = X_train
+                arrays[X_test_name] = X_test
+
+            attributes = {'key': _dataset_file_key(train_path, test_path)}
+
+            yield _dataset_file_name(TRAIN_FILES[index]), arrays, attributes
+
+    num_datasets = write_dataset_archive(archive_path, archived_datasets())
+    if verbose: print("Packed %d datasets into %s" % (num_datasets, archive_path))
+
+    return archive_path
+
+
+def _dataset_dir(index):
+    """
+    Finds the directory of the files of a dataset, the same way
+    `_resolve_dataset_path` finds the files themselves.
+
+    Returns:
+        The path to the directory, or None if it does not exist.
+    """
+    data_dir = os.path.dirname(TRAIN_FILES[index])
+
+    if os.path.isdir(data_dir):
+        return data_dir
+
+    elif os.path.isdir(data_dir[1:]):
+        return data_dir[1:]
+
+    return None
+
+
+def _dataset_file_name(path):
+    # ../data//Adiac_TRAIN -> Adiac
+    return os.path.basename(path)[:-len('_TRAIN')]
+
+
+def _dataset_file_key(train_path, test_path):
+    key = []
+    for path in (train_path, test_path):
+        stat = os.stat(path)
+        key.append([stat.st_mtime_ns, stat.st_size])
+
+    return key
+
+
+def _default_archive_path(index):
+    data_dir = _dataset_dir(index)
+    if data_dir is None:
+        return None
+
+    archive_path = os.path.join(data_dir, DATASET_ARCHIVE_NAME)
+    return archive_path if os.path.exists(archive_path) else None
+
+
+def _open_archive(archive_path):
+    """
+    Opens a dataset archive, reusing the archive opened by a previous call
+    unless the file has been replaced since.
+    """
+    mtime = os.stat(archive_path).st_mtime_ns
+    archive_path = os.path.abspath(archive_path)
+
+    if archive_path in _dataset_archives:
+        archive, archive_mtime = _dataset_archives[archive_path]
+        if archive_mtime == mtime:
+            return archive
+
+        archive.close()
+
+    archive = DatasetArchive(archive_path)
+    _dataset_archives[archive_path] = (archive, mtime)
+
+    return archive
+
+
+def _load_archived_dataset(archive_path, index, normalize_timeseries=0, mmap=False, dtype=np.float32):
+    """
+    Loads a dataset from a dataset archive, if it holds an up to date copy.
+
+    Args:
+        archive_path: Path to the archive file.
+        index: Integer index of the dataset.
+        normalize_timeseries: Integer. 0 loads the raw series, 1 the sample-wise
+            and 2 the dataset-wise z-normalized series.
+        mmap: Whether to return read-only views of the archive instead of
+            in-memory copies.
+        dtype: Floating point type of X_train and X_test.
+
+    Returns:
+        A tuple of (X_train, y_train, X_test, y_test), or None if the archive
+        does not hold the dataset, holds an outdated copy of it, or holds
+        its series in another floating point type.
+    """
+    try:
+        archive = _open_archive(archive_path)
+    except (IOError, OSError, ValueError) as e:
+        print("Could not read dataset archive %s : %s" % (archive_path, e))
+        return None
+
+    name = _dataset_file_name(TRAIN_FILES[index])
+    if name not in archive:
+        return None
+
+    # the files of the dataset are optional, but must not have changed since
+    try:
+        key = _dataset_file_key(_resolve_dataset_path(TRAIN_FILES[index]),
+                                _resolve_dataset_path(TEST_FILES[index]))
+    except FileNotFoundError:
+        key = None
+
+    if key is not None and key != archive.attributes(name)['key']:
+        return None
+
+    # casting the archived series would not restore the precision they were
+    # archived without, so a different type is read from the dataset files
+    if archive.array(name, 'X_train').dtype != np.dtype(dtype):
+        return None
+
+    dataset = []
+    for array_name in _cache_array_names(normalize_timeseries):
+        array = archive.array(name, array_name)
+
+        if not mmap:
+            array = np.array(array)
+
+        dataset.append(array)
+
+    return tuple(dataset)
 
 
 def calculate_dataset_metrics(X_train):
@@ -222,7 +682,7 @@ def plot_dataset(dataset_id, seed=None, limit=None, cutoff=None,
             if choice not in ['pre', 'post']:
                 return
             else:
-                X_train, X_test = X_test(X_train, X_test, choice, dataset_id, sequence_length)
+                X_train, X_test = cutoff_sequence(X_train, X_test, choice, dataset_id, sequence_length)
 
         X_train_attention = None
         X_test_attention = None
@@ -0,0 +1,453 @@
+import json
+
+import h5py
+import numpy as np
+
+
+# default epsilon of the Keras BatchNormalization layer
+BATCHNORM_EPSILON = 1e-3
+
+
+class NumpyLSTMFCN(object):
+    """
+    Forward pass of a trained LSTM-FCN or ALSTM-FCN model, written with NumPy
+    only. It reads the weight files written by `train_model` and does not
+    import TensorFlow nor Keras, so that inference processes start quickly
+    and stay small.
+
+    The topology is the one built by `generate_lstmfcn` / `generate_alstmfcn`:
+    an LSTM or AttentionLSTM branch, and three Conv1D - BatchNormalization -
+    ReLU blocks followed by global average pooling, concatenated and fed to
+    the softmax classifier. The kind of recurrent layer and the shape of every
+    layer are inferred from the weight file. Each BatchNormalization layer is
+    folded into the kernel and bias of the Conv1D layer before it when the
+    weights are loaded.
+
+    The activations of the recurrent layer are read from the configuration of
+    the model stored in files written by `model.save`. Files written by
+    `model.save_weights` do not hold it, and the defaults of the layer in the
+    version of Keras which wrote the file are used instead : the recurrent
+    activation of the Keras LSTM layer is `hard_sigmoid` before Keras 2.3, and
+    `sigmoid` since. Models built with other activations must pass them.
+
+    Args:
+        weights_path: Path to a weight file, such as
+            `./weights/lstmfcn_8_cells_weights/Adiac_weights.h5`.
+        dtype: Floating point type the forward pass is computed in.
+        activation: Optional name of the activation of the recurrent layer,
+            which overrides the one found in the file.
+        recurrent_activation: Optional name of the recurrent activation of
+            the recurrent layer, which overrides the one found in the file.
+    """
+
+    def __init__(self, weights_path, dtype=np.float32, activation=None, recurrent_activation=None):
+        self.weights_path = weights_path
+        self.dtype = dtype
+
+        self.recurrent_type = None  # 'lstm' or 'attention_lstm'
+        self.recurrent_weights = None
+        self._recurrent_layer_name = None
+        self.recurrent_activations = None  # names of the activations of the recurrent layer
+        self.conv_weights = []  # conv weights, with the batchnorm that follows them folded in
+        self.dense_weights = None
+
+        self._build(load_weights(weights_path))
+
+        activations = _recurrent_activations(weights_path, self._recurrent_layer_name, self.recurrent_type)
+        if activation is not None:
+            activations['activation'] = activation
+        if recurrent_activation is not None:
+            activations['recurrent_activation'] = recurrent_activation
+
+        for name, value in activations.items():
+            if value not in ACTIVATIONS:
+                raise ValueError("Unsupported %s '%s' of layer %s, expected one of %s" %
+                                 (name, value, self._recurrent_layer_name, sorted(ACTIVATIONS.keys())))
+
+        self.recurrent_activations = activations
+
+    @property
+    def units(self):
+        return self.recurrent_weights['recurrent_kernel'].shape[0]
+
+    @property
+    def sequence_length(self):
+        return self.recurrent_weights['kernel'].shape[0]
+
+    @property
+    def nb_classes(self):
+        return self.dense_weights['kernel'].shape[1]
+
+    def predict(self, X, batch_size=128):
+        """
+        Computes the class probabilities of a batch of time series.
+
+        Args:
+            X: Numpy array of shape (samples, 1, timesteps), as fed to the
+                Keras model, or (samples, timesteps).
+            batch_size: Number of samples passed through the network at once.
+
+        Returns:
+            Numpy array of shape (samples, classes).
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        if X.ndim == 2:
+            X = X[:, np.newaxis, :]
+
+        assert X.shape[-1] == self.sequence_length, \
+            "Expected series of length %d, got %d" % (self.sequence_length, X.shape[-1])
+
+        outputs = [self._forward(X[i: i + batch_size]) for i in range(0, X.shape[0], batch_size)]
+
+        if len(outputs) == 0:
+            return np.zeros((0, self.nb_classes), dtype=self.dtype)
+
+        return np.concatenate(outputs, axis=0)
+
+    def predict_classes(self, X, batch_size=128):
+        """
+        Computes the most likely class of a batch of time series.
+
+        Args:
+            X: Numpy array of shape (samples, 1, timesteps) or (samples, timesteps).
+            batch_size: Number of samples passed through the network at once.
+
+        Returns:
+            Integer numpy array of shape (samples,).
+        """
+        return np.argmax(self.predict(X, batch_size=batch_size), axis=-1)
+
+    def _forward(self, X):
+        # recurrent branch, which sees the input as (samples, 1, timesteps)
+        activations = {name: ACTIVATIONS[value] for name, value in self.recurrent_activations.items()}
+
+        if self.recurrent_type == 'attention_lstm':
+            x = _attention_lstm(X, **dict(self.recurrent_weights, **activations))
+        else:
+            x = _lstm(X, **dict(self.recurrent_weights, **activations))
+
+        # convolution branch, which sees the input as (samples, timesteps, 1)
+        y = np.transpose(X, (0, 2, 1))
+        for conv_weights in self.conv_weights:
+            y = _conv1d(y, **conv_weights)
+            y = np.maximum(y, 0.)
+
+        y = np.mean(y, axis=1)
+
+        out = np.concatenate([x, y], axis=-1)
+        out = np.dot(out, self.dense_weights['kernel']) + self.dense_weights['bias']
+        return _softmax(out)
+
+    def _build(self, layers):
+        pending_conv = None
+
+        for layer_name, weights in layers:
+            weights = {name: value.astype(self.dtype) for name, value in weights.items()}
+
+            if 'attention_W' in weights:
+                self.recurrent_type = 'attention_lstm'
+                self.recurrent_weights = weights
+                self._recurrent_layer_name = layer_name
+
+            elif 'recurrent_kernel' in weights:
+                self.recurrent_type = 'lstm'
+                self.recurrent_weights = weights
+                self._recurrent_layer_name = layer_name
+
+            elif 'moving_mean' in weights:
+                assert pending_conv is not None, \
+                    "BatchNormalization layer %s does not follow a Conv1D layer" % layer_name
+                kernel, bias = fold_batchnorm_weights(pending_conv['kernel'], pending_conv.get('bias'),
+                                                      **weights)
+                self.conv_weights.append({'kernel': kernel, 'bias': bias})
+                pending_conv = None
+
+            elif 'kernel' in weights and weights['kernel'].ndim == 3:
+                # the previous conv is not followed by a batchnorm, as in a model folded by `fold_batchnorm`
+                if pending_conv is not None:
+                    self.conv_weights.append(pending_conv)
+                pending_conv = weights
+
+            elif 'kernel' in weights:
+                self.dense_weights = weights
+
+            else:
+                raise ValueError("Unsupported layer %s with weights %s" % (layer_name, list(weights.keys())))
+
+        if pending_conv is not None:
+            self.conv_weights.append(pending_conv)
+
+        if self.recurrent_weights is None or self.dense_weights is None or len(self.conv_weights) == 0:
+            raise ValueError("Weight file %s does not hold an LSTM-FCN or ALSTM-FCN model" % self.weights_path)
+
+
+def fold_batchnorm_weights(kernel, bias, moving_mean, moving_variance, gamma=None, beta=None,
+                           epsilon=BATCHNORM_EPSILON):
+    """
+    Folds the statistics of an inference mode BatchNormalization layer into
+    the kernel and bias of the convolution or dense layer which precedes it.
+
+    Args:
+        kernel: Kernel of the preceding layer, whose last axis holds the
+            output channels.
+        bias: Bias of the preceding layer, or None if it has no bias.
+        moving_mean: Moving mean of the BatchNormalization layer.
+        moving_variance: Moving variance of the BatchNormalization layer.
+        gamma: Scale of the BatchNormalization layer, or None if it is not scaled.
+        beta: Offset of the BatchNormalization layer, or None if it is not centered.
+        epsilon: Epsilon of the BatchNormalization layer.
+
+    Returns:
+        A tuple of (kernel, bias), such that the preceding layer computed with
+        them gives the output of the BatchNormalization layer.
+    """
+    scale = 1. / np.sqrt(moving_variance + epsilon)
+    if gamma is not None:
+        scale = scale * gamma
+
+    if bias is None:
+        bias = np.zeros_like(moving_mean)
+
+    folded_bias = (bias - moving_mean) * scale
+    if beta is not None:
+        folded_bias = folded_bias + beta
+
+    folded_kernel = kernel * scale
+    return folded_kernel.astype(kernel.dtype), folded_bias.astype(kernel.dtype)
+
+
+def load_weights(weights_path):
+    """
+    Reads the weights of every layer of a Keras weight file.
+
+    Args:
+        weights_path: Path to a weight file written by `model.save_weights`
+            or `model.save`.
+
+    Returns:
+        A list of (layer_name, weights) tuples in the order of the layers
+        of the model, skipping layers without weights. `weights` is a dict
+        which maps the short name of each weight (such as `kernel` or
+        `moving_mean`) to a numpy array.
+    """
+    layers = []
+
+    with h5py.File(weights_path, 'r') as f:
+        if 'model_weights' in f:
+            f = f['model_weights']
+
+        for layer_name in f.attrs['layer_names']:
+            layer_name = _decode(layer_name)
+            group = f[layer_name]
+
+            weights = {}
+            for weight_name in group.attrs['weight_names']:
+                weight_name = _decode(weight_name)
+                short_name = weight_name.split('/')[-1].split(':')[0]
+                weights[short_name] = group[weight_name][()]
+
+            if len(weights) > 0:
+                layers.append((layer_name, weights))
+
+    return layers
+
+
+def _recurrent_activations(weights_path, layer_name, recurrent_type):
+    """
+    Finds the names of the activations of the recurrent layer of a model,
+    from the configuration of the model stored in the file if there is one,
+    and from the defaults of the layer otherwise.
+
+    Returns:
+        A dict which maps `activation`, `recurrent_activation`, and for the
+        AttentionLSTM layer `attention_activation`, to activation names.
+    """
+    with h5py.File(weights_path, 'r') as f:
+        model_config = f.attrs.get('model_config')
+        keras_version = f.attrs.get('keras_version')
+
+        if keras_version is None and 'model_weights' in f:
+            keras_version = f['model_weights'].attrs.get('keras_version')
+
+    if recurrent_type == 'attention_lstm':
+        # defaults of `utils.layer_utils.AttentionLSTM`, whatever the version of Keras
+        activations = {'activation': 'tanh', 'recurrent_activation': 'hard_sigmoid', 'attention_activation': 'tanh'}
+    else:
+        keras_version = _decode(keras_version) if keras_version is not None else '2.0'
+        version = tuple(int(part) for part in keras_version.split('.')[:2] if part.isdigit())
+
+        activations = {'activation': 'tanh',
+                       'recurrent_activation': 'sigmoid' if version >= (2, 3) else 'hard_sigmoid'}
+
+    if model_config is not None:
+        for layer in json.loads(_decode(model_config))['config']['layers']:
+            if layer['config'].get('name', layer.get('name')) == layer_name:
+                for name in activations:
+                    if name in layer['config']:
+                        activations[name] = layer['config'][name]
+
+    return activations
+
+
+def _decode(name):
+    return name.decode('utf8') if isinstance(name, bytes) else name
+
+
+def _dot(x, w):
+    # np.dot only dispatches 2D operands to BLAS, so fold the leading axes together
+    out = np.dot(x.reshape(-1, x.shape[-1]), w)
+    return out.reshape(x.shape[:-1] + (w.shape[-1],))
+
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0., 1.)
+
+
+def _sigmoid(x):
+    # does not overflow for large negative inputs, unlike 1 / (1 + exp(-x))
+    return 0.5 * (1. + np.tanh(0.5 * x))
+
+
+def _linear(x):
+    return x
+
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+def _conv1d(x, kernel, bias=None):
+    """
+    Convolution with 'same' padding and stride 1, matching Keras Conv1D.
+
+    Args:
+        x: Input of shape (samples, timesteps, input channels).
+        kernel: Kernel of shape (kernel size, input channels, output channels).
+        bias: Optional bias of shape (output channels,).
+
+    Returns:
+        Output of shape (samples, timesteps, output channels).
+    """
+    kernel_size = kernel.shape[0]
+    timesteps = x.shape[1]
+
+    # same padding puts the extra zero of even kernel sizes on the right
+    pad_left = (kernel_size - 1) // 2
+    pad_right = kernel_size - 1 - pad_left
+    x = np.pad(x, ((0, 0), (pad_left, pad_right), (0, 0)), mode='constant')
+
+    # a single matrix product computes the contribution of every kernel tap at
+    # every padded timestep, the taps are then summed at their offsets
+    taps = _dot(x, np.concatenate(list(kernel), axis=-1))
+    taps = taps.reshape(x.shape[0], x.shape[1], kernel_size, kernel.shape[-1])
+
+    out = taps[:, 0: timesteps, 0, :].copy()
+    for k in range(1, kernel_size):
+        out += taps[:, k: k + timesteps, k, :]
+
+    if bias is not None:
+        out += bias
+
+    return out
+
+
+def _lstm(x, kernel, recurrent_kernel, bias=None, activation=np.tanh, recurrent_activation=_hard_sigmoid):
+    """
+    Keras LSTM layer, returning the last output.
+
+    Args:
+        x: Input of shape (samples, timesteps, input_dim).
+        kernel: Input kernel of shape (input_dim, 4 * units).
+        recurrent_kernel: Recurrent kernel of shape (units, 4 * units).
+        bias: Optional bias of shape (4 * units,).
+        activation: Activation function of the cell state and output.
+        recurrent_activation: Activation function of the gates.
+
+    Returns:
+        Last output of shape (samples, units).
+    """
+    units = recurrent_kernel.shape[0]
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    c = np.zeros((x.shape[0], units), dtype=x.dtype)
+
+    # the input projection does not depend on the state, compute it for every timestep at once
+    z_input = _dot(x, kernel)
+    if bias is not None:
+        z_input += bias
+
+    for t in range(x.shape[1]):
+        z = z_input[:, t, :] + np.dot(h, recurrent_kernel)
+        h, c = _lstm_gates(z, c, units, activation, recurrent_activation)
+
+    return h
+
+
+def _attention_lstm(x, kernel, recurrent_kernel, attention_kernel, attention_W, attention_U,
+                    attention_v, bias=None, attention_b=None, activation=np.tanh,
+                    recurrent_activation=_hard_sigmoid, attention_activation=np.tanh):
+    """
+    AttentionLSTM layer of `utils.layer_utils`, returning the last output.
+
+    Args:
+        x: Input of shape (samples, timesteps, input_dim).
+        kernel: Input kernel of shape (input_dim, 4 * units).
+        recurrent_kernel: Recurrent kernel of shape (units, 4 * units).
+        attention_kernel: Context vector kernel of shape (input_dim, 4 * units).
+        attention_W: Alignment model input weights of shape (input_dim, units).
+        attention_U: Alignment model recurrent weights of shape (units, units).
+        attention_v: Alignment model output weights of shape (units, 1).
+        bias: Optional bias of shape (4 * units,).
+        attention_b: Optional alignment model bias of shape (units,).
+        activation: Activation function of the cell state and output.
+        recurrent_activation: Activation function of the gates.
+        attention_activation: Activation function of the alignment model.
+
+    Returns:
+        Last output of shape (samples, units).
+    """
+    units = recurrent_kernel.shape[0]
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    c = np.zeros((x.shape[0], units), dtype=x.dtype)
+
+    # projections which do not depend on the state
+    att = _dot(x, attention_W)
+    z_input = _dot(x, kernel)
+    if bias is not None:
+        att += attention_b
+        z_input += bias
+
+    for t in range(x.shape[1]):
+        # alignment model
+        energy = attention_activation(np.dot(h, attention_U)[:, np.newaxis, :] + att)
+        energy = _dot(energy, attention_v)[..., 0]
+
+        alpha = np.exp(energy)
+        alpha /= np.sum(alpha, axis=1, keepdims=True)
+
+        # context vector
+        z_hat = np.sum(x * alpha[:, :, np.newaxis], axis=1)
+
+        z = z_input[:, t, :] + np.dot(h, recurrent_kernel) + np.dot(z_hat, attention_kernel)
+        h, c = _lstm_gates(z, c, units, activation, recurrent_activation)
+
+    return h
+
+
+def _lstm_gates(z, c, units, activation=np.tanh, recurrent_activation=_hard_sigmoid):
+    i = recurrent_activation(z[:, :units])
+    f = recurrent_activation(z[:, units: 2 * units])
+    c = f * c + i * activation(z[:, 2 * units: 3 * units])
+    o = recurrent_activation(z[:, 3 * units:])
+
+    h = o * activation(c)
+    return h, c
+
+
+# activations supported by the recurrent layers, by their Keras name
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    'sigmoid': _sigmoid,
+    'hard_sigmoid': _hard_sigmoid,
+    'linear': _linear,
+}
@@ -1,4 +1,9 @@
 import os
+import sys
+import json
+import time
+import resource
+import threading
 import numpy as np
 import pandas as pd
 import matplotlib as mpl
@@ -10,38 +15,54 @@ from sklearn.model_selection import GridSearchCV, train_test_split
 from skimage.transform import resize
 
 import warnings
+import h5py
 
 from keras.models import Model
-from keras.layers import Permute
+from keras.layers import Input, Permute, Conv1D
 from keras.optimizers import Adam
 from keras.utils import to_categorical
 from keras.preprocessing.sequence import pad_sequences
-from keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, LearningRateScheduler
+from keras.callbacks import Callback, ModelCheckpoint, ReduceLROnPlateau, LearningRateScheduler
 from keras.wrappers.scikit_learn import KerasClassifier
 from keras import backend as K
+from keras import __version__ as keras_version
 
 from utils.generic_utils import load_dataset_at, calculate_dataset_metrics, cutoff_choice, \
     cutoff_sequence, plot_dataset
 from utils.constants import MAX_SEQUENCE_LENGTH_LIST, TRAIN_FILES
+from utils.inference_utils import fold_batchnorm_weights
+from utils.runtime_utils import describe_runtime
 
 mpl.style.use('seaborn-paper')
 warnings.simplefilter('ignore', category=DeprecationWarning)
 
 
 if not os.path.exists('weights/'):
-    os.makedirs('weights/')
+    os.makedirs('weights/', exist_ok=True)
 
 
 def train_model(model: Model, dataset_id, dataset_prefix, epochs=50, batch_size=128, val_subset=None,
-                cutoff=None, normalize_timeseries=False, learning_rate=1e-3):
+                cutoff=None, normalize_timeseries=False, learning_rate=1e-3, dataset=None, initial_epoch=0,
+                stopping_patience=None, val_frequency=1, checkpoint_interval=None, record_metrics=True,
+                checkpoint_best=None):
     """
     Trains a provided Model, given a dataset id.
 
     Args:
-        model: A Keras Model.
+        model: A Keras Model, or a cell ensemble built by `build_cell_ensemble`.
+            The members of an ensemble share the optimizer, and a single
+            learning rate schedule and plateau stopping, which both monitor
+            the sum of the losses of the members. A member whose loss has
+            stopped improving therefore keeps its learning rate, and keeps
+            training, as long as the summed loss improves, so its weights
+            differ from those of a standalone run.
         dataset_id: Integer id representing the dataset index containd in
             `utils/constants.py`.
-        dataset_prefix: Name of the dataset. Used for weight saving.
+        dataset_prefix: Name of the dataset. Used for weight saving. For a cell
+            ensemble, a list holding the name of each member, in the order of
+            the members. The weights of each member are then saved on their
+            own, whenever its own loss improves, and can be loaded into a
+            standalone model.
         epochs: Number of epochs to train.
         batch_size: Size of each batch for training.
         val_subset: Optional integer id to subset the test set. To be used if
@@ -57,9 +78,49 @@ def train_model(model: Model, dataset_id, dataset_prefix, epochs=50, batch_size=
                 z-normalization.
             If 2: Performs full dataset z-normalization.
         learning_rate: Initial learning rate.
+        dataset: Optional tuple of (X_train, y_train, X_test, y_test, is_timeseries),
+            as returned by `load_dataset_at`. If provided, it is used instead
+            of loading the dataset again, and `normalize_timeseries` is ignored.
+        initial_epoch: Epoch at which to resume training, with `epochs` being
+            the index of the last epoch. If greater than 0 and the model has
+            already been trained by a previous call, the model is not compiled
+            again, so that the state of the optimizer and the current learning
+            rate are kept.
+        stopping_patience: Optional integer. If set, training ends once the
+            learning rate has reached its floor and the training loss has not
+            improved for `stopping_patience` epochs. Why and when training
+            stopped is written to `./weights/<dataset_prefix>_stopping.json`.
+            For a cell ensemble, the summed loss of the members is monitored,
+            and the same record is written for every member.
+            If None, training always runs for `epochs` epochs.
+        val_frequency: Integer. The test set is evaluated every `val_frequency`
+            epochs, and after the last epoch. The validation metrics are only
+            logged on those epochs. If 0, the test set is never evaluated
+            during training.
+        checkpoint_interval: Optional number of seconds. If set, the best
+            weights are kept in memory, and written to disk by a background
+            thread at most once every `checkpoint_interval` seconds, and at
+            the end of training. If None, the weight file is written every
+            time the training loss improves, blocking training meanwhile.
+        record_metrics: Whether to record the wall time, train and validation
+            time, throughput, checkpoint time and peak memory of every epoch
+            to `./weights/<dataset_prefix>_metrics.jsonl`. See `TrainingMetrics`.
+        checkpoint_best: Optional lowest training loss of the weights already
+            saved by a previous call, such as the previous run of a resumed
+            training. The weight file is then only overwritten by weights with
+            a lower loss. For a cell ensemble, a list holding the value of each
+            member. If None, the first epoch always writes the weight file.
+
+    Returns:
+        The Keras History object of the training run.
     """
-    X_train, y_train, X_test, y_test, is_timeseries = load_dataset_at(dataset_id,
-                                                                      normalize_timeseries=normalize_timeseries)
+    is_ensemble = isinstance(dataset_prefix, (list, tuple))
+    dataset_prefixes = list(dataset_prefix) if is_ensemble else [dataset_prefix]
+
+    if dataset is None:
+        dataset = load_dataset_at(dataset_id, normalize_timeseries=normalize_timeseries)
+
+    X_train, y_train, X_test, y_test, is_timeseries = dataset
     max_nb_words, sequence_length = calculate_dataset_metrics(X_train)
 
     if sequence_length != MAX_SEQUENCE_LENGTH_LIST[dataset_id]:
@@ -95,42 +156,153 @@ def train_model(model: Model, dataset_id, dataset_prefix, epochs=50, batch_size=
     else:
         factor = 1. / np.sqrt(2)
 
-    path_splits = os.path.split(dataset_prefix)
-    if len(path_splits) > 1:
-        base_path = os.path.join('weights', *path_splits)
+    for prefix in dataset_prefixes:
+        path_splits = os.path.split(prefix)
+        if len(path_splits) > 1:
+            base_path = os.path.join('weights', *path_splits)
+
+            if not os.path.exists(base_path):
+                os.makedirs(base_path)
 
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
+            base_path = os.path.join(base_path, path_splits[-1])
 
-        base_path = os.path.join(base_path, path_splits[-1])
+        else:
+            all_weights_path = os.path.join('weights', prefix)
+
+            if not os.path.exists(all_weights_path):
+                os.makedirs(all_weights_path)
+
+    if is_ensemble:
+        # each member is checkpointed on its own loss, into its own weight file
+        members = ensemble_members(model)
+        assert len(members) == len(dataset_prefixes), 'Expected a dataset prefix for each member of the ensemble'
 
+        checkpoint_bests = checkpoint_best if checkpoint_best is not None else [None] * len(members)
+
+        callback_list = [SubModelCallback(_model_checkpoint(prefix, '%s_loss' % output_name, checkpoint_interval,
+                                                            best),
+                                          member)
+                         for prefix, output_name, member, best in zip(dataset_prefixes, model.output_names,
+                                                                      members, checkpoint_bests)]
     else:
-        all_weights_path = os.path.join('weights', dataset_prefix)
+        callback_list = [_model_checkpoint(dataset_prefix, 'loss', checkpoint_interval, checkpoint_best)]
+
+    training_metrics = None
+    if record_metrics:
+        run_info = {'dataset_id': dataset_id, 'dataset_prefix': dataset_prefix, 'batch_size': batch_size,
+                    'initial_epoch': initial_epoch, 'epochs': epochs, 'val_frequency': val_frequency}
+        training_metrics = TrainingMetrics(["./weights/%s_metrics.jsonl" % prefix for prefix in dataset_prefixes],
+                                           num_samples=len(X_train), run_info=run_info)
 
-        if not os.path.exists(all_weights_path):
-            os.makedirs(all_weights_path)
+        # so far, the list only holds the checkpoints
+        callback_list = [training_metrics.timed(callback) for callback in callback_list]
 
-    model_checkpoint = ModelCheckpoint("./weights/%s_weights.h5" % dataset_prefix, verbose=1,
-                                       monitor='loss', save_best_only=True, save_weights_only=True)
+    # with a cell ensemble, the learning rate is shared by all members and
+    # follows the sum of their losses
     reduce_lr = ReduceLROnPlateau(monitor='loss', patience=100, mode='auto',
                                   factor=factor, cooldown=0, min_lr=1e-4, verbose=2)
 
-    callback_list = [model_checkpoint, reduce_lr]
-
-    optm = Adam(lr=learning_rate)
-
-    model.compile(optimizer=optm, loss='categorical_crossentropy', metrics=['accuracy'])
+    callback_list.append(reduce_lr)
 
     if val_subset is not None:
         X_test = X_test[:val_subset]
         y_test = y_test[:val_subset]
 
-    model.fit(X_train, y_train, batch_size=batch_size, epochs=epochs, callbacks=callback_list,
-              class_weight=class_weight, verbose=2, validation_data=(X_test, y_test))
+    if is_ensemble:
+        # every member is fed the same batches, and learns the same targets
+        y_train = [y_train] * len(dataset_prefixes)
+        y_test = [y_test] * len(dataset_prefixes)
+        class_weight = [class_weight] * len(dataset_prefixes)
+
+    validation_data = None
+    if val_frequency == 1:
+        validation_data = (X_test, y_test)
+
+    elif val_frequency > 1:
+        # placed first among the user callbacks, so that the others see the validation metrics
+        periodic_validation = PeriodicValidation((X_test, y_test), frequency=val_frequency,
+                                                 batch_size=batch_size, last_epoch=epochs - 1)
+        callback_list.insert(0, periodic_validation)
+
+    if stopping_patience is not None:
+        plateau_stopping = PlateauStopping(patience=stopping_patience, min_lr=reduce_lr.min_lr, monitor='loss',
+                                           record_path=["./weights/%s_stopping.json" % prefix
+                                                        for prefix in dataset_prefixes])
+        callback_list.append(plateau_stopping)
+
+    if training_metrics is not None:
+        # last, so that it sees the time spent by the other callbacks
+        callback_list.append(training_metrics)
+
+    print("Runtime : ", describe_runtime())
+
+    if initial_epoch == 0 or getattr(model, 'optimizer', None) is None:
+        optm = Adam(lr=learning_rate)
+
+        model.compile(optimizer=optm, loss='categorical_crossentropy', metrics=['accuracy'])
+
+    history = model.fit(X_train, y_train, batch_size=batch_size, epochs=epochs, callbacks=callback_list,
+                        class_weight=class_weight, verbose=2, validation_data=validation_data,
+                        initial_epoch=initial_epoch)
+
+    return history
+
+
+def _model_checkpoint(dataset_prefix, monitor, checkpoint_interval=None, best=None):
+    if checkpoint_interval is None:
+        checkpoint = ModelCheckpoint("./weights/%s_weights.h5" % dataset_prefix, verbose=1,
+                                     monitor=monitor, save_best_only=True, save_weights_only=True)
+    else:
+        checkpoint = AsyncModelCheckpoint("./weights/%s_weights.h5" % dataset_prefix, verbose=1,
+                                          monitor=monitor, flush_interval=checkpoint_interval)
+
+    # only weights better than the ones already saved overwrite the file
+    if best is not None:
+        checkpoint.best = best
+
+    return checkpoint
+
+
+def build_cell_ensemble(models, names=None):
+    """
+    Combines several models of the same input shape, such as the variants of
+    a model with different numbers of cells, into a single Model with one
+    output per model.
+
+    The models remain independent sub-networks which share no weights, but
+    they are fed the same input batches and trained by the same optimizer
+    steps, so that the cost of feeding batches and the per-step overhead of
+    Keras are paid once for all of them. Each model keeps its own weights,
+    and can still be used, saved or evaluated on its own.
+
+    Args:
+        models: List of Keras Models, with the same input shape.
+        names: Optional list of names of the models, which are used as the
+            names of the outputs of the ensemble.
+
+    Returns:
+        A Keras Model with one output per model, in order.
+    """
+    if names is not None:
+        for model, name in zip(models, names):
+            model.name = name
+
+    ip = Input(shape=models[0].input_shape[1:])
+    outputs = [model(ip) for model in models]
+
+    return Model(ip, outputs, name='cell_ensemble')
+
+
+def ensemble_members(model: Model):
+    """
+    Returns the models combined by `build_cell_ensemble`, in the order of
+    the outputs of the ensemble.
+    """
+    return [output._keras_history[0] for output in model.outputs]
 
 
 def evaluate_model(model: Model, dataset_id, dataset_prefix, batch_size=128, test_data_subset=None,
-                   cutoff=None, normalize_timeseries=False):
+                   cutoff=None, normalize_timeseries=False, dataset=None):
     """
     Evaluates a given Keras Model on the provided dataset.
 
@@ -151,12 +323,17 @@ def evaluate_model(model: Model, dataset_id, dataset_prefix, batch_size=128, tes
             If True / int not equal to 2, performs standard sample-wise
                 z-normalization.
             If 2: Performs full dataset z-normalization.
+        dataset: Optional tuple of (X_train, y_train, X_test, y_test, is_timeseries),
+            as returned by `load_dataset_at`. If provided, it is used instead
+            of loading the dataset again, and `normalize_timeseries` is ignored.
 
     Returns:
         The test set accuracy of the model.
     """
-    _, _, X_test, y_test, is_timeseries = load_dataset_at(dataset_id,
-                                                          normalize_timeseries=normalize_timeseries)
+    if dataset is None:
+        dataset = load_dataset_at(dataset_id, normalize_timeseries=normalize_timeseries)
+
+    _, _, X_test, y_test, is_timeseries = dataset
     max_nb_words, sequence_length = calculate_dataset_metrics(X_test)
 
     if sequence_length != MAX_SEQUENCE_LENGTH_LIST[dataset_id]:
@@ -194,14 +371,49 @@ def evaluate_model(model: Model, dataset_id, dataset_prefix, batch_size=128, tes
 
 
 def loss_model(model: Model, dataset_id, dataset_prefix, batch_size=128, train_data_subset=None,
-               cutoff=None, normalize_timeseries=False):
-    X_train, y_train, _, _, is_timeseries = load_dataset_at(dataset_id,
-                                                            normalize_timeseries=normalize_timeseries)
+               cutoff=None, normalize_timeseries=False, dataset=None, keep_state=False):
+    """
+    Computes the training set loss of a given Keras Model, from its saved weights.
+
+    Args:
+        model: A Keras Model.
+        dataset_id: Integer id representing the dataset index containd in
+            `utils/constants.py`.
+        dataset_prefix: Name of the dataset. Used for weight loading.
+        batch_size: Size of each batch for evaluation.
+        train_data_subset: Optional integer id to subset the train set.
+        cutoff: Unused.
+        normalize_timeseries: Bool / Integer. Determines whether to normalize
+            the timeseries.
+
+            If False, does not normalize the time series.
+            If True / int not equal to 2, performs standard sample-wise
+                z-normalization.
+            If 2: Performs full dataset z-normalization.
+        dataset: Optional tuple of (X_train, y_train, X_test, y_test, is_timeseries),
+            as returned by `load_dataset_at`. If provided, it is used instead
+            of loading the dataset again, and `normalize_timeseries` is ignored.
+        keep_state: Whether to leave a model which is being trained as it
+            was. The model is then not compiled again, so that the state of
+            its optimizer is kept, and its current weights are restored once
+            the saved ones have been evaluated, so that its training can be
+            resumed.
+
+    Returns:
+        The train set loss of the model.
+    """
+    if dataset is None:
+        dataset = load_dataset_at(dataset_id, normalize_timeseries=normalize_timeseries)
+
+    X_train, y_train, _, _, is_timeseries = dataset
 
     y_train = to_categorical(y_train, len(np.unique(y_train)))
 
-    optm = Adam(lr=1e-3)
-    model.compile(optimizer=optm, loss='categorical_crossentropy', metrics=['accuracy'])
+    current_weights = model.get_weights() if keep_state else None
+
+    if not keep_state or getattr(model, 'optimizer', None) is None:
+        optm = Adam(lr=1e-3)
+        model.compile(optimizer=optm, loss='categorical_crossentropy', metrics=['accuracy'])
 
     model.load_weights("./weights/%s_weights.h5" % dataset_prefix)
     print("Weights loaded from ", "./weights/%s_weights.h5" % dataset_prefix)
@@ -215,6 +427,9 @@ def loss_model(model: Model, dataset_id, dataset_prefix, batch_size=128, train_d
     print()
     print("Final Loss : ", loss)
 
+    if current_weights is not None:
+        model.set_weights(current_weights)
+
     return loss
 
 
@@ -267,7 +482,7 @@ def build_function(model, layer_names=None, outputs=None):
     return funcs
 
 
-def get_outputs(model, inputs, eval_functions, verbose=False):
+def get_outputs(model, inputs, eval_functions, verbose=False, learning_phase=1.):
     """
     Gets the outputs of the Keras model.
 
@@ -276,20 +491,63 @@ def get_outputs(model, inputs, eval_functions, verbose=False):
         inputs: Input numpy arrays.
         eval_functions: Keras functions for evaluation.
         verbose: Whether to print evaluation metrics.
+        learning_phase: Learning phase the functions are evaluated in.
+            1 for the training phase, 0 for the inference phase.
 
     Returns:
         List of outputs of the Keras Model.
     """
     if verbose: print('----- activations -----')
     outputs = []
-    layer_outputs = [func([inputs, 1.])[0] for func in eval_functions]
+    layer_outputs = [func([inputs, learning_phase])[0] for func in eval_functions]
     for layer_activations in layer_outputs:
         outputs.append(layer_activations)
     return outputs
 
 
+def _extract_attention_vectors(model, eval_functions, X, batch_size=256):
+    """
+    Computes the attention vectors of the Attention LSTM for a set of samples,
+    one minibatch at a time. Each vector is min-max rescaled to the [-1, 1]
+    range and resized to the length of the input sequence.
+
+    Args:
+        model: an Attention LSTM-FCN Model.
+        eval_functions: Keras functions which return the attention vectors,
+            built by `build_function`.
+        X: Input sequences of shape (samples, 1, timesteps).
+        batch_size: Number of samples processed at once.
+
+    Returns:
+        The attention vectors, of shape (samples, 1, timesteps).
+    """
+    sequence_length = X.shape[-1]
+    attention_vectors = []
+
+    for i in range(0, X.shape[0], batch_size):
+        activations = get_outputs(model, X[i: i + batch_size], eval_functions, verbose=False)[0]
+        activations = activations.reshape((activations.shape[0], -1))
+
+        # rescale each sample separately
+        min_val = activations.min(axis=1, keepdims=True)
+        max_val = activations.max(axis=1, keepdims=True)
+
+        attention_vector = (activations - min_val) / (max_val - min_val)
+        attention_vector = (attention_vector * 2.) - 1.
+
+        # resize all the samples at once. The batch axis keeps its size, so
+        # neither the interpolation nor the anti aliasing mix samples together
+        output_shape = [attention_vector.shape[0], sequence_length, 1]
+        attention_vector = resize(attention_vector[..., np.newaxis], output_shape, mode='reflect', anti_aliasing=True)
+
+        attention_vectors.append(attention_vector.reshape((-1, 1, sequence_length)))
+
+    return np.concatenate(attention_vectors, axis=0)
+
+
 def visualize_context_vector(model: Model, dataset_id, dataset_prefix, cutoff=None, limit=None,
-                             normalize_timeseries=False, visualize_sequence=True, visualize_classwise=False):
+                             normalize_timeseries=False, visualize_sequence=True, visualize_classwise=False,
+                             batch_size=256):
     """
     Visualize the Context Vector of the Attention LSTM.
 
@@ -317,6 +575,8 @@ def visualize_context_vector(model: Model, dataset_id, dataset_prefix, cutoff=No
             seperated by class. When doing so, `limit` is multiplied by
             the number of classes so it is better to set `limit` to 1 in
             such cases.
+        batch_size: Number of samples whose context vectors are computed
+            at once.
     """
 
     X_train, y_train, X_test, y_test, is_timeseries = load_dataset_at(dataset_id,
@@ -351,47 +611,9 @@ def visualize_context_vector(model: Model, dataset_id, dataset_prefix, cutoff=No
     attention_output = model.layers[i].call(model.input)
 
     eval_functions = build_function(model, attn_lstm_layer.name, outputs=[attention_output])
-    train_attention_vectors = []
-    test_attention_vectors = []
-
-    output_shape = [X_train.shape[-1], 1, 1]
 
-    for i in range(X_train.shape[0]):
-        activations = get_outputs(model,
-                                  X_train[i, :, :][np.newaxis, ...],
-                                  eval_functions,
-                                  verbose=False)[0]
-
-        # print("activations", activations.shape)
-        attention_vector = activations.reshape((-1, 1, 1))
-
-        attention_vector = (attention_vector - attention_vector.min()) / (
-                attention_vector.max() - attention_vector.min())
-        attention_vector = (attention_vector * 2.) - 1.
-
-        attention_vector = resize(attention_vector, output_shape, mode='reflect', anti_aliasing=True)
-        attention_vector = attention_vector.reshape([1, -1])
-        train_attention_vectors.append(attention_vector)
-
-    for i in range(X_test.shape[0]):
-        activations = get_outputs(model,
-                                  X_test[i, :, :][np.newaxis, ...],
-                                  eval_functions,
-                                  verbose=False)[0]
-
-        # print("activations", activations.shape)
-        attention_vector = activations.reshape((-1, 1, 1))
-
-        attention_vector = (attention_vector - attention_vector.min()) / (
-                attention_vector.max() - attention_vector.min())
-        attention_vector = (attention_vector * 2.) - 1.
-
-        attention_vector = resize(attention_vector, output_shape, mode='reflect', anti_aliasing=True)
-        attention_vector = attention_vector.reshape([1, -1])
-        test_attention_vectors.append(attention_vector)
-
-    train_attention_vectors = np.array(train_attention_vectors)
-    test_attention_vectors = np.array(test_attention_vectors)
+    train_attention_vectors = _extract_attention_vectors(model, eval_functions, X_train, batch_size=batch_size)
+    test_attention_vectors = _extract_attention_vectors(model, eval_functions, X_test, batch_size=batch_size)
 
     print("Train Attention Vectors Shape :", train_attention_vectors.shape)
     print("Test Attentin Vectors Shape :", test_attention_vectors.shape)
@@ -424,7 +646,8 @@ def visualize_context_vector(model: Model, dataset_id, dataset_prefix, cutoff=No
 
 
 def write_context_vector(model: Model, dataset_id, dataset_prefix, cutoff=None, limit=None,
-                         normalize_timeseries=False, visualize_sequence=True, visualize_classwise=False):
+                         normalize_timeseries=False, visualize_sequence=True, visualize_classwise=False,
+                         batch_size=256):
     """ Same as visualize_context_vector, but writes the context vectors to a file. Unused. """
 
     X_train, y_train, X_test, y_test, is_timeseries = load_dataset_at(dataset_id,
@@ -459,50 +682,12 @@ def write_context_vector(model: Model, dataset_id, dataset_prefix, cutoff=None,
     attention_output = model.layers[i].call(model.input)
 
     eval_functions = build_function(model, attn_lstm_layer.name, outputs=[attention_output])
-    train_attention_vectors = []
-    test_attention_vectors = []
 
     if not os.path.exists('lstm_features/'):
         os.makedirs('lstm_features/')
 
-    output_shape = [X_train.shape[-1], 1, 1]
-
-    for i in range(X_train.shape[0]):
-        activations = get_outputs(model,
-                                  X_train[i, :, :][np.newaxis, ...],
-                                  eval_functions,
-                                  verbose=False)[0]
-
-        # print("activations", activations.shape)
-        attention_vector = activations.reshape((-1, 1, 1))
-
-        attention_vector = (attention_vector - attention_vector.min()) / (
-                attention_vector.max() - attention_vector.min())
-        attention_vector = (attention_vector * 2.) - 1.
-
-        attention_vector = resize(attention_vector, output_shape, mode='reflect', anti_aliasing=True)
-        attention_vector = attention_vector.reshape([1, -1])
-        train_attention_vectors.append(attention_vector)
-
-    for i in range(X_test.shape[0]):
-        activations = get_outputs(model,
-                                  X_test[i, :, :][np.newaxis, ...],
-                                  eval_functions,
-                                  verbose=False)[0]
-
-        # print("activations", activations.shape)
-        attention_vector = activations.reshape((-1, 1, 1))
-
-        attention_vector = (attention_vector - attention_vector.min()) / (
-                attention_vector.max() - attention_vector.min())
-        attention_vector = (attention_vector * 2.) - 1.
-
-        attention_vector = resize(attention_vector, output_shape, mode='reflect', anti_aliasing=True)
-        attention_vector = attention_vector.reshape([1, -1])
-        test_attention_vectors.append(attention_vector)
-
-    train_attention_vectors = np.array(train_attention_vectors)
-    test_attention_vectors = np.array(test_attention_vectors)
+    train_attention_vectors = _extract_attention_vectors(model, eval_functions, X_train, batch_size=batch_size)
+    test_attention_vectors = _extract_attention_vectors(model, eval_functions, X_test, batch_size=batch_size)
 
     print("Train Attention Vectors Shape :", train_attention_vectors.shape)
     print("Test Attentin Vectors Shape :", test_attention_vectors.shape)
@@ -643,8 +828,43 @@ def visualize_cam(model: Model, dataset_id, dataset_prefix, class_id,
 
 
 def write_cam(model: Model, dataset_id, dataset_prefix,
-              cutoff=None, normalize_timeseries=False):
-    """ Same as visualize_cam, but writes the result data to a file. """
+              cutoff=None, normalize_timeseries=False, batch_size=256, inference_mode=False):
+    """
+    Same as visualize_cam, but writes the class activation maps of every
+    sample of the test set to a file.
+
+    The class activation maps of a batch are computed with a single einsum,
+    and each batch is appended to the output file as soon as it is ready, so
+    memory use does not grow with the size of the test set.
+
+    By default, the activations of the final convolution layer are computed
+    in the training phase, as they always have been, so that the maps match
+    the ones written by earlier runs. BatchNormalization then normalizes with
+    the statistics of the batch, so each sample is evaluated on its own. With
+    `inference_mode`, the activations are computed in the inference phase,
+    with the moving statistics of BatchNormalization, a whole minibatch at a
+    time. The maps then no longer depend on the batch, but differ from the
+    ones of earlier runs.
+
+    Args:
+        model: A Keras Model.
+        dataset_id: Integer id representing the dataset index containd in
+            `utils/constants.py`.
+        dataset_prefix: Name of the dataset. Used for weight saving.
+        cutoff: Optional integer which slices of the first `cutoff` timesteps
+            from the input signal.
+        normalize_timeseries: Bool / Integer. Determines whether to normalize
+            the timeseries.
+
+            If False, does not normalize the time series.
+            If True / int not equal to 2, performs standard sample-wise
+                z-normalization.
+            If 2: Performs full dataset z-normalization.
+        batch_size: Number of samples whose class activation maps are
+            computed at once, in inference mode.
+        inference_mode: Whether to compute the activations in the inference
+            phase instead of the training phase.
+    """
 
     _, _, X_test, y_test, is_timeseries = load_dataset_at(dataset_id,
                                                           normalize_timeseries=normalize_timeseries)
@@ -660,7 +880,7 @@ def write_cam(model: Model, dataset_id, dataset_prefix,
         if choice not in ['pre', 'post']:
             return
         else:
-            X_train, _ = cutoff_sequence(_, X_test, choice, dataset_id, sequence_length)
+            _, X_test = cutoff_sequence(None, X_test, choice, dataset_id, sequence_length)
 
     print("Weights path : ", "./weights/%s_weights.h5" % dataset_prefix)
     model.load_weights("./weights/%s_weights.h5" % dataset_prefix)
@@ -670,14 +890,12 @@ def write_cam(model: Model, dataset_id, dataset_prefix,
     conv_layers = [layer for layer in model.layers if layer.__class__.__name__ == 'Conv1D']
 
     final_conv = conv_layers[-1].name
-    final_softmax = model.layers[-1].name
-    out_names = [final_conv, final_softmax]
 
-    eval_functions = build_function(model, out_names)
+    eval_functions = build_function(model, [final_conv])
 
     parts = os.path.split(dataset_prefix)
     if len(parts) > 1:
-        basepath = os.path.join('cam_features', os.pathsep.join(parts[:-1]))
+        basepath = os.path.join('cam_features', *parts[:-1])
         dataset_name = parts[-1]
     else:
         basepath = 'cam_features/'
@@ -686,32 +904,51 @@ def write_cam(model: Model, dataset_id, dataset_prefix,
     if not os.path.exists(basepath):
         os.makedirs(basepath)
 
-    cam_features = []
+    num_samples = X_test.shape[0]
+
+    if inference_mode:
+        learning_phase = 0.
+    else:
+        # in the training phase the batch statistics of BatchNormalization
+        # would mix the samples of a batch together
+        learning_phase = 1.
+        batch_size = 1
+
+    with open(basepath + '/%s_features_mean_unnormalized.csv' % dataset_name, 'w') as file:
+        for i in range(0, num_samples, batch_size):
+            print("Samples %d - %d of %d running" % (i + 1, min(i + batch_size, num_samples), num_samples))
 
-    for i in range(X_test.shape[0]):
-        print("Sample %d running" % (i + 1))
-        y_id = y_test[i, 0]
-        sequence_input = X_test[[i], :, :]
+            conv_out = get_outputs(model, X_test[i: i + batch_size], eval_functions,
+                                   learning_phase=learning_phase)[0]
+            class_ids = y_test[i: i + batch_size, 0].astype('int32')
 
-        conv_out, predictions = get_outputs(model, sequence_input, eval_functions)
+            conv_cam = _class_activation_maps(conv_out, class_weights, class_ids)
 
-        conv_out = conv_out[0, :, :]  # (T, C)
+            pd.DataFrame(conv_cam).to_csv(file, header=False, index=False)
 
-        conv_out = conv_out.transpose((1, 0))  # (C, T)
-        conv_channels = conv_out.shape[0]
-        conv_cam = class_weights[:conv_channels, [int(y_id)]] * conv_out
-        conv_cam = np.mean(conv_cam, axis=0)
+    print("Num features = ", (num_samples, X_test.shape[-1]))
 
-        conv_cam = conv_cam.reshape((-1, 1))
-        cam_features.append(conv_cam)
 
-    cam_features = np.concatenate(cam_features, -1).transpose()
-    print("Num features = ", cam_features.shape)
+def _class_activation_maps(conv_out, class_weights, class_ids):
+    """
+    Computes the class activation maps of a batch of samples.
+
+    Args:
+        conv_out: Output of the final convolution layer, of shape
+            (samples, timesteps, channels).
+        class_weights: Kernel of the final softmax layer.
+        class_ids: Integer class of each sample, whose activation map
+            is computed.
 
-    conv_cam_df = pd.DataFrame(cam_features)
+    Returns:
+        The class activation maps of shape (samples, timesteps), averaged
+        over the convolution channels.
+    """
+    conv_channels = conv_out.shape[-1]
+    sample_weights = class_weights[:conv_channels, class_ids]  # (C, samples)
 
-    conv_cam_df.to_csv(basepath + '/%s_features_mean_unnormalized.csv' % dataset_name,
-                       header=False, index=False)
+    conv_cam = np.einsum('btc,cb->bt', conv_out, sample_weights)
+    return conv_cam / conv_channels
 
 
 def visualize_filters(model: Model, dataset_id, dataset_prefix,
@@ -915,6 +1152,594 @@ def extract_features(model: Model, dataset_id, dataset_prefix,
     print()
 
 
+def fold_batchnorm(model: Model):
+    """
+    Builds an inference-only copy of a trained Model, in which every
+    BatchNormalization layer that directly follows a Conv1D layer is folded
+    into the kernel and bias of that Conv1D layer.
+
+    The folded model gives the same predictions as the original one in the
+    inference phase, with one layer less per convolution block. Layers other
+    than the folded Conv1D layers are shared with the original model, so the
+    folded model must not be trained.
+
+    Args:
+        model: A trained Keras Model.
+
+    Returns:
+        A new Keras Model, with the folded weights.
+    """
+    consumers = {}
+    for layer in model.layers:
+        for inbound_layer in _inbound_layers(layer):
+            consumers.setdefault(inbound_layer.name, []).append(layer)
+
+    # map each layer of the original model to the output of the folded model
+    outputs = {}
+    folded_convs = {}
+
+    for layer in model.layers:
+        inbound_layers = _inbound_layers(layer)
+
+        if len(inbound_layers) == 0:
+            outputs[layer.name] = layer.output
+            continue
+
+        inputs = [outputs[inbound_layer.name] for inbound_layer in inbound_layers]
+        inputs = inputs[0] if len(inputs) == 1 else inputs
+
+        if layer.__class__.__name__ == 'Conv1D' and _is_foldable(layer, consumers.get(layer.name, [])):
+            # applied once the statistics of the batchnorm which follows are known
+            folded_convs[layer.name] = inputs
+            continue
+
+        if layer.__class__.__name__ == 'BatchNormalization' and inbound_layers[0].name in folded_convs:
+            conv = inbound_layers[0]
+            conv_weights = conv.get_weights()
+
+            bn_weights = dict(zip([w.name.split('/')[-1].split(':')[0] for w in layer.weights],
+                                  layer.get_weights()))
+            kernel, bias = fold_batchnorm_weights(conv_weights[0],
+                                                  conv_weights[1] if conv.use_bias else None,
+                                                  epsilon=layer.epsilon, **bn_weights)
+
+            config = conv.get_config()
+            config['use_bias'] = True
+            folded_conv = Conv1D.from_config(config)
+
+            outputs[layer.name] = folded_conv(folded_convs[conv.name])
+            folded_conv.set_weights([kernel, bias])
+            continue
+
+        outputs[layer.name] = layer(inputs)
+
+    return Model(model.inputs, [outputs[layer.name] for layer in model.output_layers])
+
+
+def _inbound_layers(layer):
+    nodes = getattr(layer, '_inbound_nodes', None)
+    if nodes is None:
+        nodes = layer.inbound_nodes
+
+    return nodes[0].inbound_layers
+
+
+def _is_foldable(conv, consumers):
+    # the conv output must only feed a single batchnorm over the channel axis
+    if len(consumers) != 1 or consumers[0].__class__.__name__ != 'BatchNormalization':
+        return False
+
+    return conv.activation.__name__ == 'linear' and consumers[0].axis in (-1, 2)
+
+
+class AsyncModelCheckpoint(Callback):
+    """
+    Keeps the best weights of the model in memory, and writes them to disk
+    from a background thread, so that training does not wait for the file
+    to be written.
+
+    The weights are written at most once every `flush_interval` seconds, and
+    always at the end of training. The file has the layout of
+    `model.save_weights`, and is written to a temporary file which then
+    replaces the previous one, so that it is never left half written.
+
+    Args:
+        filepath: Path to the weight file.
+        monitor: Quantity to be monitored. Lower is better.
+        flush_interval: Minimum number of seconds between two writes.
+        verbose: Verbosity mode, 0 or 1.
+    """
+
+    def __init__(self, filepath, monitor='loss', flush_interval=60., verbose=0):
+        super(AsyncModelCheckpoint, self).__init__()
+        self.filepath = filepath
+        self.monitor = monitor
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+
+        self.best = np.inf
+        self._pending = None  # best weights not yet written to disk
+        self._writer = None
+        self._writer_error = None
+        self._last_flush = -np.inf
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        current = logs.get(self.monitor)
+
+        if current is None:
+            warnings.warn('Can save best model only with %s available, skipping.' % self.monitor, RuntimeWarning)
+            return
+
+        if current < self.best:
+            if self.verbose > 0:
+                print('\nEpoch %05d: %s improved from %0.5f to %0.5f, keeping weights for %s'
+                      % (epoch + 1, self.monitor, self.best, current, self.filepath))
+
+            self.best = current
+            self._pending = _snapshot_weights(self.model)
+
+        if self._pending is not None and time.time() - self._last_flush >= self.flush_interval:
+            if self._writer is None or not self._writer.is_alive():
+                self._flush(background=True)
+
+    def on_train_end(self, logs=None):
+        if self._writer is not None:
+            self._writer.join()
+
+        if self._pending is not None:
+            self._flush(background=False)
+
+        if self._writer_error is not None:
+            raise self._writer_error
+
+    def _flush(self, background):
+        layers, self._pending = self._pending, None
+        self._last_flush = time.time()
+
+        if background:
+            self._writer = threading.Thread(target=self._write, args=(layers,), name='AsyncModelCheckpoint')
+            self._writer.daemon = True
+            self._writer.start()
+        else:
+            self._write(layers)
+
+    def _write(self, layers):
+        try:
+            _write_weights_file(self.filepath, layers)
+        except Exception as e:
+            self._writer_error = e
+
+
+def _snapshot_weights(model):
+    """
+    Copies the current weights of a model to memory.
+
+    Returns:
+        A list of (layer name, weight names, weight values) tuples.
+    """
+    # `model.weights` lists every trainable weight before the non-trainable
+    # ones, so read the weights layer by layer, in the order of the file
+    weights = [w for layer in model.layers for w in layer.weights]
+    values = iter(K.batch_get_value(weights))
+
+    layers = []
+    for layer in model.layers:
+        names = [w.name for w in layer.weights]
+        layers.append((layer.name, names, [next(values) for _ in names]))
+
+    return layers
+
+
+def _write_weights_file(filepath, layers):
+    """
+    Writes weights copied by `_snapshot_weights` to a file with the layout
+    of `model.save_weights`, so that it can be read by `model.load_weights`.
+    """
+    temp_path = filepath + '.tmp'
+
+    with h5py.File(temp_path, 'w') as f:
+        f.attrs['layer_names'] = [layer_name.encode('utf8') for layer_name, _, _ in layers]
+        f.attrs['backend'] = K.backend().encode('utf8')
+        f.attrs['keras_version'] = str(keras_version).encode('utf8')
+
+        for layer_name, names, values in layers:
+            g = f.create_group(layer_name)
+            g.attrs['weight_names'] = [name.encode('utf8') for name in names]
+
+            for name, value in zip(names, values):
+                g.create_dataset(name, data=value)
+
+    os.replace(temp_path, filepath)
+
+
+class CallbackWrapper(Callback):
+    """
+    Forwards every event of training to a wrapped callback. Subclasses
+    override the events they change.
+
+    Args:
+        callback: The Keras Callback to run.
+    """
+
+    def __init__(self, callback):
+        super(CallbackWrapper, self).__init__()
+        self.callback = callback
+
+    def set_params(self, params):
+        super(CallbackWrapper, self).set_params(params)
+        self.callback.set_params(params)
+
+    def set_model(self, model):
+        super(CallbackWrapper, self).set_model(model)
+        self.callback.set_model(model)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.callback.on_epoch_begin(epoch, logs)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.callback.on_epoch_end(epoch, logs)
+
+    def on_batch_begin(self, batch, logs=None):
+        self.callback.on_batch_begin(batch, logs)
+
+    def on_batch_end(self, batch, logs=None):
+        self.callback.on_batch_end(batch, logs)
+
+    def on_train_begin(self, logs=None):
+        self.callback.on_train_begin(logs)
+
+    def on_train_end(self, logs=None):
+        self.callback.on_train_end(logs)
+
+
+class SubModelCallback(CallbackWrapper):
+    """
+    Runs a callback against a single sub-model of the model being trained,
+    such as a member of a cell ensemble. A ModelCheckpoint wrapped this way
+    saves the weights of that sub-model only, with the layout of a standalone
+    model, while still reading the logs of the whole model.
+
+    Args:
+        callback: The Keras Callback to run.
+        sub_model: The Model which the callback sees as `self.model`.
+    """
+
+    def __init__(self, callback, sub_model):
+        super(SubModelCallback, self).__init__(callback)
+        self.sub_model = sub_model
+
+    def set_model(self, model):
+        Callback.set_model(self, model)
+        self.callback.set_model(self.sub_model)
+
+
+class TimedCallback(CallbackWrapper):
+    """
+    Measures the time a callback spends at the end of each epoch and at the
+    end of training, such as the time a ModelCheckpoint spends writing
+    weight files.
+
+    Args:
+        callback: The Keras Callback to run.
+        timers: Dict to which the time spent, in seconds, is added.
+        timer: Key of `timers` under which the time spent is added.
+    """
+
+    def __init__(self, callback, timers, timer):
+        super(TimedCallback, self).__init__(callback)
+        self.timers = timers
+        self.timer = timer
+
+    def on_epoch_end(self, epoch, logs=None):
+        start_time = time.time()
+        self.callback.on_epoch_end(epoch, logs)
+        self.timers[self.timer] = self.timers.get(self.timer, 0.) + time.time() - start_time
+
+    def on_train_end(self, logs=None):
+        start_time = time.time()
+        self.callback.on_train_end(logs)
+        self.timers[self.timer] = self.timers.get(self.timer, 0.) + time.time() - start_time
+
+
+class TrainingMetrics(Callback):
+    """
+    Records where the time of training goes, to a JSON lines file with one
+    line per epoch.
+
+    Each epoch records its wall time, the time spent on the train batches and
+    the resulting throughput in samples per second, the time spent after the
+    last batch evaluating the validation data, the time spent writing
+    checkpoints, the peak resident memory of the process, the learning rate
+    and the logs of the epoch. A first line describes the run, and a last one
+    sums it up.
+
+    Must be the last callback of the list, so that the time spent by the
+    other callbacks at the end of each epoch is known. Checkpoint callbacks
+    must be wrapped with `timed` to be measured.
+
+    Args:
+        path: Path, or list of paths, to the metrics file. Lines are appended,
+            so that a training resumed by another call is recorded as a new run.
+        num_samples: Number of train samples per epoch.
+        run_info: Optional dict of information on the run, such as the
+            dataset, written in the first line.
+    """
+
+    def __init__(self, path, num_samples, run_info=None):
+        super(TrainingMetrics, self).__init__()
+        self.paths = list(path) if isinstance(path, (list, tuple)) else [path]
+        self.num_samples = num_samples
+        self.run_info = run_info or {}
+
+        self.timers = {}
+        self._train_start = None
+        self._epoch_start = None
+        self._last_batch_end = None
+        self._epochs = 0
+        self._batch_time = 0.
+        self._checkpoint_time = 0.
+
+    def timed(self, callback):
+        """
+        Wraps a checkpoint callback, so that its time is recorded.
+        """
+        return TimedCallback(callback, self.timers, 'checkpoint')
+
+    def on_train_begin(self, logs=None):
+        self._train_start = time.time()
+
+        record = {'type': 'run', 'time': self._train_start, 'pid': os.getpid(), 'runtime': describe_runtime(),
+                  'num_samples': self.num_samples}
+        record.update(self.run_info)
+        self._write(record)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.time()
+        self._last_batch_end = self._epoch_start
+
+    def on_batch_end(self, batch, logs=None):
+        self._last_batch_end = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        end_time = time.time()
+
+        batch_time = self._last_batch_end - self._epoch_start
+        checkpoint_time = self.timers.get('checkpoint', 0.)
+
+        # everything after the last batch which is not a checkpoint is spent
+        # evaluating the validation data, by Keras or by PeriodicValidation
+        validation_time = max(0., end_time - self._last_batch_end - checkpoint_time)
+
+        self._epochs += 1
+        self._batch_time += batch_time
+        self._checkpoint_time += checkpoint_time
+        self.timers['checkpoint'] = 0.
+
+        record = {
+            'type': 'epoch',
+            'epoch': epoch + 1,
+            'epoch_time': end_time - self._epoch_start,
+            'train_time': batch_time,
+            'samples_per_sec': self.num_samples / batch_time if batch_time > 0 else None,
+            'validation_time': validation_time,
+            'checkpoint_time': checkpoint_time,
+            'peak_rss_mb': _peak_rss_mb(),
+            'lr': float(K.get_value(self.model.optimizer.lr)),
+        }
+        record.update({name: float(value) for name, value in (logs or {}).items()})
+
+        self._write(record)
+
+    def on_train_end(self, logs=None):
+        end_time = time.time()
+
+        self._write({
+            'type': 'summary',
+            'epochs': self._epochs,
+            'total_time': end_time - self._train_start,
+            'train_time': self._batch_time,
+            'samples_per_sec': self._epochs * self.num_samples / self._batch_time if self._batch_time > 0 else None,
+            # includes the last write of the checkpoints at the end of training
+            'checkpoint_time': self._checkpoint_time + self.timers.get('checkpoint', 0.),
+            'peak_rss_mb': _peak_rss_mb(),
+        })
+
+    def _write(self, record):
+        line = json.dumps(record) + '\n'
+
+        for path in self.paths:
+            with open(path, 'a') as f:
+                f.write(line)
+
+
+def _peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return peak_rss / (1024. * 1024.)
+
+    return peak_rss / 1024.
+
+
+def load_training_metrics(paths):
+    """
+    Collects the summaries of the training runs recorded by `TrainingMetrics`,
+    to compare the cost of training across datasets or across sweeps.
+
+    Args:
+        paths: List of paths to metrics files, such as
+            `glob.glob('./weights/*/*_metrics.jsonl')`.
+
+    Returns:
+        A pandas DataFrame with one row per run, sorted by decreasing total
+        time, holding the information on the run and its summary.
+    """
+    rows = []
+
+    for path in paths:
+        with open(path, 'r') as f:
+            run = None
+
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                if record['type'] == 'run':
+                    run = dict(record, path=path)
+
+                elif record['type'] == 'summary' and run is not None:
+                    row = dict(run)
+                    row.update(record)
+                    rows.append(row)
+                    run = None
+
+    df = pd.DataFrame(rows)
+    if len(df) > 0:
+        df = df.drop(columns=['type']).sort_values('total_time', ascending=False).reset_index(drop=True)
+
+    return df
+
+
+class PeriodicValidation(Callback):
+    """
+    Evaluates the model on the validation data every `frequency` epochs,
+    instead of after every epoch as `model.fit(validation_data=...)` does.
+
+    On the epochs where it runs, the validation metrics are added to the logs
+    of the epoch under the usual `val_` names, so that the callbacks placed
+    after it and the History of training see them as if Keras had computed
+    them. The progress logger of `model.fit` runs before any user callback,
+    and never sees them, so they are printed on a line of their own instead.
+
+    Args:
+        validation_data: Tuple of (X, y).
+        frequency: Number of epochs between two evaluations.
+        batch_size: Size of each batch for evaluation.
+        last_epoch: Optional index of the last epoch, which is always evaluated.
+        verbose: Verbosity mode, 0 or 1.
+    """
+
+    def __init__(self, validation_data, frequency, batch_size=128, last_epoch=None, verbose=1):
+        super(PeriodicValidation, self).__init__()
+        # `validation_data` itself is overwritten by `model.fit`
+        self.validation_data_ = validation_data
+        self.frequency = frequency
+        self.batch_size = batch_size
+        self.last_epoch = last_epoch
+        self.verbose = verbose
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.frequency != 0 and epoch != self.last_epoch:
+            return
+
+        X, y = self.validation_data_
+        values = self.model.evaluate(X, y, batch_size=self.batch_size, verbose=0)
+
+        if not isinstance(values, list):
+            values = [values]
+
+        if logs is not None:
+            for name, value in zip(self.model.metrics_names, values):
+                logs['val_' + name] = value
+
+        if self.verbose > 0:
+            metrics = ['val_%s: %0.4f' % (name, value) for name, value in zip(self.model.metrics_names, values)]
+            print('Epoch %d validation - %s' % (epoch + 1, ' - '.join(metrics)))
+
+
+class PlateauStopping(Callback):
+    """
+    Stops training once the learning rate has reached its floor, and the
+    monitored loss has not improved for `patience` epochs since then.
+
+    Unlike the Keras EarlyStopping callback, epochs spent above the floor of
+    the learning rate do not count, so that ReduceLROnPlateau gets the chance
+    to lower the learning rate before training is given up.
+
+    Args:
+        patience: Number of epochs without improvement at the learning rate
+            floor after which training stops.
+        min_lr: Floor of the learning rate, as set in ReduceLROnPlateau.
+        monitor: Quantity to be monitored.
+        min_delta: Minimum decrease of the monitored quantity to count as
+            an improvement.
+        record_path: Optional path, or list of paths, to a JSON file to which
+            why and when training stopped is written at the end of training.
+    """
+
+    def __init__(self, patience, min_lr, monitor='loss', min_delta=0., record_path=None):
+        super(PlateauStopping, self).__init__()
+        self.patience = patience
+        self.min_lr = min_lr
+        self.monitor = monitor
+        self.min_delta = min_delta
+        self.record_path = record_path
+
+        self.best = np.inf
+        self.best_epoch = None
+        self.wait = 0
+        self.floor_epoch = None
+        self.last_epoch = None
+        self.stopped_epoch = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        current = logs.get(self.monitor)
+        self.last_epoch = epoch
+
+        if current is None:
+            warnings.warn('Plateau stopping requires %s available!' % self.monitor, RuntimeWarning)
+            return
+
+        improved = current < self.best - self.min_delta
+        if improved:
+            self.best = current
+            self.best_epoch = epoch
+
+        lr = float(K.get_value(self.model.optimizer.lr))
+        if lr > self.min_lr * (1. + 1e-6):
+            return
+
+        if self.floor_epoch is None:
+            self.floor_epoch = epoch
+
+        if improved:
+            self.wait = 0
+            return
+
+        self.wait += 1
+        if self.wait >= self.patience:
+            self.stopped_epoch = epoch
+            self.model.stop_training = True
+
+            print("Epoch %d : loss has not improved for %d epochs at the learning rate floor, "
+                  "stopping training" % (epoch + 1, self.patience))
+
+    def on_train_end(self, logs=None):
+        if self.record_path is None:
+            return
+
+        record = {
+            'reason': 'loss_plateau' if self.stopped_epoch is not None else 'max_epochs',
+            'epochs': self.last_epoch + 1 if self.last_epoch is not None else 0,
+            'monitor': self.monitor,
+            'best': float(self.best) if self.best_epoch is not None else None,
+            'best_epoch': self.best_epoch + 1 if self.best_epoch is not None else None,
+            'lr_floor_epoch': self.floor_epoch + 1 if self.floor_epoch is not None else None,
+            'patience': self.patience,
+        }
+
+        record_paths = self.record_path if isinstance(self.record_path, (list, tuple)) else [self.record_path]
+
+        for record_path in record_paths:
+            with open(record_path, 'w') as f:
+                json.dump(record, f, indent=2)
+
+
 class MaskablePermute(Permute):
 
     def __init__(self, dims, **kwargs):
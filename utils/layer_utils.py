@@ -188,6 +188,9 @@ class AttentionLSTMCell(Layer):
         self.return_attention = return_attention
         self._dropout_mask = None
         self._recurrent_dropout_mask = None
+        self._input_sequence = None
+        self._attention_projection = None
+        self._fused_kernel = None
         self.implementation = implementation
         self.state_spec = [InputSpec(shape=(None, self.units)),
                            InputSpec(shape=(None, self.units))]
@@ -331,6 +334,26 @@ class AttentionLSTMCell(Layer):
             self._recurrent_dropout_mask = None
 
 
+    def _generate_attention_projection(self, inputs):
+        # the projection of the input sequence by the alignment model does not
+        # depend on the recurrent state, so compute it once per sequence
+        # instead of at every timestep
+        self._input_sequence = inputs
+        self._attention_projection = _time_distributed_dense(inputs, self.attention_weights, self.attention_bias,
+                                                             input_dim=self.input_dim, output_dim=self.units,
+                                                             timesteps=self.timestep_dim)
+
+
+    def _generate_fused_kernel(self):
+        # without dropout, the input, recurrent state and context vector all
+        # share the same kernels for the four gates, so stack the three kernels
+        # once per sequence and compute every gate with a single matmul per step
+        if 0 < self.dropout < 1 or 0 < self.recurrent_dropout < 1:
+            self._fused_kernel = None
+        else:
+            self._fused_kernel = K.concatenate([self.kernel, self.recurrent_kernel, self.attention_kernel], axis=0)
+
+
     def call(self, inputs, states, training=None):
         # dropout matrices for input units
         dp_mask = self._dropout_mask
@@ -340,10 +363,11 @@ class AttentionLSTMCell(Layer):
         h_tm1 = states[0]  # previous memory state
         c_tm1 = states[1]  # previous carry state
 
+        x_input = self._input_sequence  # full input sequence
+        att = self._attention_projection  # input sequence projected by the alignment model
+
         # alignment model
         h_att = K.repeat(h_tm1, self.timestep_dim)
-        att = _time_distributed_dense(inputs, self.attention_weights, self.attention_bias,
-                                      input_dim=self.input_dim, output_dim=self.units, timesteps=self.timestep_dim)
         attention_ = self.attention_activation(K.dot(h_att, self.attention_recurrent_weights) + att)  # energy
         attention_ = K.squeeze(K.dot(attention_, self.attention_recurrent_bias), 2)  # energy
 
@@ -356,12 +380,28 @@ class AttentionLSTMCell(Layer):
         alpha_r = K.repeat(alpha, self.input_dim)
         alpha_r = K.permute_dimensions(alpha_r, (0, 2, 1))
 
-        # make context vector (soft attention after Bahdanau et al.)
-        z_hat = inputs * alpha_r
+        # make context vector (soft attention after Bahdanau et al.), one per
+        # sample, as a weighted sum over the timesteps of its own input sequence
+        z_hat = x_input * alpha_r
         context_sequence = z_hat
         z_hat = K.sum(z_hat, axis=1)
 
-        if self.implementation == 1:
+        if self._fused_kernel is not None:
+            z = K.dot(K.concatenate([inputs, h_tm1, z_hat]), self._fused_kernel)
+
+            if self.use_bias:
+                z = K.bias_add(z, self.bias)
+
+            z0 = z[:, :self.units]
+            z1 = z[:, self.units: 2 * self.units]
+            z2 = z[:, 2 * self.units: 3 * self.units]
+            z3 = z[:, 3 * self.units:]
+
+            i = self.recurrent_activation(z0)
+            f = self.recurrent_activation(z1)
+            c = f * c_tm1 + i * self.activation(z2)
+            o = self.recurrent_activation(z3)
+        elif self.implementation == 1:
             if 0 < self.dropout < 1.:
                 inputs_i = inputs * dp_mask[0]
                 inputs_f = inputs * dp_mask[1]
@@ -489,7 +529,9 @@ class AttentionLSTM(RNN):
         recurrent_dropout: Float between 0 and 1.
             Fraction of the units to drop for
             the linear transformation of the recurrent state.
-        implementation: Implementation mode, either 1 or 2.
+        implementation: Implementation mode, either 1 or 2, used when dropout
+            or recurrent dropout is enabled. Without dropout, every gate is
+            computed by a single matmul at each timestep, whatever the mode.
         return_sequences: Boolean. Whether to return the last output.
             in the output sequence, or the full sequence.
         return_state: Boolean. Whether to return the last state
@@ -603,6 +645,8 @@ class AttentionLSTM(RNN):
     def call(self, inputs, mask=None, training=None, initial_state=None):
         self.cell._generate_dropout_mask(inputs, training=training)
         self.cell._generate_recurrent_dropout_mask(inputs, training=training)
+        self.cell._generate_attention_projection(inputs)
+        self.cell._generate_fused_kernel()
         return super(AttentionLSTM, self).call(inputs,
                                                mask=mask,
                                                training=training,
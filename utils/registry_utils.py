@@ -0,0 +1,347 @@
+import os
+import glob
+import json
+import collections
+
+import numpy as np
+
+from utils.constants import TRAIN_FILES, TEST_FILES, MAX_SEQUENCE_LENGTH_LIST, NB_CLASSES_LIST
+from utils.archive_utils import DATASET_ARCHIVE_NAME
+from utils.generic_utils import _read_ucr_dataset, _resolve_dataset_path, DATASET_BINARY_EXTENSION, \
+    _dataset_dir, _dataset_file_name, _dataset_file_key, _open_archive
+
+
+# name of the index file, written inside the data directory
+REGISTRY_INDEX_NAME = '_registry.json'
+
+# must be bumped whenever the layout of the index changes
+REGISTRY_INDEX_VERSION = 1
+
+# names under which the drivers have always referred to these datasets, which
+# differ from the names of their files. The weight directories and log files
+# of previous runs use these names.
+LEGACY_DATASET_NAMES = {
+    'Car': 'car',
+    'Mallat': 'MALLAT',
+    'Plane': 'plane',
+    'StarLightCurves': 'StarlightCurves',
+    'Two_Patterns': 'Patterns',
+    'Wafer': 'wafer',
+    'Yoga': 'yoga',
+}
+
+
+DatasetInfo = collections.namedtuple('DatasetInfo', ['name', 'id', 'file_name', 'train_file', 'test_file',
+                                                     'sequence_length', 'nb_classes', 'n_train', 'n_test'])
+DatasetInfo.__doc__ = """
+Description of a single dataset of the registry.
+
+Attributes:
+    name: Name of the dataset, as used by the drivers for log and weight files.
+    id: Integer id of the dataset, the index used by `load_dataset_at`.
+    file_name: Name of the dataset files, without the `_TRAIN` / `_TEST` suffix.
+    train_file: Path to the train set file.
+    test_file: Path to the test set file.
+    sequence_length: Length of the series fed to the models.
+    nb_classes: Number of classes.
+    n_train: Number of train samples, or None if the files are missing.
+    n_test: Number of test samples, or None if the files are missing.
+"""
+
+
+class DatasetRegistry(object):
+    """
+    Registry of every dataset known to this repository, which can be looked
+    up by name or by id.
+
+    The datasets listed inside `utils/constants.py` keep their ids. Any other
+    pair of `<name>_TRAIN` / `<name>_TEST` files found in the data directory,
+    either CSV files or their binary copies, as well as any other dataset of
+    the dataset archive of the data directory, is registered after them, and
+    appended to the lists of `utils/constants.py`, so that `load_dataset_at`
+    and the other utilities which take a dataset id work with it unchanged.
+
+    The sample counts, sequence length and class count of each dataset are
+    computed from its files once, and stored in an index file inside the data
+    directory. The entry of a dataset is only computed again when one of its
+    files changes.
+
+    Use `load_registry` to build one.
+
+    Args:
+        datasets: List of DatasetInfo, ordered by id.
+    """
+
+    def __init__(self, datasets):
+        self._datasets = list(datasets)
+        self._by_name = {}
+
+        for info in self._datasets:
+            self._by_name[info.name] = info
+            self._by_name.setdefault(info.file_name, info)
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def __iter__(self):
+        return iter(self._datasets)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def get(self, name):
+        """
+        Looks up a dataset by its name, or the name of its files.
+
+        Args:
+            name: Name of the dataset.
+
+        Returns:
+            A DatasetInfo.
+        """
+        if name not in self._by_name:
+            raise KeyError("Dataset %s is not registered" % name)
+
+        return self._by_name[name]
+
+    def get_id(self, dataset_id):
+        """
+        Looks up a dataset by its integer id.
+        """
+        return self._datasets[dataset_id]
+
+    def datasets(self, names=None, available_only=True, max_train_samples=None):
+        """
+        Selects datasets of the registry.
+
+        Args:
+            names: Optional list of dataset names to select.
+            available_only: Whether to skip datasets whose files are missing.
+            max_train_samples: Optional maximum number of train samples.
+
+        Returns:
+            A list of DatasetInfo, ordered by id.
+        """
+        if names is not None:
+            datasets = [self.get(name) for name in names]
+        else:
+            datasets = self._datasets
+
+        if available_only:
+            datasets = [info for info in datasets if info.n_train is not None]
+
+        if max_train_samples is not None:
+            datasets = [info for info in datasets if info.n_train is not None and info.n_train <= max_train_samples]
+
+        return datasets
+
+    def dataset_map(self, names=None, available_only=True, max_train_samples=None):
+        """
+        Same as `datasets`, but returns the (dataset name, id) pairs used by
+        the drivers.
+        """
+        return [(info.name, info.id) for info in self.datasets(names, available_only, max_train_samples)]
+
+
+def load_registry(data_dir=None, verbose=True):
+    """
+    Builds the registry of datasets, reading the index file of the data
+    directory and computing the entries of new or modified datasets.
+
+    Args:
+        data_dir: Directory holding the dataset files. By default, the
+            directory of the files listed inside `utils/constants.py`.
+        verbose: Whether to describe the datasets being indexed.
+
+    Returns:
+        A DatasetRegistry.
+    """
+    if data_dir is None:
+        data_dir = _dataset_dir(0)
+
+    index_path = os.path.join(data_dir, REGISTRY_INDEX_NAME) if data_dir is not None else None
+    index = _read_index(index_path)
+
+    index_changed = _register_new_datasets(data_dir, index, verbose)
+
+    datasets = []
+
+    for dataset_id in range(len(TRAIN_FILES)):
+        file_name = _dataset_file_name(TRAIN_FILES[dataset_id])
+
+        entry, changed = _index_entry(index, TRAIN_FILES[dataset_id], TEST_FILES[dataset_id], verbose)
+        index_changed = index_changed or changed
+
+        datasets.append(DatasetInfo(name=LEGACY_DATASET_NAMES.get(file_name, file_name),
+                                    id=dataset_id,
+                                    file_name=file_name,
+                                    train_file=TRAIN_FILES[dataset_id],
+                                    test_file=TEST_FILES[dataset_id],
+                                    sequence_length=MAX_SEQUENCE_LENGTH_LIST[dataset_id],
+                                    nb_classes=NB_CLASSES_LIST[dataset_id],
+                                    n_train=entry['n_train'] if entry is not None else None,
+                                    n_test=entry['n_test'] if entry is not None else None))
+
+    if index_changed and index_path is not None:
+        _write_index(index_path, index)
+
+    return DatasetRegistry(datasets)
+
+
+def _register_new_datasets(data_dir, index, verbose=True):
+    """
+    Appends every dataset of the data directory which is not yet listed
+    inside `utils/constants.py` to its lists, using its index entry to find
+    its sequence length and class count. The entries of all new datasets
+    are computed first, so that the lists only ever hold complete datasets.
+
+    Returns:
+        Whether the index was modified.
+    """
+    if data_dir is None:
+        return False
+
+    known = set(_dataset_file_name(path) for path in TRAIN_FILES)
+    index_changed = False
+
+    train_paths = glob.glob(os.path.join(data_dir, '*_TRAIN'))
+    train_paths += [path[:-len(DATASET_BINARY_EXTENSION)]
+                    for path in glob.glob(os.path.join(data_dir, '*_TRAIN' + DATASET_BINARY_EXTENSION))]
+
+    archive_names = _archived_dataset_names(data_dir)
+    train_paths += [os.path.join(data_dir, name + '_TRAIN') for name in archive_names]
+
+    new_datasets = []
+
+    # the lists hold the paths without extension, `_resolve_dataset_path` finds the file
+    for train_path in sorted(set(train_paths)):
+        file_name = _dataset_file_name(train_path)
+        test_path = os.path.join(data_dir, file_name + '_TEST')
+
+        if file_name in known or not (os.path.exists(test_path) or
+                                      os.path.exists(test_path + DATASET_BINARY_EXTENSION) or
+                                      file_name in archive_names):
+            continue
+
+        entry, changed = _index_entry(index, train_path, test_path, verbose)
+        index_changed = index_changed or changed
+
+        if entry is not None:
+            new_datasets.append((train_path, test_path, entry['file_sequence_length'], entry['nb_classes']))
+
+        known.add(file_name)
+
+    for train_path, test_path, sequence_length, nb_classes in new_datasets:
+        TRAIN_FILES.append(train_path)
+        TEST_FILES.append(test_path)
+        MAX_SEQUENCE_LENGTH_LIST.append(sequence_length)
+        NB_CLASSES_LIST.append(nb_classes)
+
+    return index_changed
+
+
+def _index_entry(index, train_file, test_file, verbose=True):
+    """
+    Finds the index entry of a dataset, reading the dataset to compute it
+    if it is missing or if the files of the dataset have changed since.
+
+    Args:
+        index: Dict which maps the file name of each dataset to its entry,
+            updated in place.
+        train_file: Path to the train set file, as listed in `utils/constants.py`.
+        test_file: Path to the test set file, as listed in `utils/constants.py`.
+        verbose: Whether to describe the dataset being indexed.
+
+    Returns:
+        A tuple of (entry, changed), where entry is None if the files of
+        the dataset are missing.
+    """
+    file_name = _dataset_file_name(train_file)
+
+    try:
+        train_path = _resolve_dataset_path(train_file)
+        test_path = _resolve_dataset_path(test_file)
+    except FileNotFoundError:
+        # datasets of the archive need not have their files, their entry is
+        # cheap to compute from the memory-mapped archive and is not indexed
+        return _archived_index_entry(train_file), False
+
+    key = _dataset_file_key(train_path, test_path)
+
+    entry = index.get(file_name)
+    if entry is not None and entry['key'] == key:
+        return entry, False
+
+    if verbose: print("Indexing dataset : ", file_name)
+
+    X_train, y_train, X_test, y_test = _read_ucr_dataset(train_path, test_path, verbose=False, dtype=np.float32)
+
+    entry = _make_index_entry(key, X_train, y_train, X_test)
+
+    index[file_name] = entry
+    return entry, True
+
+
+def _archived_index_entry(train_file):
+    file_name = _dataset_file_name(train_file)
+
+    # the data directory is found the same way `_resolve_dataset_path` finds the files
+    for data_dir in (os.path.dirname(train_file), os.path.dirname(train_file)[1:]):
+        if file_name in _archived_dataset_names(data_dir):
+            archive = _open_archive(os.path.join(data_dir, DATASET_ARCHIVE_NAME))
+
+            return _make_index_entry(None, archive.array(file_name, 'X_train'), archive.array(file_name, 'y_train'),
+                                     archive.array(file_name, 'X_test'))
+
+    return None
+
+
+def _archived_dataset_names(data_dir):
+    archive_path = os.path.join(data_dir, DATASET_ARCHIVE_NAME)
+    if not os.path.exists(archive_path):
+        return []
+
+    try:
+        return _open_archive(archive_path).names()
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def _make_index_entry(key, X_train, y_train, X_test):
+    return {
+        'key': key,
+        'n_train': int(X_train.shape[0]),
+        'n_test': int(X_test.shape[0]),
+        'file_sequence_length': int(X_train.shape[-1]),
+        'nb_classes': int(len(np.unique(y_train))),
+    }
+
+
+def _read_index(index_path):
+    if index_path is None or not os.path.exists(index_path):
+        return {}
+
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except ValueError:
+        return {}
+
+    if index.get('version') != REGISTRY_INDEX_VERSION:
+        return {}
+
+    return index.get('datasets', {})
+
+
+def _write_index(index_path, index):
+    temp_path = '%s.%d.tmp' % (index_path, os.getpid())
+
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump({'version': REGISTRY_INDEX_VERSION, 'datasets': index}, f, indent=1, sort_keys=True)
+
+        os.replace(temp_path, index_path)
+
+    except (IOError, OSError) as e:
+        # the registry still works without its index, it is only slower to build
+        print("Could not write the dataset index %s : %s" % (index_path, str(e)))
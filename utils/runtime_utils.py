@@ -0,0 +1,299 @@
+import os
+import time
+import multiprocessing
+
+import numpy as np
+
+
+# runtime configuration of the current process, set by `configure_runtime`
+_RUNTIME_CONFIG = None
+
+
+class RuntimeConfig(object):
+    """
+    Threading and CPU placement settings of a training process.
+
+    TensorFlow sizes its thread pools when a session is created, so the
+    configuration must be applied with `configure_runtime` before any model
+    is built. The OpenMP / MKL / BLAS runtimes read their thread counts from
+    the environment when numpy or TensorFlow are first imported, which is too
+    late for `configure_runtime`. They are only applied to the processes
+    started with the environment of `thread_environment`, such as the workers
+    of `run_jobs`. Any other process must be started with these variables
+    already set, such as `OMP_NUM_THREADS`.
+
+    Args:
+        intra_op_threads: Number of threads TensorFlow uses inside a single
+            op, such as a matrix multiplication. None leaves the default of
+            TensorFlow, which is one thread per core of the host.
+        inter_op_threads: Number of ops TensorFlow may run concurrently.
+            None uses `min(2, intra_op_threads)`.
+        omp_threads: Number of OpenMP / MKL / BLAS threads, used by TensorFlow
+            builds with MKL and by numpy, of the processes started with the
+            environment of `thread_environment`. None uses `intra_op_threads`.
+        cpu_affinity: Optional list of the ids of the CPUs the process may
+            run on.
+    """
+
+    def __init__(self, intra_op_threads=None, inter_op_threads=None, omp_threads=None, cpu_affinity=None):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.omp_threads = omp_threads
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity is not None else None
+
+        if self.inter_op_threads is None and intra_op_threads is not None:
+            self.inter_op_threads = min(2, intra_op_threads)
+
+        if self.omp_threads is None:
+            self.omp_threads = intra_op_threads
+
+    def session_config(self):
+        """
+        Returns the `tf.ConfigProto` of the sessions of this process, or
+        None if TensorFlow should use its defaults.
+        """
+        if self.intra_op_threads is None:
+            return None
+
+        import tensorflow as tf
+
+        return tf.ConfigProto(intra_op_parallelism_threads=self.intra_op_threads,
+                              inter_op_parallelism_threads=self.inter_op_threads)
+
+    def to_dict(self):
+        return {
+            'intra_op_threads': self.intra_op_threads,
+            'inter_op_threads': self.inter_op_threads,
+            'omp_threads': self.omp_threads,
+            'cpu_affinity': self.cpu_affinity,
+        }
+
+    def __repr__(self):
+        return 'RuntimeConfig(%s)' % ', '.join('%s=%s' % item for item in sorted(self.to_dict().items()))
+
+
+def available_cpus():
+    """
+    Returns the sorted list of the ids of the CPUs this process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(multiprocessing.cpu_count()))
+
+
+def worker_config(worker_id, num_workers, threads_per_worker=None, pin_cpus=False):
+    """
+    Builds the runtime configuration of one worker of a pool, which shares
+    the CPUs of the host with the other workers.
+
+    Args:
+        worker_id: Index of the worker, from 0 to `num_workers - 1`.
+        num_workers: Number of workers of the pool.
+        threads_per_worker: Number of threads of each worker. If None, the
+            CPUs are split evenly between the workers, and a single worker
+            keeps the defaults of TensorFlow.
+        pin_cpus: Whether to pin each worker to its own block of CPUs, so
+            that workers do not migrate between cores and evict each other
+            from the caches.
+
+    Returns:
+        A RuntimeConfig.
+    """
+    cpus = available_cpus()
+
+    if threads_per_worker is None:
+        if num_workers <= 1 and not pin_cpus:
+            return RuntimeConfig()
+
+        threads_per_worker = max(1, len(cpus) // max(1, num_workers))
+
+    cpu_affinity = None
+    if pin_cpus:
+        start = (worker_id * threads_per_worker) % len(cpus)
+        cpu_affinity = [cpus[(start + i) % len(cpus)] for i in range(min(threads_per_worker, len(cpus)))]
+
+    return RuntimeConfig(intra_op_threads=threads_per_worker, cpu_affinity=cpu_affinity)
+
+
+def thread_environment(config):
+    """
+    Builds the environment variables which set the OpenMP / MKL / BLAS thread
+    counts of a runtime configuration. These runtimes read them once, when
+    numpy or TensorFlow are imported, so they must be set in the environment
+    a process is started with, before it imports either of them.
+
+    Args:
+        config: A RuntimeConfig, or None.
+
+    Returns:
+        A dict of environment variables, empty if the defaults are kept.
+    """
+    environment = {}
+
+    if config is None:
+        return environment
+
+    if config.omp_threads is not None:
+        for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            environment[name] = str(config.omp_threads)
+
+    if config.cpu_affinity is not None:
+        # keep the OpenMP threads of MKL builds of TensorFlow on the pinned cores
+        environment['KMP_AFFINITY'] = 'granularity=fine,compact,1,0'
+        environment['KMP_BLOCKTIME'] = os.environ.get('KMP_BLOCKTIME', '1')
+
+    return environment
+
+
+def configure_runtime(config):
+    """
+    Applies a runtime configuration to the current process : pins the
+    process to its CPUs, and records the TensorFlow thread counts used by
+    `reset_session`. The OpenMP / MKL / BLAS thread counts are not changed,
+    see `thread_environment`.
+
+    Args:
+        config: A RuntimeConfig, or None to keep the defaults.
+    """
+    global _RUNTIME_CONFIG
+    _RUNTIME_CONFIG = config
+
+    if config is None:
+        return
+
+    if config.cpu_affinity is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, config.cpu_affinity)
+
+
+def runtime_config():
+    """
+    Returns the RuntimeConfig applied to the current process, or None.
+    """
+    return _RUNTIME_CONFIG
+
+
+def reset_session():
+    """
+    Releases the memory of the current Keras session, and starts a new one
+    using the thread counts of the runtime configuration of this process.
+    """
+    import tensorflow as tf
+    from keras import backend as K
+
+    K.clear_session()
+
+    session_config = _RUNTIME_CONFIG.session_config() if _RUNTIME_CONFIG is not None else None
+    if session_config is not None:
+        K.set_session(tf.Session(config=session_config))
+
+
+def describe_runtime():
+    """
+    Returns a one line description of the runtime configuration of this process.
+    The OpenMP thread count is the one of the environment of the process.
+    """
+    config = _RUNTIME_CONFIG or RuntimeConfig()
+
+    threads = ('%d intra-op / %d inter-op threads' % (config.intra_op_threads, config.inter_op_threads)
+               if config.intra_op_threads is not None else 'default TensorFlow threads')
+    omp_threads = os.environ.get('OMP_NUM_THREADS', 'default')
+    cpus = config.cpu_affinity if config.cpu_affinity is not None else available_cpus()
+
+    return "%s, %s OpenMP threads, %d CPUs (%s)" % (threads, omp_threads, len(cpus),
+                                                    ','.join(str(cpu) for cpu in cpus))
+
+
+def benchmark_threads(model_fn, sequence_length, nb_classes, n_train, batch_size=128, thread_counts=None,
+                      steps=20, warmup_steps=3, cells=8):
+    """
+    Measures the training throughput of a model under several thread budgets,
+    and recommends how to split the CPUs of the host between workers for a
+    dataset of the given size.
+
+    Each thread budget is measured in this process, pinned to as many CPUs as
+    threads, on synthetic data of the shape of the dataset. A sweep running
+    `num_cpus // threads` workers of that budget then processes about as many
+    times the measured throughput. Small datasets, whose batches are too small
+    to keep many threads busy, usually favour many single threaded workers,
+    while long series favour fewer workers with more threads.
+
+    Args:
+        model_fn: Function which builds the Keras Model, called as
+            `model_fn(sequence_length, nb_classes, cells)`.
+        sequence_length: Length of the series of the dataset.
+        nb_classes: Number of classes of the dataset.
+        n_train: Number of train samples of the dataset.
+        batch_size: Size of each batch for training.
+        thread_counts: List of the thread budgets to measure. By default,
+            the powers of 2 up to the number of CPUs, and that number.
+        steps: Number of timed training steps per budget.
+        warmup_steps: Number of untimed training steps per budget.
+        cells: Number of cells of the model.
+
+    Returns:
+        A dict with the recommended `threads_per_worker` and `num_workers`,
+        and the `results` of every budget, each holding its `threads`,
+        `step_time` in seconds, `samples_per_sec` of a single worker and
+        `total_samples_per_sec` of all workers.
+    """
+    cpus = available_cpus()
+
+    if thread_counts is None:
+        thread_counts = [2 ** i for i in range(int(np.log2(len(cpus))) + 1)]
+        if thread_counts[-1] != len(cpus):
+            thread_counts.append(len(cpus))
+
+    batch_size = min(batch_size, n_train)
+
+    X = np.random.normal(size=(batch_size, 1, sequence_length)).astype(np.float32)
+    y = np.eye(nb_classes, dtype=np.float32)[np.random.randint(0, nb_classes, size=batch_size)]
+
+    previous_config = _RUNTIME_CONFIG
+    results = []
+
+    try:
+        for threads in thread_counts:
+            configure_runtime(RuntimeConfig(intra_op_threads=threads, cpu_affinity=cpus[:threads]))
+            reset_session()
+
+            model = model_fn(sequence_length, nb_classes, cells)
+            model.compile(optimizer='adam', loss='categorical_crossentropy')
+
+            for _ in range(warmup_steps):
+                model.train_on_batch(X, y)
+
+            start_time = time.time()
+            for _ in range(steps):
+                model.train_on_batch(X, y)
+
+            step_time = (time.time() - start_time) / steps
+            num_workers = max(1, len(cpus) // threads)
+
+            results.append({
+                'threads': threads,
+                'step_time': step_time,
+                'samples_per_sec': batch_size / step_time,
+                'total_samples_per_sec': num_workers * batch_size / step_time,
+            })
+
+            print("Benchmark : %d threads, %0.2f ms per step, %0.1f samples / sec per worker, "
+                  "%0.1f samples / sec for %d workers" %
+                  (threads, step_time * 1000., batch_size / step_time, num_workers * batch_size / step_time,
+                   num_workers))
+
+    finally:
+        configure_runtime(previous_config)
+        if previous_config is None or previous_config.cpu_affinity is None:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpus)
+
+        reset_session()
+
+    best = max(results, key=lambda result: result['total_samples_per_sec'])
+
+    return {
+        'threads_per_worker': best['threads'],
+        'num_workers': max(1, len(cpus) // best['threads']),
+        'results': results,
+    }
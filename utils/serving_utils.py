@@ -0,0 +1,196 @@
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher(object):
+    """
+    Queues single time series requests for a model, and runs them through
+    the model as dynamically sized micro-batches.
+
+    A background thread waits for the first queued request, then keeps
+    collecting requests until either `max_batch_size` requests are queued
+    or `max_delay` seconds have passed since the first one arrived, and
+    predicts the whole batch at once. Under light load a request waits at
+    most `max_delay` seconds before it is run; under heavy load batches
+    fill up immediately and the cost of each forward pass is shared by
+    many requests.
+
+    Args:
+        predict_fn: Function which maps a numpy array of shape
+            (samples, timesteps) to a numpy array of shape (samples, classes).
+        max_batch_size: Maximum number of requests run in one batch.
+        max_delay: Maximum time in seconds that the first request of a
+            batch waits for more requests to arrive.
+        latency_window: Number of most recent requests kept to compute the
+            latency percentiles.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_delay=0.005, latency_window=10000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._running = False
+
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._num_requests = 0
+        self._num_batches = 0
+        self._num_errors = 0
+        self._start_time = None
+
+    def start(self):
+        """ Starts the background thread which runs the batches. """
+        if self._running:
+            return
+
+        self._running = True
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run, name='MicroBatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, after the queued requests have been run.
+        Requests submitted afterwards are rejected.
+        """
+        with self._lock:
+            if not self._running:
+                return
+
+            # under the lock, so that no request is queued after the stop request
+            self._running = False
+            self._queue.put(None)
+
+        self._thread.join()
+
+    def submit(self, x):
+        """
+        Queues a single time series.
+
+        Args:
+            x: Numpy array of shape (timesteps,).
+
+        Returns:
+            A `concurrent.futures.Future` whose result is the numpy array of
+            class probabilities of the series.
+
+        Raises:
+            RuntimeError: If the batcher is not running, as nothing would
+                ever run the request.
+        """
+        future = Future()
+
+        with self._lock:
+            if not self._running:
+                raise RuntimeError("MicroBatcher is not running, call start() before submitting requests")
+
+            self._queue.put((np.asarray(x), future, time.time()))
+
+        return future
+
+    def predict(self, x, timeout=None):
+        """
+        Queues a single time series and waits for its class probabilities.
+
+        Args:
+            x: Numpy array of shape (timesteps,).
+            timeout: Maximum time in seconds to wait for the result.
+
+        Returns:
+            Numpy array of shape (classes,).
+        """
+        return self.submit(x).result(timeout=timeout)
+
+    def stats(self):
+        """
+        Returns a dict describing the requests run so far: the number of
+        requests, batches and errors, the mean batch size, the throughput
+        in requests per second and the p50 / p99 latencies in milliseconds.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies, dtype=np.float64)
+            num_requests = self._num_requests
+            num_batches = self._num_batches
+            num_errors = self._num_errors
+
+        elapsed = time.time() - self._start_time if self._start_time is not None else 0.
+
+        stats = {
+            'requests': num_requests,
+            'batches': num_batches,
+            'errors': num_errors,
+            'mean_batch_size': num_requests / float(num_batches) if num_batches > 0 else 0.,
+            'throughput': num_requests / elapsed if elapsed > 0 else 0.,
+            'latency_p50_ms': None,
+            'latency_p99_ms': None,
+        }
+
+        if len(latencies) > 0:
+            stats['latency_p50_ms'] = float(np.percentile(latencies, 50) * 1000.)
+            stats['latency_p99_ms'] = float(np.percentile(latencies, 99) * 1000.)
+
+        return stats
+
+    def _next_batch(self):
+        # block until the first request of the batch arrives
+        item = self._queue.get()
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = item[2] + self.max_delay
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+
+            try:
+                # once the deadline has passed, only take what is already queued
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                # stop request, run the current batch before exiting
+                self._queue.put(None)
+                break
+
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            series, futures, submit_times = zip(*batch)
+
+            try:
+                outputs = self.predict_fn(np.stack(series, axis=0))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+                with self._lock:
+                    self._num_errors += len(batch)
+                continue
+
+            finish_time = time.time()
+
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+            with self._lock:
+                self._num_requests += len(batch)
+                self._num_batches += 1
+                self._latencies.extend(finish_time - t for t in submit_times)
@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import heapq
+import multiprocessing
+import traceback
+
+import h5py
+
+from utils.runtime_utils import configure_runtime, worker_config, thread_environment, reset_session, \
+    describe_runtime
+
+
+def run_jobs(jobs, job_fn, num_workers=1, threads_per_worker=None, callback=None, pin_cpus=False):
+    """
+    Runs a list of jobs, either one at a time inside this process or across
+    a pool of worker processes.
+
+    Each worker is restricted to its own TensorFlow intra-op / inter-op and
+    OpenMP thread budget, and optionally pinned to its own CPUs, so that
+    several workers do not oversubscribe the cores of the host. Jobs should
+    call `reset_session` instead of `K.clear_session` so that the new session
+    respects this budget. The OpenMP budget only applies to worker processes,
+    as it must be set before numpy and TensorFlow are imported.
+
+    Args:
+        jobs: List of tuples. Each tuple holds the arguments of one call
+            to `job_fn`.
+        job_fn: Function which runs a single job. When using more than one
+            worker, it must be defined at the top level of a module so that
+            it can be sent to the worker processes.
+        num_workers: Number of worker processes. If 1 or less, the jobs are
+            run sequentially inside this process.
+        threads_per_worker: Number of threads each worker may use. If None
+            and more than one worker is used, the cores of the host are split
+            evenly between the workers. If None and a single worker is used,
+            TensorFlow picks the thread count.
+        callback: Optional function called inside this process as
+            `callback(job, result, error)` as soon as each job finishes,
+            where `error` is the formatted traceback of a failed job or None.
+            As only the parent process calls it, it can safely append to
+            shared log files.
+        pin_cpus: Whether to pin each worker to its own block of
+            `threads_per_worker` CPUs.
+
+    Returns:
+        A list of (job, result, error) tuples, in order of completion.
+    """
+    results = []
+
+    if num_workers <= 1:
+        _init_worker(threads_per_worker, 1, pin_cpus)
+        outputs = map(_run_job, [(job_fn, job) for job in jobs])
+
+        for job, result, error in outputs:
+            _handle_result(job, result, error, callback, results)
+
+    else:
+        # TensorFlow is not fork safe, so always spawn fresh interpreters
+        context = multiprocessing.get_context('spawn')
+
+        # hands out the index of each worker, which picks its block of CPUs
+        worker_ids = context.Value('i', 0)
+
+        # the OpenMP / MKL thread counts are read when the workers import numpy,
+        # before their initializer runs, so they are passed in their environment.
+        # Every worker has the same thread budget, only its CPUs differ.
+        environment = thread_environment(worker_config(0, num_workers, threads_per_worker, pin_cpus))
+        previous_environment = {name: os.environ.get(name) for name in environment}
+        os.environ.update(environment)
+
+        try:
+            with context.Pool(num_workers, initializer=_init_worker,
+                              initargs=(threads_per_worker, num_workers, pin_cpus, worker_ids)) as pool:
+                outputs = pool.imap_unordered(_run_job, [(job_fn, job) for job in jobs])
+
+                for job, result, error in outputs:
+                    _handle_result(job, result, error, callback, results)
+
+        finally:
+            for name, value in previous_environment.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    return results
+
+
+class JobLedger(object):
+    """
+    Durable, append-only record of the jobs of a sweep, stored as a JSON lines
+    file. Every change of state of a job appends one line, so that a sweep
+    which crashed can be restarted and only run the jobs which have not
+    finished yet.
+
+    Lines are appended with a single `write` call on a file opened in append
+    mode, so several worker processes can safely share the same ledger.
+
+    Args:
+        path: Path to the ledger file. It is created if it does not exist.
+    """
+
+    STARTED = 'started'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+        self._records = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # line cut short by a crash while it was being written
+                        continue
+
+                    self._records[record['job']] = record
+
+            # terminate a line cut short by a crash, so that it does not
+            # swallow the next record
+            with open(path, 'rb+') as file:
+                file.seek(0, os.SEEK_END)
+                if file.tell() > 0:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':
+                        file.write(b'\n')
+
+    @staticmethod
+    def job_key(*parts):
+        """
+        Builds the key of a job from its parts, such as the model name,
+        number of cells and dataset name.
+        """
+        return '/'.join(str(part) for part in parts)
+
+    def status(self, key):
+        """
+        Returns the last recorded status of a job, or None if it has never
+        been started.
+        """
+        record = self._records.get(key)
+        return record['status'] if record is not None else None
+
+    def result(self, key):
+        """
+        Returns the result recorded when a job finished, or None.
+        """
+        record = self.record(key)
+        if record is None or record['status'] != JobLedger.FINISHED:
+            return None
+
+        return record.get('result')
+
+    def record(self, key):
+        """
+        Returns the last record of a job, a dict holding its status along
+        with the fields given when it was recorded, or None if it has never
+        been started.
+        """
+        return self._records.get(key)
+
+    def is_finished(self, key, weights_path=None):
+        """
+        Checks whether a job has finished.
+
+        Args:
+            key: Key of the job.
+            weights_path: Optional path to the weight file written by the
+                job. If provided, the job only counts as finished if this
+                file is a complete weight file.
+
+        Returns:
+            True if the job does not need to be run again.
+        """
+        if self.status(key) != JobLedger.FINISHED:
+            return False
+
+        if weights_path is not None and not is_valid_weights_file(weights_path):
+            print("Weights of finished job %s are missing or incomplete : %s" % (key, weights_path))
+            return False
+
+        return True
+
+    def is_interrupted(self, key):
+        """
+        Checks whether a job was started but never finished nor failed, which
+        means that the process running it was killed. Any weight file written
+        by such a job may be incomplete.
+        """
+        return self.status(key) == JobLedger.STARTED
+
+    def mark_started(self, key, **info):
+        self._append(key, JobLedger.STARTED, **info)
+
+    def mark_finished(self, key, result=None, **info):
+        self._append(key, JobLedger.FINISHED, result=result, **info)
+
+    def mark_failed(self, key, error=None, **info):
+        self._append(key, JobLedger.FAILED, error=error, **info)
+
+    def _append(self, key, status, **info):
+        record = {'job': key, 'status': status, 'time': time.time(), 'pid': os.getpid()}
+        record.update(info)
+
+        line = (json.dumps(record) + '\n').encode('utf8')
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self._records[key] = record
+
+
+def order_jobs_by_cost(jobs, costs):
+    """
+    Orders jobs from the most to the least expensive, so that a pool of
+    workers starts the longest jobs first instead of ending the sweep with
+    them (longest processing time first scheduling).
+
+    Args:
+        jobs: List of jobs.
+        costs: List of the estimated cost of each job.
+
+    Returns:
+        A tuple of (jobs, costs), both sorted by decreasing cost.
+    """
+    order = sorted(range(len(jobs)), key=lambda i: costs[i], reverse=True)
+    return [jobs[i] for i in order], [costs[i] for i in order]
+
+
+def estimate_makespan(costs, num_workers=1):
+    """
+    Estimates the cost of a sweep from start to finish, when its jobs are
+    handed in order to the first free worker.
+
+    Args:
+        costs: List of the estimated cost of each job, in the order in which
+            the jobs are run.
+        num_workers: Number of worker processes.
+
+    Returns:
+        The cost at which the last job finishes, in the same unit as `costs`.
+    """
+    loads = [0.] * max(1, num_workers)
+
+    for cost in costs:
+        heapq.heapreplace(loads, loads[0] + cost)
+
+    return max(loads)
+
+
+class SweepProgress(object):
+    """
+    Tracks the progress of a sweep and estimates when it will finish.
+
+    The rate at which the cost of the jobs is processed is measured from the
+    jobs which have already finished. The remaining time is the remaining cost
+    at this rate, but never less than the time a single worker needs for the
+    most expensive remaining job.
+
+    Args:
+        costs: Dict which maps each job to its estimated cost.
+        num_workers: Number of worker processes.
+    """
+
+    def __init__(self, costs, num_workers=1):
+        self.costs = dict(costs)
+        self.num_workers = max(1, num_workers)
+        self.remaining = dict(costs)
+        self.done_cost = 0.
+        self.start_time = time.time()
+
+    def update(self, job):
+        """
+        Records that a job has finished.
+
+        Returns:
+            The estimated number of seconds until the sweep finishes, or
+            None if it cannot be estimated yet.
+        """
+        cost = self.remaining.pop(job, 0.)
+        self.done_cost += cost
+
+        return self.remaining_time()
+
+    def remaining_time(self):
+        elapsed = time.time() - self.start_time
+        if self.done_cost <= 0. or elapsed <= 0.:
+            return None
+
+        if len(self.remaining) == 0:
+            return 0.
+
+        rate = self.done_cost / elapsed
+        remaining_cost = sum(self.remaining.values())
+        largest_cost = max(self.remaining.values())
+
+        return max(remaining_cost / rate, largest_cost / (rate / self.num_workers))
+
+
+def successive_halving(candidates, train_fn, max_epochs, min_epochs, eta=3):
+    """
+    Selects the best of several candidates with successive halving, instead
+    of fully training every one of them.
+
+    Every candidate is first trained for `min_epochs` epochs. Only the best
+    `1 / eta` of them, ranked by training loss, are kept and trained for `eta`
+    times as many epochs, and so on. Once a single candidate remains, it is
+    trained up to `max_epochs`, so that the epochs saved on the discarded
+    candidates go to the survivor.
+
+    Args:
+        candidates: List of candidates, such as numbers of cells.
+        train_fn: Function called as `train_fn(candidate, initial_epoch, epochs)`,
+            which resumes the training of a candidate from `initial_epoch` up
+            to `epochs`, and returns its training loss.
+        max_epochs: Number of epochs the selected candidate is trained for.
+        min_epochs: Number of epochs every candidate is trained for before
+            the first candidates are discarded.
+        eta: Inverse of the fraction of candidates kept at each round.
+
+    Returns:
+        A tuple of (best candidate, losses), where losses is a dict which maps
+        each candidate to its training loss when it was last trained.
+    """
+    survivors = list(candidates)
+    losses = {}
+
+    epochs_done = 0
+    rung_epochs = min(min_epochs, max_epochs)
+
+    while True:
+        for candidate in survivors:
+            losses[candidate] = train_fn(candidate, epochs_done, rung_epochs)
+
+        epochs_done = rung_epochs
+        if len(survivors) == 1 or epochs_done >= max_epochs:
+            break
+
+        survivors = sorted(survivors, key=lambda candidate: losses[candidate])
+        survivors = survivors[:max(1, len(survivors) // eta)]
+
+        print("Successive halving : kept %s after %d epochs" % (str(survivors), epochs_done))
+
+        if len(survivors) == 1:
+            rung_epochs = max_epochs
+        else:
+            rung_epochs = min(rung_epochs * eta, max_epochs)
+
+    best_candidate = min(survivors, key=lambda candidate: losses[candidate])
+    return best_candidate, losses
+
+
+def is_valid_weights_file(weights_path):
+    """
+    Checks whether a file is a complete Keras weight file.
+
+    Args:
+        weights_path: Path to the weight file.
+
+    Returns:
+        True if the file exists and can be read as a Keras weight file.
+    """
+    if not os.path.exists(weights_path):
+        return False
+
+    try:
+        with h5py.File(weights_path, 'r') as f:
+            return 'layer_names' in f.attrs
+    except (IOError, OSError):
+        return False
+
+
+def remove_incomplete_weights(weights_path):
+    """
+    Removes a weight file which may have been left half written by an
+    interrupted job.
+
+    Args:
+        weights_path: Path to the weight file.
+    """
+    if os.path.exists(weights_path):
+        print("Removing weights left by an interrupted job : %s" % weights_path)
+        os.remove(weights_path)
+
+
+def _init_worker(threads_per_worker, num_workers=1, pin_cpus=False, worker_ids=None):
+    """
+    Sets the thread budget and CPUs of a worker process.
+
+    Args:
+        threads_per_worker: Number of threads the worker may use, or None
+            to split the CPUs of the host evenly between the workers.
+        num_workers: Number of workers of the pool.
+        pin_cpus: Whether to pin the worker to its own block of CPUs.
+        worker_ids: Optional shared counter, from which each worker of a pool
+            takes its index.
+    """
+    worker_id = 0
+    if worker_ids is not None:
+        with worker_ids.get_lock():
+            worker_id = worker_ids.value
+            worker_ids.value += 1
+
+    configure_runtime(worker_config(worker_id, num_workers, threads_per_worker, pin_cpus))
+
+    if num_workers > 1 or pin_cpus or threads_per_worker is not None:
+        print("Worker %d runtime : %s" % (worker_id, describe_runtime()))
+
+
+def _run_job(args):
+    """
+    Runs a single job, catching any failure so that it does not stop the
+    remaining jobs.
+
+    Args:
+        args: A tuple of (job_fn, job).
+
+    Returns:
+        A tuple of (job, result, error).
+    """
+    job_fn, job = args
+
+    try:
+        return job, job_fn(*job), None
+    except Exception:
+        return job, None, traceback.format_exc()
+
+
+def _handle_result(job, result, error, callback, results):
+    if error is not None:
+        print("Job %s failed :\n%s" % (str(job), error))
+
+    if callback is not None:
+        callback(job, result, error)
+
+    results.append((job, result, error))